@@ -0,0 +1,88 @@
+"""Micro-benchmark of JSON response decoding.
+
+Compares decoding a response body twice (once by the session to look for
+errors, once by the service) with the memoized ``PyiCloudResponse.json``,
+using the standard ``json`` module and the backend selected at import.
+Payloads are the Find My iPhone and Drive fixtures, scaled up to the size
+of large accounts.
+
+Usage: python -m benchmarks.bench_json
+"""
+
+import json
+import timeit
+
+from requests import Response
+
+from pyicloud.base import PyiCloudResponse
+from pyicloud.utils import json_loads
+from tests.const_drive import DRIVE_ROOT_WORKING
+from tests.const_findmyiphone import FMI_FAMILY_WORKING
+
+SCALE = 100
+NUMBER = 20
+
+
+def payloads():
+    """Returns the benchmarked payloads, by name."""
+    devices = dict(FMI_FAMILY_WORKING)
+    devices["content"] = FMI_FAMILY_WORKING["content"] * SCALE
+    drive = [dict(DRIVE_ROOT_WORKING[0])]
+    drive[0]["items"] = DRIVE_ROOT_WORKING[0]["items"] * SCALE
+    return {
+        "findmyiphone": json.dumps(devices).encode(),
+        "drive": json.dumps(drive).encode(),
+    }
+
+
+def _response(cls, content):
+    response = cls()
+    response.status_code = 200
+    response._content = content  # pylint: disable=protected-access
+    response.encoding = "utf-8"
+    return response
+
+
+def decode_twice(content):
+    """Decoding as done before memoization, with the json module."""
+    response = _response(Response, content)
+    response.json()
+    return response.json()
+
+
+def decode_once_json(content):
+    """Memoized decoding, with the json module."""
+    # pylint: disable=protected-access
+    response = _response(PyiCloudResponse, content)
+    response._json = json.loads(response.content)
+    return response.json()
+
+
+def decode_once(content):
+    """Memoized decoding, with the selected backend."""
+    response = _response(PyiCloudResponse, content)
+    response.json()
+    return response.json()
+
+
+def run():
+    """Runs the benchmark and prints the per-response cost."""
+    backend = getattr(json_loads, "__module__", None) or "orjson"
+    results = {}
+    for payload, content in payloads().items():
+        print("%s (%.1f MB)" % (payload, len(content) / 1e6))
+        for name, func in (
+            ("json, twice", decode_twice),
+            ("json, once", decode_once_json),
+            ("%s, once" % backend, decode_once),
+        ):
+            seconds = min(
+                timeit.repeat(lambda func=func: func(content), number=NUMBER, repeat=3)
+            )
+            results[(payload, name)] = seconds / NUMBER
+            print("  %-16s %10.2f ms/response" % (name, seconds / NUMBER * 1e3))
+    return results
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,75 @@
+"""Micro-benchmark of the per-request logger attribution.
+
+Compares the former ``inspect.stack()`` based call-site lookup with the
+cached resolver used by ``PyiCloudSession.request``.
+
+Usage: python -m benchmarks.bench_request_logger
+"""
+
+import inspect
+import logging
+import timeit
+
+from pyicloud.base import PyiCloudPasswordFilter, PyiCloudSession
+
+STACK_DEPTH = 30
+NUMBER = 2000
+
+
+class _ServiceStub:
+    """Minimal service exposing what the session needs for logging."""
+
+    def __init__(self):
+        self.password_filter = PyiCloudPasswordFilter("password")
+
+
+def legacy_request_logger(session):
+    """Logger attribution as done before the resolver (inspect.stack)."""
+    callee = inspect.stack()[2]
+    module = inspect.getmodule(callee[0])
+    request_logger = logging.getLogger(module.__name__).getChild("http")
+    if session.service.password_filter not in request_logger.filters:
+        request_logger.addFilter(session.service.password_filter)
+    return request_logger
+
+
+def cached_request_logger(session):
+    """Logger attribution through the session resolver."""
+    return session._get_request_logger(2)  # pylint: disable=protected-access
+
+
+def _nested(depth, func, session):
+    """Calls func at the given stack depth, as a deep call site would."""
+    if depth:
+        return _nested(depth - 1, func, session)
+    return _call_site(func, session)
+
+
+def _call_site(func, session):
+    return func(session)
+
+
+def run():
+    """Runs the benchmark and prints the per-call cost of both approaches."""
+    session = PyiCloudSession(_ServiceStub())
+    results = {}
+    for name, func in (
+        ("inspect.stack", legacy_request_logger),
+        ("cached resolver", cached_request_logger),
+    ):
+        seconds = min(
+            timeit.repeat(
+                lambda func=func: _nested(STACK_DEPTH, func, session),
+                number=NUMBER,
+                repeat=3,
+            )
+        )
+        results[name] = seconds / NUMBER
+        print("%-16s %12.2f us/request" % (name, results[name] * 1e6))
+
+    print("speedup: %.0fx" % (results["inspect.stack"] / results["cached resolver"]))
+    return results
+
+
+if __name__ == "__main__":
+    run()
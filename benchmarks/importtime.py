@@ -0,0 +1,86 @@
+"""Import-time benchmark of the command line entry point.
+
+Imports ``pyicloud.cmdline:main`` in fresh interpreters run with
+``python -X importtime`` and reports its cold-start cost, the modules
+costing the most, and which of the heavy optional dependencies got loaded.
+
+Usage: python -m benchmarks.importtime [--repeat 5] [--top 15] [--target pyicloud.cmdline:main]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = (
+    "google.protobuf",
+    "srp",
+    "keyring",
+    "tzlocal",
+    "sqlite3",
+    "pyicloud.services.notes",
+    "pyicloud.services.photos",
+    "pyicloud.services.drive",
+)
+
+
+def import_times(target):
+    """Imports the target in a fresh interpreter.
+
+    Returns {module: (self us, cumulative us)}, in import order.
+    """
+    module, _, attribute = target.partition(":")
+    statement = f"from {module} import {attribute}" if attribute else f"import {module}"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def run(target="pyicloud.cmdline:main", repeat=5, top=15):
+    """Runs the benchmark and prints the report."""
+    module = target.partition(":")[0]
+    runs = [import_times(target) for _ in range(repeat)]
+    totals = [times[module][1] for times in runs]
+
+    print(f"{target}: cumulative import time over {repeat} runs")
+    print(
+        "  min %.1f ms, median %.1f ms"
+        % (min(totals) / 1e3, statistics.median(totals) / 1e3)
+    )
+
+    best = runs[totals.index(min(totals))]
+    print(f"\nTop {top} modules by self time (fastest run):")
+    for name, (self_us, cumulative_us) in sorted(
+        best.items(), key=lambda item: item[1][0], reverse=True
+    )[:top]:
+        print("  %8.1f ms  %8.1f ms  %s" % (self_us / 1e3, cumulative_us / 1e3, name))
+
+    print("\nHeavy modules loaded:")
+    for name in HEAVY_MODULES:
+        print("  %-28s %s" % (name, "yes" if name in best else "no"))
+    return totals
+
+
+def main():
+    """Parses the arguments and runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", default="pyicloud.cmdline:main")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+    run(args.target, args.repeat, args.top)
+
+
+if __name__ == "__main__":
+    main()
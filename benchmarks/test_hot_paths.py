@@ -0,0 +1,193 @@
+"""Benchmarks of the library hot paths, at several synthetic data sizes.
+
+Responses come from a fake session serving pre-encoded JSON bodies, so the
+benchmarks measure the client code and JSON decoding, not the network.
+
+Usage:
+    python -m pytest benchmarks --benchmark-autosave \
+        --benchmark-storage=benchmarks/results
+    python -m pytest benchmarks --benchmark-storage=benchmarks/results \
+        --benchmark-compare --benchmark-compare-fail=mean:10%
+
+Saved runs are named after the commit, so a run compares against the
+results of former versions.
+"""
+import json
+from unittest.mock import Mock, patch
+
+import pytest
+from requests import Response
+
+from pyicloud.base import PyiCloudPasswordFilter, PyiCloudSession
+from pyicloud.services.drive import DriveNode, _date_to_utc
+from pyicloud.services.findmyiphone import FindMyiPhoneServiceManager
+from pyicloud.services.notes import NotesService
+from pyicloud.services.photos import PhotoAlbum, PhotoAsset
+from pyicloud.services.reminders import RemindersService
+from pyicloud.utils import json_loads
+from tests.synthetic import (
+    SyntheticPhotos,
+    drive_tree,
+    find_my_devices,
+    note_records,
+    reminders,
+)
+
+pytest.importorskip("pytest_benchmark")
+
+SIZES = {"small": 10, "medium": 100, "large": 1000}
+
+
+class _Response:
+    """Response decoding a JSON body."""
+
+    def __init__(self, content):
+        self.content = content
+        self.ok = True  # pylint: disable=invalid-name
+
+    def json(self):
+        """Returns the decoded body."""
+        return json_loads(self.content)
+
+
+class _Session:
+    """Session answering requests with pre-encoded JSON bodies.
+
+    `bodies` maps an URL part to the bodies of its successive requests.
+    """
+
+    def __init__(self, bodies):
+        self.bodies = {
+            path: [json.dumps(body).encode() for body in path_bodies]
+            for path, path_bodies in bodies.items()
+        }
+        self.calls = {path: 0 for path in bodies}
+        self.service = Mock()
+        self.service.data = {"dsInfo": {"dsid": "1234"}}
+
+    def request(self, url):
+        """Returns the next response to an URL."""
+        for path, bodies in self.bodies.items():
+            if path in url:
+                index = self.calls[path] % len(bodies)
+                self.calls[path] += 1
+                return _Response(bodies[index])
+        raise KeyError(url)
+
+    def get(self, url, **kwargs):  # pylint: disable=unused-argument
+        """Returns the next response to an URL."""
+        return self.request(url)
+
+    def post(self, url, **kwargs):  # pylint: disable=unused-argument
+        """Returns the next response to an URL."""
+        return self.request(url)
+
+
+@pytest.fixture(params=list(SIZES), name="size")
+def fixture_size(request):
+    """Returns the number of items of the synthetic data."""
+    return SIZES[request.param]
+
+
+def test_session_request(benchmark, size):
+    """PyiCloudSession.request, for a response listing `size` devices."""
+    service = Mock()
+    service.password_filter = PyiCloudPasswordFilter("secret")
+    service.session_data = {}
+    session = PyiCloudSession(service)
+    content = json.dumps(find_my_devices(0, size)).encode()
+
+    def send(*args, **kwargs):  # pylint: disable=unused-argument
+        # pylint: disable=protected-access
+        response = Response()
+        response.status_code = 200
+        response.headers["Content-Type"] = "application/json"
+        response._content = content
+        response._content_consumed = True
+        return response
+
+    with patch("requests.Session.request", side_effect=send):
+        benchmark(lambda: session.get("https://p01-fmipweb.icloud.com/").json())
+
+
+def test_album_page(benchmark, size):
+    """PhotoAlbum page processing, for a page of `size` photos."""
+    album = PhotoAlbum(Mock(), "All Photos", "list_type", "obj_type", "ASCENDING")
+    records = []
+    for master, asset in SyntheticPhotos(size)[:]:
+        records.extend((asset, master))
+    content = json.dumps({"records": records}).encode()
+
+    # pylint: disable=protected-access
+    photos = benchmark(lambda: album._page_photos(json_loads(content)))
+    assert len(photos) == size
+
+
+def test_asset_versions(benchmark, size):
+    """PhotoAsset.versions, for `size` photos."""
+    records = SyntheticPhotos(size)[:]
+
+    def versions():
+        return [PhotoAsset(None, master, asset).versions for master, asset in records]
+
+    assert len(benchmark(versions)) == size
+
+
+def test_notes_refresh(benchmark, size):
+    """NotesService.refresh, decoding `size` notes."""
+    records = note_records(0, size, folders=5)
+    stubs = [
+        {"recordName": record["recordName"], "recordType": record["recordType"]}
+        for record in records
+    ]
+    session = _Session(
+        {
+            "changes/zone": [{"zones": [{"records": stubs, "moreComing": False}]}],
+            "records/lookup": [
+                {"records": records[index : index + 50]}
+                for index in range(0, len(records), 50)
+            ],
+        }
+    )
+    service = NotesService("https://p01-ckdatabasews.icloud.com", session, {})
+
+    benchmark(service.refresh)
+    assert len(service.notes) == size
+
+
+def test_drive_children(benchmark, size):
+    """DriveNode.get_children and get, in a folder of `size` items."""
+    nodes, _ = drive_tree(0, depth=1, folders=size // 2, files=size // 2)
+    data = nodes["FOLDER::com.apple.CloudDocs::root"]
+    last = "File %d.txt" % (size // 2 - 1)
+
+    def children():
+        node = DriveNode(None, dict(data))
+        node.get_children()
+        return node.get(last)
+
+    assert benchmark(children).name == last
+
+
+def test_date_to_utc(benchmark, size):
+    """_date_to_utc, for `size` dates with and without offset."""
+    dates = ["2020-05-02T17:16:17-07:00", "2020-05-03T00:15:17Z"] * (size // 2)
+    benchmark(lambda: [_date_to_utc(date) for date in dates])
+
+
+def test_find_my_refresh(benchmark, size):
+    """FindMyiPhoneServiceManager.refresh_client, for `size` devices."""
+    session = _Session({"refreshClient": [find_my_devices(0, size)]})
+    manager = FindMyiPhoneServiceManager("https://p01-fmipweb.icloud.com", session, {})
+
+    benchmark(manager.refresh_client)
+    assert len(manager.keys()) == size
+
+
+def test_reminders_refresh(benchmark, size):
+    """RemindersService.refresh grouping, for `size` x 10 reminders."""
+    session = _Session({"rd/startup": [reminders(0, 10, size * 10)]})
+    service = RemindersService("https://p01-remindersws.icloud.com", session, {})
+
+    benchmark(service.refresh)
+    assert sum(len(items) for items in service.lists.values()) == size * 10
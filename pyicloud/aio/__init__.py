@@ -0,0 +1,16 @@
+"""Asyncio pyiCloud client.
+
+Requires aiohttp, installed with the "aio" extra: pip install pyicloud[aio]
+"""
+try:
+    import aiohttp  # noqa: F401 pylint: disable=unused-import
+except ImportError as error:  # pragma: no cover
+    raise ImportError(
+        "pyicloud.aio requires aiohttp, install it with: pip install pyicloud[aio]"
+    ) from error
+
+from pyicloud.aio.base import (
+    AsyncPyiCloudService,
+    AsyncPyiCloudSession,
+    get_http_session,
+)
@@ -0,0 +1,470 @@
+"""Asyncio library base file."""
+import asyncio
+from email.message import Message
+from functools import partial
+import logging
+import time
+from types import SimpleNamespace
+import weakref
+
+import aiohttp
+from requests.cookies import MockRequest, MockResponse, get_cookie_header
+
+from pyicloud.aio.services import (
+    AsyncCalendarService,
+    AsyncContactsService,
+    AsyncDriveService,
+    AsyncFindMyiPhoneServiceManager,
+    AsyncNotesService,
+    AsyncPhotosService,
+)
+from pyicloud.base import (
+    HEADER_DATA,
+    PyiCloudService,
+    PyiCloudSession,
+    get_response_error,
+)
+from pyicloud.exceptions import (
+    PyiCloudAPIResponseException,
+    PyiCloudDeadlineExceededException,
+)
+from pyicloud.timeouts import bounded_timeout, remaining
+from pyicloud.utils import json_loads
+
+
+JSON_MIMETYPES = ["application/json", "text/json"]
+
+_HTTP_SESSIONS = weakref.WeakKeyDictionary()
+
+
+def get_http_session(limit=100, limit_per_host=0):
+    """Returns the aiohttp session shared by the clients of the running loop.
+
+    It owns a single connection pool, so one event loop can drive many
+    accounts over the same connections. It does not keep cookies: each
+    account keeps them in its own cookie jar.
+    """
+    loop = asyncio.get_running_loop()
+    http_session = _HTTP_SESSIONS.get(loop)
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host),
+            cookie_jar=aiohttp.DummyCookieJar(),
+        )
+        _HTTP_SESSIONS[loop] = http_session
+    return http_session
+
+
+def _encode_params(params):
+    """Converts query parameters the way requests does (aiohttp rejects bools)."""
+    if not params:
+        return None
+    return {
+        key: str(value) if isinstance(value, (bool, int, float)) else value
+        for key, value in params.items()
+    }
+
+
+def _client_timeout(timeout):
+    """Converts a requests (connect, read) timeout to the aiohttp one."""
+    if not isinstance(timeout, tuple):
+        timeout = (timeout, timeout)
+    connect, read = timeout
+    return aiohttp.ClientTimeout(
+        total=remaining(), sock_connect=connect, sock_read=read
+    )
+
+
+class AsyncPyiCloudSession:
+    """Asyncio iCloud session.
+
+    Requests go through an aiohttp session, by default the one shared by
+    all the clients of the event loop. Cookies and session data are those
+    of the account's `PyiCloudService`, so they are persisted the same way,
+    by the writer thread of its session rather than on the event loop.
+    """
+
+    def __init__(self, service, http_session=None):
+        self.service = service
+        self.http_session = http_session
+        self.headers = dict(service.sync_service.session.headers)
+        self.verify = service.sync_service.session.verify
+
+    _raise_error = PyiCloudSession._raise_error
+
+    @property
+    def cookies(self):
+        """Gets the account cookie jar."""
+        return self.service.sync_service.session.cookies
+
+    async def request(
+        self,
+        method,
+        url,
+        params=None,
+        data=None,
+        headers=None,
+        stream=False,
+    ):
+        """Makes a request.
+
+        The body of JSON responses is read and checked for errors. Other
+        responses, and all of them when `stream` is set, are returned
+        unread and must be released by the caller. Failures are retried
+        following the retry policy of the synchronous session, and its
+        timeout policy applies.
+        """
+        request_headers = dict(self.headers)
+        request_headers.update(headers or {})
+        sync_session = self.service.sync_service.session
+        # pylint: disable=protected-access
+        request_logger = sync_session._get_request_logger(2)
+        retry = sync_session.get_retry_policy(url).start()
+
+        while True:
+            generation = sync_session.auth_generation
+            failures = sync_session.auth_failures
+            cookie_request = SimpleNamespace(url=url, headers=dict(request_headers))
+            cookie_header = get_cookie_header(self.cookies, cookie_request)
+            if cookie_header:
+                cookie_request.headers["Cookie"] = cookie_header
+
+            if request_logger.isEnabledFor(logging.DEBUG):
+                request_logger.debug(
+                    "%s %s %s", method, url, sync_session._log_payload(data or "")
+                )
+
+            if sync_session.rate_limiter is not None:
+                delay = sync_session.rate_limiter.reserve(
+                    sync_session.webservice_key(url)
+                )
+                if delay:
+                    await asyncio.sleep(delay)
+
+            timeout = bounded_timeout(sync_session.get_timeout(url, stream))
+            http_session = self.http_session or get_http_session()
+            started = time.perf_counter()
+            try:
+                response = await http_session.request(
+                    method,
+                    url,
+                    params=_encode_params(params),
+                    data=data,
+                    headers=cookie_request.headers,
+                    ssl=None if self.verify else False,
+                    timeout=_client_timeout(timeout),
+                )
+            except asyncio.TimeoutError as error:
+                self._record(url, None, started)
+                left = remaining()
+                if left is not None and left <= 0:
+                    raise PyiCloudDeadlineExceededException() from error
+                raise
+            except aiohttp.ClientError:
+                self._record(url, None, started)
+                raise
+            self._record(url, response, started, data)
+
+            self._update_session(response, cookie_request)
+
+            content_type = response.headers.get("Content-Type", "").split(";")[0]
+
+            if response.status in [401, 421]:
+                # pylint: disable=protected-access
+                retry_url = await self.service._run_sync(
+                    sync_session._revalidate, url, generation
+                )
+                if retry_url is not None:
+                    response.release()
+                    url = retry_url
+                    continue
+
+            if response.status >= 400 and retry.should_retry(
+                status=response.status,
+                retry_after=response.headers.get("Retry-After"),
+            ):
+                response.release()
+                # pylint: disable=protected-access
+                if response.status in [421, 450, 500] and sync_session._is_findme(url):
+                    # Handle re-authentication for Find My iPhone
+                    request_logger.debug("Re-authenticating Find My iPhone service")
+                    try:
+                        # If 450, authentication requires a full sign in to the account
+                        service = None if response.status == 450 else "find"
+                        await self.service.reauthenticate(generation, service, failures)
+                    except PyiCloudAPIResponseException:
+                        request_logger.debug("Re-authentication failed")
+                else:
+                    api_error = PyiCloudAPIResponseException(
+                        response.reason, response.status, retry=True
+                    )
+                    request_logger.debug(
+                        "%s, retrying in %.2fs", api_error, retry.next_delay
+                    )
+                sync_session._record_retry(url)  # pylint: disable=protected-access
+                await asyncio.sleep(retry.next_delay)
+                continue
+
+            if response.status >= 400 and (
+                content_type not in JSON_MIMETYPES or response.status in [421, 450, 500]
+            ):
+                response.release()
+                self._raise_error(response.status, response.reason)
+
+            if stream or content_type not in JSON_MIMETYPES:
+                return response
+
+            body = await response.read()
+            try:
+                data_json = json_loads(body)
+            except ValueError:
+                request_logger.warning("Failed to parse response with JSON mimetype")
+                return response
+            if request_logger.isEnabledFor(logging.DEBUG):
+                request_logger.debug("%s", sync_session._log_payload(data_json))
+            # Decoded once, for the services
+            response.pyicloud_json = data_json
+
+            code, reason = get_response_error(data_json)
+            if reason and retry.should_retry(
+                error_code=code, retry_after=response.headers.get("Retry-After")
+            ):
+                request_logger.debug(
+                    "%s (%s), retrying in %.2fs", reason, code, retry.next_delay
+                )
+                sync_session._record_retry(url)  # pylint: disable=protected-access
+                await asyncio.sleep(retry.next_delay)
+                continue
+            if reason:
+                self._raise_error(code, reason)
+
+            return response
+
+    async def get(self, url, **kwargs):
+        """Makes a GET request."""
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        """Makes a POST request."""
+        return await self.request("POST", url, **kwargs)
+
+    def _record(self, url, response, started, data=None):
+        """Records the metrics of a request, up to its response headers."""
+        metrics = self.service.sync_service.session.metrics
+        if metrics is None:
+            return
+        # pylint: disable=protected-access
+        webservice, path = self.service.sync_service.session._metrics_endpoint(url)
+        if response is None:
+            metrics.record(webservice, path, None, time.perf_counter() - started)
+            return
+        metrics.record(
+            webservice,
+            path,
+            response.status,
+            time.perf_counter() - started,
+            bytes_in=response.content_length or 0,
+            bytes_out=len(data) if isinstance(data, (str, bytes)) else 0,
+        )
+
+    def _update_session(self, response, cookie_request):
+        """Stores the session headers and cookies of a response."""
+        session_data = self.service.session_data
+        session_changed = False
+        for header, value in HEADER_DATA.items():
+            header_value = response.headers.get(header)
+            if header_value and session_data.get(value) != header_value:
+                session_data[value] = header_value
+                session_changed = True
+
+        writer = self.service.sync_service.session.writer
+        cookies_changed = False
+        for resp in response.history + (response,):
+            set_cookies = resp.headers.getall("Set-Cookie", [])
+            if not set_cookies:
+                continue
+            message = Message()
+            for set_cookie in set_cookies:
+                message["Set-Cookie"] = set_cookie
+            mock_response = MockResponse(message)
+            mock_request = MockRequest(cookie_request)
+            cookies_changed = cookies_changed or writer.cookies_changed(
+                self.cookies.make_cookies(mock_response, mock_request)
+            )
+            self.cookies.extract_cookies(mock_response, mock_request)
+
+        # Written by the writer thread: the store is not read on the loop
+        writer.mark_dirty(
+            session_data=session_changed, cookies=cookies_changed, defer=True
+        )
+
+
+class AsyncPyiCloudService:
+    """Asyncio counterpart of `PyiCloudService`.
+
+    Authentication is rare, so it runs the blocking `PyiCloudService` in
+    an executor; every service request is then made natively with aiohttp.
+
+    Usage:
+        from pyicloud.aio import AsyncPyiCloudService
+        api = await AsyncPyiCloudService.create('username@apple.com', 'password')
+        devices = await api.devices()
+    """
+
+    def __init__(self, sync_service, http_session=None):
+        self.sync_service = sync_service
+        self.session = AsyncPyiCloudSession(self, http_session)
+
+        self._drive = None
+        self._photos = None
+
+    @classmethod
+    async def create(cls, apple_id, password=None, http_session=None, **kwargs):
+        """Authenticates an account and returns its asyncio service.
+
+        Keyword arguments are those of `PyiCloudService`.
+        """
+        loop = asyncio.get_running_loop()
+        sync_service = await loop.run_in_executor(
+            None, partial(PyiCloudService, apple_id, password, **kwargs)
+        )
+        return cls(sync_service, http_session)
+
+    async def _run_sync(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(func, *args))
+
+    async def authenticate(self, force_refresh=False, service=None):
+        """Handles authentication, see `PyiCloudService.authenticate`."""
+        await self._run_sync(self.sync_service.authenticate, force_refresh, service)
+
+    async def reauthenticate(self, generation, service=None, failures=None):
+        """Authenticates again once for the requests sent at `generation`.
+
+        See `PyiCloudSession.reauthenticate`.
+        """
+        await self._run_sync(
+            self.sync_service.session.reauthenticate, generation, service, failures
+        )
+
+    async def validate_2fa_code(self, code):
+        """Verifies a verification code received via Apple's 2FA system (HSA2)."""
+        return await self._run_sync(self.sync_service.validate_2fa_code, code)
+
+    async def trust_session(self):
+        """Request session trust to avoid user log in going forward."""
+        return await self._run_sync(self.sync_service.trust_session)
+
+    async def close(self):
+        """Writes pending session changes.
+
+        The shared aiohttp session is left open for the other accounts.
+        """
+        await self._run_sync(self.sync_service.session.writer.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def user(self):
+        """Gets the account user."""
+        return self.sync_service.user
+
+    @property
+    def data(self):
+        """Gets the account data returned at login."""
+        return self.sync_service.data
+
+    @property
+    def params(self):
+        """Gets the account request parameters."""
+        return self.sync_service.params
+
+    @property
+    def session_data(self):
+        """Gets the account session data."""
+        return self.sync_service.session_data
+
+    @property
+    def requires_2sa(self):
+        """Returns True if two-step authentication is required."""
+        return self.sync_service.requires_2sa
+
+    @property
+    def requires_2fa(self):
+        """Returns True if two-factor authentication is required."""
+        return self.sync_service.requires_2fa
+
+    @property
+    def is_trusted_session(self):
+        """Returns True if the session is trusted."""
+        return self.sync_service.is_trusted_session
+
+    @property
+    def _webservices(self):
+        return self.sync_service._webservices  # pylint: disable=protected-access
+
+    def _get_webservice_url(self, ws_key):
+        # pylint: disable=protected-access
+        return self.sync_service._get_webservice_url(ws_key)
+
+    async def devices(self):
+        """Returns all devices."""
+        service = AsyncFindMyiPhoneServiceManager(
+            self._get_webservice_url("findme"),
+            self.session,
+            self.params,
+            self.sync_service.with_family,
+        )
+        await service.refresh_client()
+        return service
+
+    async def photos(self):
+        """Gets the 'Photo' service."""
+        if not self._photos:
+            service = AsyncPhotosService(
+                self._get_webservice_url("ckdatabasews"), self.session, self.params
+            )
+            await service.check_indexing_state()
+            self._photos = service
+        return self._photos
+
+    async def drive(self):
+        """Gets the 'Drive' service."""
+        if not self._drive:
+            self._drive = AsyncDriveService(
+                service_root=self._get_webservice_url("drivews"),
+                document_root=self._get_webservice_url("docws"),
+                session=self.session,
+                params=self.params,
+            )
+        return self._drive
+
+    async def notes(self):
+        """Gets the 'Notes' service."""
+        service = AsyncNotesService(
+            self._get_webservice_url("ckdatabasews"), self.session, self.params
+        )
+        await service.refresh()
+        return service
+
+    async def calendar(self):
+        """Gets the 'Calendar' service."""
+        return AsyncCalendarService(
+            self._get_webservice_url("calendar"), self.session, self.params
+        )
+
+    async def contacts(self):
+        """Gets the 'Contacts' service."""
+        return AsyncContactsService(
+            self._get_webservice_url("contacts"), self.session, self.params
+        )
+
+    def __str__(self):
+        return f"iCloud async API: {self.user.get('apple_id')}"
+
+    def __repr__(self):
+        return f"<{self}>"
@@ -0,0 +1,615 @@
+"""Asyncio services."""
+from calendar import monthrange
+from datetime import datetime
+from functools import reduce
+import json
+import logging
+from urllib.parse import urlencode
+
+from tzlocal import get_localzone_name
+
+from pyicloud.exceptions import (
+    PyiCloudAPIResponseException,
+    PyiCloudNoDevicesException,
+    PyiCloudServiceNotActivatedException,
+)
+from pyicloud.services.drive import DriveNode
+from pyicloud.services.findmyiphone import AppleDevice
+from pyicloud.services.notes import (
+    NotesService,
+    _changes_zone_body,
+    _lookup_body,
+    _resolve_record,
+)
+from pyicloud.services.photos import PhotoAlbum, PhotoAsset, PhotosService
+from pyicloud.utils import json_loads
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+async def _json(response):
+    """Returns the JSON body of a response, decoded once by the session."""
+    data = getattr(response, "pyicloud_json", None)
+    if data is None:
+        data = await response.json(content_type=None, loads=json_loads)
+    return data
+
+
+class AsyncFindMyiPhoneServiceManager:
+    """Asyncio 'Find my iPhone' iCloud service."""
+
+    def __init__(self, service_root, session, params, with_family=False):
+        self.session = session
+        self.params = params
+        self.with_family = with_family
+
+        fmip_endpoint = "%s/fmipservice/client/web" % service_root
+        self._fmip_refresh_url = "%s/refreshClient" % fmip_endpoint
+        self._fmip_sound_url = "%s/playSound" % fmip_endpoint
+        self._fmip_message_url = "%s/sendMessage" % fmip_endpoint
+        self._fmip_lost_url = "%s/lostDevice" % fmip_endpoint
+
+        self.response = {}
+        self._devices = {}
+
+    async def refresh_client(self):
+        """Refreshes the FindMyiPhoneService endpoint,
+
+        This ensures that the location data is up-to-date.
+
+        """
+        req = await self.session.post(
+            self._fmip_refresh_url,
+            params=self.params,
+            data=json.dumps(
+                {
+                    "clientContext": {
+                        "fmly": self.with_family,
+                        "shouldLocate": True,
+                        "selectedDevice": "all",
+                        "deviceListVersion": 1,
+                    }
+                }
+            ),
+        )
+        self.response = await _json(req)
+
+        for device_info in self.response["content"]:
+            device_id = device_info["id"]
+            if device_id not in self._devices:
+                self._devices[device_id] = AsyncAppleDevice(
+                    device_info,
+                    self.session,
+                    self.params,
+                    manager=self,
+                    sound_url=self._fmip_sound_url,
+                    lost_url=self._fmip_lost_url,
+                    message_url=self._fmip_message_url,
+                )
+            else:
+                self._devices[device_id].update(device_info)
+
+        if not self._devices:
+            raise PyiCloudNoDevicesException()
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            key = list(self.keys())[key]
+        return self._devices[key]
+
+    def __getattr__(self, attr):
+        return getattr(self._devices, attr)
+
+    def __str__(self):
+        return f"{self._devices}"
+
+    def __repr__(self):
+        return f"{self}"
+
+
+class AsyncAppleDevice(AppleDevice):
+    """Apple device of the asyncio 'Find my iPhone' service."""
+
+    async def location(self):
+        """Updates the device location."""
+        await self.manager.refresh_client()
+        return self.content["location"]
+
+    async def status(self, additional=None):
+        """Returns status information for device.
+
+        This returns only a subset of possible properties.
+        """
+        await self.manager.refresh_client()
+        fields = ["batteryLevel", "deviceDisplayName", "deviceStatus", "name"]
+        fields += additional or []
+        return {field: self.content.get(field) for field in fields}
+
+    async def play_sound(self, subject="Find My iPhone Alert"):
+        """Send a request to the device to play a sound."""
+        data = json.dumps(
+            {
+                "device": self.content["id"],
+                "subject": subject,
+                "clientContext": {"fmly": True},
+            }
+        )
+        await self.session.post(self.sound_url, params=self.params, data=data)
+
+    async def display_message(
+        self, subject="Find My iPhone Alert", message="This is a note", sounds=False
+    ):
+        """Send a request to the device to display a message."""
+        data = json.dumps(
+            {
+                "device": self.content["id"],
+                "subject": subject,
+                "sound": sounds,
+                "userText": True,
+                "text": message,
+            }
+        )
+        await self.session.post(self.message_url, params=self.params, data=data)
+
+    async def lost_device(
+        self, number, text="This iPhone has been lost. Please call me.", newpasscode=""
+    ):
+        """Send a request to the device to trigger 'lost mode'."""
+        data = json.dumps(
+            {
+                "text": text,
+                "userText": True,
+                "ownerNbr": number,
+                "lostModeEnabled": True,
+                "trackingEnabled": True,
+                "device": self.content["id"],
+                "passcode": newpasscode,
+            }
+        )
+        await self.session.post(self.lost_url, params=self.params, data=data)
+
+    def __repr__(self):
+        return f"<AsyncAppleDevice({self})>"
+
+
+class AsyncPhotosService:
+    """Asyncio 'Photos' iCloud service."""
+
+    SMART_FOLDERS = PhotosService.SMART_FOLDERS
+
+    def __init__(self, service_root, session, params):
+        self.session = session
+        self.params = dict(params)
+        self._service_root = service_root
+        self.service_endpoint = (
+            "%s/database/1/com.apple.photos.cloud/production/private"
+            % self._service_root
+        )
+
+        self._albums = None
+
+        self.params.update({"remapEnums": True, "getCurrentSyncToken": True})
+
+    async def check_indexing_state(self):
+        """Raises if the photo library is still being indexed."""
+        url = f"{self.service_endpoint}/records/query?{urlencode(self.params)}"
+        json_data = (
+            '{"query":{"recordType":"CheckIndexingState"},'
+            '"zoneID":{"zoneName":"PrimarySync"}}'
+        )
+        request = await self.session.post(
+            url, data=json_data, headers={"Content-type": "text/plain"}
+        )
+        response = await _json(request)
+        indexing_state = response["records"][0]["fields"]["state"]["value"]
+        if indexing_state != "FINISHED":
+            raise PyiCloudServiceNotActivatedException(
+                "iCloud Photo Library not finished indexing. "
+                "Please try again in a few minutes."
+            )
+
+    async def albums(self):
+        """Returns photo albums."""
+        if not self._albums:
+            albums = {
+                name: AsyncPhotoAlbum(self, name, **props)
+                for (name, props) in self.SMART_FOLDERS.items()
+            }
+
+            for folder in await self._fetch_folders():
+                # Skiping albums having null name, that can happen sometime
+                if "albumNameEnc" not in folder["fields"]:
+                    continue
+
+                if folder["recordName"] == "----Root-Folder----" or (
+                    folder["fields"].get("isDeleted")
+                    and folder["fields"]["isDeleted"]["value"]
+                ):
+                    continue
+
+                album = AsyncPhotoAlbum.from_folder(self, folder)
+                albums[album.name] = album
+
+            self._albums = albums
+
+        return self._albums
+
+    async def _fetch_folders(self):
+        url = f"{self.service_endpoint}/records/query?{urlencode(self.params)}"
+        json_data = (
+            '{"query":{"recordType":"CPLAlbumByPositionLive"},'
+            '"zoneID":{"zoneName":"PrimarySync"}}'
+        )
+
+        request = await self.session.post(
+            url, data=json_data, headers={"Content-type": "text/plain"}
+        )
+        response = await _json(request)
+
+        return response["records"]
+
+    async def all(self):
+        """Returns all photos."""
+        return (await self.albums())["All Photos"]
+
+
+class AsyncPhotoAlbum(PhotoAlbum):
+    """A photo album of the asyncio 'Photos' service.
+
+    Iterate it with `async for`, and get its size with `await count()`.
+    """
+
+    async def count(self):
+        """Returns the number of photos of the album."""
+        if self._len is None:
+            request = await self.service.session.post(
+                self._count_query_url(),
+                data=json.dumps(self._count_query_gen()),
+                headers={"Content-type": "text/plain"},
+            )
+            response = await _json(request)
+
+            self._len = response["batch"][0]["records"][0]["fields"]["itemCount"][
+                "value"
+            ]
+
+        return self._len
+
+    def __len__(self):
+        if self._len is None:
+            raise TypeError("Album size unknown, use 'await album.count()'")
+        return self._len
+
+    def __iter__(self):
+        raise TypeError("Use 'async for' to iterate over an asyncio album")
+
+    def __aiter__(self):
+        return self.photos
+
+    @property
+    async def photos(self):
+        """Returns the album photos."""
+        if self.direction == "DESCENDING":
+            offset = await self.count() - 1
+        else:
+            offset = 0
+
+        while True:
+            request = await self.service.session.post(
+                self._list_query_url(),
+                data=json.dumps(
+                    self._list_query_gen(
+                        offset, self.list_type, self.direction, self.query_filter
+                    )
+                ),
+                headers={"Content-type": "text/plain"},
+            )
+            response = await _json(request)
+
+            photos = self._page_photos(response)
+            if not photos:
+                break
+
+            if self.direction == "DESCENDING":
+                offset = offset - len(photos)
+            else:
+                offset = offset + len(photos)
+
+            for photo in photos:
+                yield photo
+
+    def _make_photo(self, master_record, asset_record):
+        return AsyncPhotoAsset(self.service, master_record, asset_record)
+
+
+class AsyncPhotoAsset(PhotoAsset):
+    """A photo of the asyncio 'Photos' service."""
+
+    async def download(self, version="original", **kwargs):
+        """Returns the unread response of the photo file.
+
+        The caller must release it, e.g. with `async with`.
+        """
+        if version not in self.versions:
+            return None
+
+        return await self._service.session.get(
+            self.versions[version]["url"], stream=True, **kwargs
+        )
+
+    async def delete(self):
+        """Deletes the photo."""
+        url, json_data = self._delete_request()
+        return await self._service.session.post(
+            url, data=json_data, headers={"Content-type": "text/plain"}
+        )
+
+
+class AsyncDriveService:
+    """Asyncio 'Drive' iCloud service."""
+
+    def __init__(self, service_root, document_root, session, params):
+        self._service_root = service_root
+        self._document_root = document_root
+        self.session = session
+        self.params = dict(params)
+        self._root = None
+
+    async def get_node_data(self, node_id):
+        """Returns the node data."""
+        request = await self.session.post(
+            self._service_root + "/retrieveItemDetailsInFolders",
+            params=self.params,
+            data=json.dumps(
+                [
+                    {
+                        "drivewsid": "FOLDER::com.apple.CloudDocs::%s" % node_id,
+                        "partialData": False,
+                    }
+                ]
+            ),
+        )
+        self._raise_if_error(request)
+        return (await _json(request))[0]
+
+    async def get_file(self, file_id, **kwargs):
+        """Returns the unread response of an iCloud Drive file."""
+        file_params = dict(self.params)
+        file_params.update({"document_id": file_id})
+        response = await self.session.get(
+            self._document_root + "/ws/com.apple.CloudDocs/download/by_id",
+            params=file_params,
+        )
+        self._raise_if_error(response)
+        response_json = await _json(response)
+        package_token = response_json.get("package_token")
+        data_token = response_json.get("data_token")
+        if data_token and data_token.get("url"):
+            return await self.session.get(
+                data_token["url"], params=self.params, stream=True, **kwargs
+            )
+        if package_token and package_token.get("url"):
+            return await self.session.get(
+                package_token["url"], params=self.params, stream=True, **kwargs
+            )
+        raise KeyError("'data_token' nor 'package_token'")
+
+    async def get_app_data(self):
+        """Returns the app library (previously ubiquity)."""
+        request = await self.session.get(
+            self._service_root + "/retrieveAppLibraries", params=self.params
+        )
+        self._raise_if_error(request)
+        return (await _json(request))["items"]
+
+    async def root(self):
+        """Returns the root node."""
+        if not self._root:
+            self._root = AsyncDriveNode(self, await self.get_node_data("root"))
+        return self._root
+
+    def _raise_if_error(self, response):  # pylint: disable=no-self-use
+        if response.status >= 400:
+            api_error = PyiCloudAPIResponseException(response.reason, response.status)
+            LOGGER.error(api_error)
+            raise api_error
+
+
+class AsyncDriveNode(DriveNode):
+    """Drive node of the asyncio 'Drive' service."""
+
+    async def get_children(self):
+        """Gets the node children."""
+        if not self._children:
+            if "items" not in self.data:
+                self.data.update(
+                    await self.connection.get_node_data(self.data["docwsid"])
+                )
+            if "items" not in self.data:
+                raise KeyError("No items in folder, status: %s" % self.data["status"])
+            self._children = [
+                AsyncDriveNode(self.connection, item_data)
+                for item_data in self.data["items"]
+            ]
+        return self._children
+
+    async def open(self, **kwargs):
+        """Gets the unread response of the node file."""
+        return await self.connection.get_file(self.data["docwsid"], **kwargs)
+
+    async def dir(self):
+        """Gets the node list of directories."""
+        if self.type == "file":
+            return None
+        return [child.name for child in await self.get_children()]
+
+    async def get(self, name):
+        """Gets the node child."""
+        if self.type == "file":
+            return None
+        for child in await self.get_children():
+            if child.name == name:
+                return child
+        raise KeyError(f"No child named '{name}' exists")
+
+    def __getitem__(self, key):
+        raise TypeError("Use 'await node.get(name)' on asyncio drive nodes")
+
+
+class AsyncNotesService(NotesService):
+    """Asyncio 'Notes' iCloud service.
+
+    Records are fetched by `await refresh()`.
+    """
+
+    def __init__(self, service_root, session, params):
+        # pylint: disable=super-init-not-called
+        self.session = session
+        self._params = params
+        self._service_root = service_root
+        self.service_endpoint = (
+            f"{self._service_root}/database/1/com.apple.notes/production/private"
+        )
+
+        self.records = []
+
+    async def refresh(self):
+        """Fetches and decodes the notes and folders."""
+        dsid = self.session.service.data["dsInfo"]["dsid"]
+
+        url = f"{self.service_endpoint}/changes/zone?{urlencode({'dsid': dsid})}"
+        records = []
+        sync_token = None
+        while True:
+            request = await self.session.post(
+                url,
+                data=_changes_zone_body(sync_token),
+                headers={"Content-type": "text/plain"},
+            )
+            zone = (await _json(request))["zones"][0]
+            records += zone.get("records", [])
+            if not zone.get("moreComing"):
+                break
+            sync_token = zone.get("syncToken")
+
+        params = {"remapEnums": True, "dsid": dsid}
+        url = f"{self.service_endpoint}/records/lookup?{urlencode(params)}"
+
+        resolved_records = []
+        for i in range(0, len(records), 50):
+            request = await self.session.post(
+                url,
+                data=_lookup_body(records[i : i + 50]),
+                headers={"Content-type": "text/plain"},
+            )
+            resolved_records.extend(
+                reduce(_resolve_record, (await _json(request))["records"], [])
+            )
+
+        self.records = resolved_records
+
+
+class AsyncCalendarService:
+    """Asyncio 'Calendar' iCloud service."""
+
+    def __init__(self, service_root, session, params):
+        self.session = session
+        self.params = params
+        self._service_root = service_root
+        self._calendar_endpoint = "%s/ca" % self._service_root
+        self._calendar_refresh_url = "%s/events" % self._calendar_endpoint
+        self._calendar_event_detail_url = f"{self._calendar_endpoint}/eventdetail"
+        self._calendars = "%s/startup" % self._calendar_endpoint
+
+        self.response = {}
+
+    def _month_params(self, from_dt=None, to_dt=None):
+        today = datetime.today()
+        if not from_dt:
+            from_dt = datetime(today.year, today.month, 1)
+        if not to_dt:
+            last_day = monthrange(today.year, today.month)[1]
+            to_dt = datetime(today.year, today.month, last_day)
+        params = dict(self.params)
+        params.update(
+            {
+                "lang": "en-us",
+                "usertz": get_localzone_name(),
+                "startDate": from_dt.strftime("%Y-%m-%d"),
+                "endDate": to_dt.strftime("%Y-%m-%d"),
+            }
+        )
+        return params
+
+    async def get_event_detail(self, pguid, guid):
+        """Fetches a single event's details."""
+        params = dict(self.params)
+        params.update({"lang": "en-us", "usertz": get_localzone_name()})
+        url = f"{self._calendar_event_detail_url}/{pguid}/{guid}"
+        req = await self.session.get(url, params=params)
+        self.response = await _json(req)
+        return self.response["Event"][0]
+
+    async def refresh_client(self, from_dt=None, to_dt=None):
+        """Refreshes the events of a date range, by default this month."""
+        req = await self.session.get(
+            self._calendar_refresh_url, params=self._month_params(from_dt, to_dt)
+        )
+        self.response = await _json(req)
+
+    async def events(self, from_dt=None, to_dt=None):
+        """Retrieves events for a given date range, by default, this month."""
+        await self.refresh_client(from_dt, to_dt)
+        return self.response.get("Event")
+
+    async def calendars(self):
+        """Retrieves calendars of this month."""
+        req = await self.session.get(self._calendars, params=self._month_params())
+        self.response = await _json(req)
+        return self.response["Collection"]
+
+
+class AsyncContactsService:
+    """Asyncio 'Contacts' iCloud service."""
+
+    def __init__(self, service_root, session, params):
+        self.session = session
+        self.params = params
+        self._service_root = service_root
+        self._contacts_endpoint = "%s/co" % self._service_root
+        self._contacts_refresh_url = "%s/startup" % self._contacts_endpoint
+        self._contacts_next_url = "%s/contacts" % self._contacts_endpoint
+        self._contacts_changeset_url = "%s/changeset" % self._contacts_endpoint
+
+        self.response = {}
+
+    async def refresh_client(self):
+        """Refreshes the contacts data."""
+        params_contacts = dict(self.params)
+        params_contacts.update(
+            {
+                "clientVersion": "2.1",
+                "locale": "en_US",
+                "order": "last,first",
+            }
+        )
+        req = await self.session.get(self._contacts_refresh_url, params=params_contacts)
+        self.response = await _json(req)
+
+        params_next = dict(params_contacts)
+        params_next.update(
+            {
+                "prefToken": self.response["prefToken"],
+                "syncToken": self.response["syncToken"],
+                "limit": "0",
+                "offset": "0",
+            }
+        )
+        req = await self.session.get(self._contacts_next_url, params=params_next)
+        self.response = await _json(req)
+
+    async def all(self):
+        """Retrieves all contacts."""
+        await self.refresh_client()
+        return self.response.get("contacts")
@@ -1,16 +1,17 @@
 """Library base file."""
 
 from uuid import uuid1
-import inspect
 import json
 import logging
-from requests import Session
+import sys
+import threading
+import time
+from requests import RequestException, Response, Session, Timeout
 from tempfile import gettempdir
 from os import path, mkdir
-from re import match
-import http.cookiejar as cookielib
+from re import sub
+from urllib.parse import urlsplit
 import getpass
-import srp
 import base64
 import hashlib
 
@@ -18,24 +19,35 @@ from pyicloud.exceptions import (
     PyiCloudFailedLoginException,
     PyiCloudAPIResponseException,
     PyiCloud2SARequiredException,
+    PyiCloudDeadlineExceededException,
     PyiCloudServiceNotActivatedException,
 )
-from pyicloud.services import (
-    FindMyiPhoneServiceManager,
-    CalendarService,
-    UbiquityService,
-    ContactsService,
-    RemindersService,
-    PhotosService,
-    AccountService,
-    DriveService,
-    NotesService,
+from pyicloud import services
+from pyicloud.retry import RetryPolicy
+from pyicloud.session_store import (
+    FLUSH_INTERVAL,
+    FileSessionStore,
+    SessionCookieJar,
+    SessionWriter,
 )
-from pyicloud.utils import get_password_from_keyring
+from pyicloud.timeouts import TimeoutPolicy, bounded_timeout, remaining
+from pyicloud.utils import get_password_from_keyring, json_loads
 
 
 LOGGER = logging.getLogger(__name__)
 
+# Account data cached in the session with the webservices
+CACHED_DATA = (
+    "apps",
+    "dsInfo",
+    "hsaChallengeRequired",
+    "hsaTrustedBrowser",
+    "webservices",
+)
+
+# Seconds the webservices are cached with lazy_auth, by default
+WEBSERVICES_TTL = 3600
+
 HEADER_DATA = {
     "X-Apple-ID-Account-Country": "account_country",
     "X-Apple-ID-Session-Id": "session_id",
@@ -45,13 +57,75 @@ HEADER_DATA = {
 }
 
 
+def get_response_error(data):
+    """Returns the (code, reason) of the error reported in a JSON body.
+
+    The reason is None when the body does not report an error.
+    """
+    if not isinstance(data, dict):
+        return None, None
+
+    reason = data.get("errorMessage")
+    reason = reason or data.get("reason")
+    reason = reason or data.get("errorReason")
+    if not reason and isinstance(data.get("error"), str):
+        reason = data.get("error")
+    if not reason and data.get("error"):
+        reason = "Unknown reason"
+
+    code = data.get("errorCode")
+    if not code and data.get("serverErrorCode"):
+        code = data.get("serverErrorCode")
+
+    return code, reason
+
+
+class PyiCloudResponse(Response):
+    """Response decoding its JSON body only once.
+
+    The decoded body is shared by every caller of `json()`.
+    """
+
+    _json = None
+
+    def json(self, **kwargs):
+        if kwargs or self.encoding not in (None, "utf-8", "UTF-8"):
+            return super().json(**kwargs)
+        if self._json is None:
+            self._json = json_loads(self.content)
+        return self._json
+
+
 class PyiCloudPasswordFilter(logging.Filter):
-    """Password log hider."""
+    """Password log hider.
+
+    String messages and arguments are redacted in place, without
+    formatting the record. Payloads logged by the session redact
+    themselves when a handler formats them.
+    """
 
     def __init__(self, password):
         super().__init__(password)
 
+    def redact(self, text):
+        """Returns the text with the password hidden."""
+        if self.name and self.name in text:
+            return text.replace(self.name, "*" * 8)
+        return text
+
     def filter(self, record):
+        if not self.name:
+            return True
+
+        args = record.args
+        if isinstance(record.msg, str) and isinstance(args, tuple):
+            if all(isinstance(arg, _SAFE_LOG_ARGS) for arg in args):
+                record.msg = self.redact(record.msg)
+                record.args = tuple(
+                    self.redact(arg) if isinstance(arg, str) else arg for arg in args
+                )
+                return True
+
         message = record.getMessage()
         if self.name in message:
             record.msg = message.replace(self.name, "*" * 8)
@@ -60,111 +134,342 @@ class PyiCloudPasswordFilter(logging.Filter):
         return True
 
 
+class LogPayload:
+    """Request or response payload, rendered only if a log record is emitted.
+
+    The rendering is truncated to `limit` characters (None for no limit),
+    and redacted with the `redact` function.
+    """
+
+    __slots__ = ("data", "limit", "redact")
+
+    def __init__(self, data, limit=None, redact=None):
+        self.data = data
+        self.limit = limit
+        self.redact = redact
+
+    def __str__(self):
+        text = self.data if isinstance(self.data, str) else str(self.data)
+        if self.redact is not None:
+            text = self.redact(text)
+        if self.limit is not None and len(text) > self.limit:
+            text = "%s... (%d characters)" % (text[: self.limit], len(text))
+        return text
+
+
+_SAFE_LOG_ARGS = (str, int, float, type(None), LogPayload)
+
+
 class PyiCloudSession(Session):
-    """iCloud session."""
+    """iCloud session.
+
+    A session can be shared by threads. `lock` guards the session state:
+    the session data captured from the responses and the authentication.
+    Requests which change none of it do not take it, and it is not held
+    while the state is written to the session store.
+
+    `auth_generation` counts the authentications of the session. Requests
+    rejected together by an expired session authenticate it once: the
+    first one does while the others wait, then all of them retry.
+    `auth_failures` counts the failed authentications: a failure is raised
+    to the requests sent before it, the later ones authenticate again.
+    """
 
-    def __init__(self, service):
+    # Maximum length of the payloads logged, None for no limit
+    payload_log_limit = 10000
+
+    def __init__(
+        self,
+        service,
+        flush_interval=FLUSH_INTERVAL,
+        retry_policy=None,
+        rate_limiter=None,
+        metrics=None,
+        timeout_policy=None,
+    ):
         self.service = service
+        self.lock = threading.RLock()
+        self.writer = SessionWriter(service, flush_interval, self.lock)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.timeout_policy = timeout_policy or TimeoutPolicy()
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        # Called with the URL rejected with 401/421 when the session was not
+        # validated yet, returns the URL to retry
+        self.revalidate = None
+        self.auth_generation = 0
+        self.auth_failures = 0
+        self._auth_failure = None
+        self.retry_policies = {}
+        self._webservice_hosts = (None, {})
+        self._request_loggers = {}
         super().__init__()
 
+    def _get_request_logger(self, depth):
+        """Returns the "http" child logger of the module at the call site.
+
+        Only the caller's module globals are read, so resolving the logger
+        is O(1); loggers are cached per module name.
+        """
+        try:
+            # pylint: disable=protected-access
+            module_name = sys._getframe(depth + 1).f_globals.get("__name__")
+        except ValueError:
+            module_name = None
+        module_name = module_name or __name__
+
+        request_logger = self._request_loggers.get(module_name)
+        if request_logger is None:
+            with self.lock:
+                request_logger = logging.getLogger(module_name).getChild("http")
+                if self.service.password_filter not in request_logger.filters:
+                    request_logger.addFilter(self.service.password_filter)
+                self._request_loggers[module_name] = request_logger
+        return request_logger
+
+    def get_retry_policy(self, url):
+        """Returns the retry policy of the webservice serving an URL."""
+        if self.retry_policies:
+            ws_key = self.webservice_key(url)
+            if ws_key in self.retry_policies:
+                return self.retry_policies[ws_key]
+        return self.retry_policy
+
+    def get_timeout(self, url, stream=False):
+        """Returns the timeout of a request, a download if streamed."""
+        operation = "download" if stream else "metadata"
+        return self.timeout_policy.timeout(self.webservice_key(url), operation)
+
+    def webservice_key(self, url):
+        """Returns the key of the webservice serving an URL, or None."""
+        webservices = getattr(self.service, "_webservices", None)
+        if not isinstance(webservices, dict):
+            return None
+        if self._webservice_hosts[0] is not webservices:
+            hosts = {}
+            for ws_key, webservice in webservices.items():
+                ws_url = (webservice or {}).get("url")
+                if ws_url:
+                    hosts.setdefault(urlsplit(ws_url).netloc, ws_key)
+            self._webservice_hosts = (webservices, hosts)
+        return self._webservice_hosts[1].get(urlsplit(url).netloc)
+
     def request(self, method, url, **kwargs):  # pylint: disable=arguments-differ
 
         # Charge logging to the right service endpoint
-        callee = inspect.stack()[2]
-        module = inspect.getmodule(callee[0])
-        request_logger = logging.getLogger(module.__name__).getChild("http")
-        if self.service.password_filter not in request_logger.filters:
-            request_logger.addFilter(self.service.password_filter)
-
-        request_logger.debug("%s %s %s", method, url, kwargs.get("data", ""))
-
-        has_retried = kwargs.get("retried")
-        kwargs.pop("retried", None)
-        response = super().request(method, url, **kwargs)
-
-        content_type = response.headers.get("Content-Type", "").split(";")[0]
-        json_mimetypes = ["application/json", "text/json"]
-
-        for header, value in HEADER_DATA.items():
-            if response.headers.get(header):
-                session_arg = value
-                self.service.session_data.update(
-                    {session_arg: response.headers.get(header)}
+        request_logger = self._get_request_logger(2)
+
+        retry_policy = kwargs.pop("retry_policy", None) or self.get_retry_policy(url)
+        retry = retry_policy.start()
+
+        while True:
+            generation, failures = self.auth_generation, self.auth_failures
+            if request_logger.isEnabledFor(logging.DEBUG):
+                request_logger.debug(
+                    "%s %s %s", method, url, self._log_payload(kwargs.get("data", ""))
                 )
 
-        # Save session_data to file
-        with open(self.service.session_path, "w", encoding="utf-8") as outfile:
-            json.dump(self.service.session_data, outfile)
-            LOGGER.debug("Saved session data to file")
+            response = self._send(method, url, **kwargs)
+            if type(response) is Response:  # pylint: disable=unidiomatic-typecheck
+                response.__class__ = PyiCloudResponse
 
-        # Save cookies to file
-        self.cookies.save(ignore_discard=True, ignore_expires=True)
-        LOGGER.debug("Cookies saved to %s", self.service.cookiejar_path)
+            content_type = response.headers.get("Content-Type", "").split(";")[0]
+            json_mimetypes = ["application/json", "text/json"]
 
-        if not response.ok and (
-            content_type not in json_mimetypes
-            or response.status_code in [421, 450, 500]
-        ):
-            try:
-                # pylint: disable=protected-access
-                fmip_url = self.service._get_webservice_url("findme")
+            session_changes = {}
+            for header, value in HEADER_DATA.items():
+                header_value = response.headers.get(header)
                 if (
-                    has_retried is None
-                    and response.status_code in [421, 450, 500]
-                    and fmip_url in url
+                    header_value
+                    and self.service.session_data.get(value) != header_value
                 ):
+                    session_changes[value] = header_value
+            if session_changes:
+                with self.lock:
+                    self.service.session_data.update(session_changes)
+
+            cookies_changed = any(
+                self.writer.cookies_changed(resp.cookies)
+                for resp in response.history + [response]
+                if "Set-Cookie" in resp.headers
+            )
+
+            # Save session_data and cookies, only if they changed
+            self.writer.mark_dirty(
+                session_data=bool(session_changes), cookies=cookies_changed
+            )
+
+            if response.status_code in [401, 421]:
+                retry_url = self._revalidate(url, generation)
+                if retry_url is not None:
+                    response.close()
+                    url = retry_url
+                    continue
+
+            if not response.ok and retry.should_retry(
+                status=response.status_code,
+                retry_after=response.headers.get("Retry-After"),
+            ):
+                response.close()
+                if response.status_code in [421, 450, 500] and self._is_findme(url):
                     # Handle re-authentication for Find My iPhone
                     LOGGER.debug("Re-authenticating Find My iPhone service")
                     try:
                         # If 450, authentication requires a full sign in to the account
                         service = None if response.status_code == 450 else "find"
-                        self.service.authenticate(True, service)
+                        self.reauthenticate(generation, service, failures)
 
                     except PyiCloudAPIResponseException:
                         LOGGER.debug("Re-authentication failed")
-                    kwargs["retried"] = True
-                    return self.request(method, url, **kwargs)
-            except Exception:
-                pass
-
-            if has_retried is None and response.status_code in [421, 450, 500]:
-                api_error = PyiCloudAPIResponseException(
-                    response.reason, response.status_code, retry=True
-                )
-                request_logger.debug(api_error)
-                kwargs["retried"] = True
-                return self.request(method, url, **kwargs)
+                else:
+                    api_error = PyiCloudAPIResponseException(
+                        response.reason, response.status_code, retry=True
+                    )
+                    request_logger.debug(
+                        "%s, retrying in %.2fs", api_error, retry.next_delay
+                    )
+                self._record_retry(url)
+                retry.wait()
+                continue
+
+            if not response.ok and (
+                content_type not in json_mimetypes
+                or response.status_code in [421, 450, 500]
+            ):
+                self._raise_error(response.status_code, response.reason)
 
-            self._raise_error(response.status_code, response.reason)
+            if content_type not in json_mimetypes:
+                return response
+
+            try:
+                data = response.json()
+            except:  # pylint: disable=bare-except
+                request_logger.warning("Failed to parse response with JSON mimetype")
+                return response
+
+            if request_logger.isEnabledFor(logging.DEBUG):
+                request_logger.debug("%s", self._log_payload(data))
+
+            code, reason = get_response_error(data)
+            if reason and retry.should_retry(
+                error_code=code, retry_after=response.headers.get("Retry-After")
+            ):
+                request_logger.debug(
+                    "%s (%s), retrying in %.2fs", reason, code, retry.next_delay
+                )
+                self._record_retry(url)
+                retry.wait()
+                continue
+            if reason:
+                self._raise_error(code, reason)
 
-        if content_type not in json_mimetypes:
             return response
 
+    def reauthenticate(self, generation, service=None, failures=None):
+        """Authenticates again, for a request sent at `generation`.
+
+        Nothing is done if the session was authenticated since the request
+        was sent. A failure is raised again to the requests sent before it,
+        when `auth_failures` was `failures`, rather than attempting as many
+        logins; requests sent after it authenticate again.
+        """
+        if failures is None:
+            failures = self.auth_failures
+        with self.lock:
+            if self.auth_generation != generation:
+                LOGGER.debug("Session already authenticated again")
+                return
+            if self.auth_failures != failures:
+                raise self._auth_failure
+            try:
+                self.service.authenticate(True, service)
+            except Exception as error:
+                self._auth_failure = error
+                self.auth_failures += 1
+                raise
+
+    def _revalidate(self, url, generation):
+        """Validates the session rejecting a request sent at `generation`.
+
+        Returns the URL to retry, None if the rejection stands.
+        """
+        with self.lock:
+            if self.auth_generation != generation:
+                # Authenticated by another thread since the request was sent
+                return url
+            revalidate, self.revalidate = self.revalidate, None
+            if revalidate is None:
+                return None
+            LOGGER.debug("Session rejected, validating it")
+            return revalidate(url)
+
+    def _log_payload(self, data):
+        return LogPayload(
+            data, self.payload_log_limit, self.service.password_filter.redact
+        )
+
+    def _send(self, method, url, **kwargs):
+        """Sends a request, rate limited, measured and timed out."""
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(self.webservice_key(url))
+        if "timeout" not in kwargs:
+            kwargs["timeout"] = self.get_timeout(url, kwargs.get("stream"))
+        kwargs["timeout"] = bounded_timeout(kwargs["timeout"])
+
+        started = time.perf_counter()
         try:
-            data = response.json()
-        except:  # pylint: disable=bare-except
-            request_logger.warning("Failed to parse response with JSON mimetype")
+            response = super().request(method, url, **kwargs)
+        except RequestException as error:
+            if self.metrics is not None:
+                webservice, path = self._metrics_endpoint(url)
+                elapsed = time.perf_counter() - started
+                self.metrics.record(webservice, path, None, elapsed)
+            left = remaining()
+            if isinstance(error, Timeout) and left is not None and left <= 0:
+                raise PyiCloudDeadlineExceededException() from error
+            raise
+        if self.metrics is None:
             return response
 
-        request_logger.debug(data)
+        elapsed = time.perf_counter() - started
+        webservice, path = self._metrics_endpoint(url)
+
+        body = response.request.body if response.request else None
+        if kwargs.get("stream"):
+            bytes_in = int(response.headers.get("Content-Length") or 0)
+        else:
+            bytes_in = len(response.content or b"")
+        self.metrics.record(
+            webservice,
+            path,
+            response.status_code,
+            elapsed,
+            bytes_in=bytes_in,
+            bytes_out=len(body or b""),
+        )
+        return response
 
-        if isinstance(data, dict):
-            reason = data.get("errorMessage")
-            reason = reason or data.get("reason")
-            reason = reason or data.get("errorReason")
-            if not reason and isinstance(data.get("error"), str):
-                reason = data.get("error")
-            if not reason and data.get("error"):
-                reason = "Unknown reason"
+    def _metrics_endpoint(self, url):
+        """Returns the (webservice, path) an URL is measured under."""
+        split = urlsplit(url)
+        return self.webservice_key(url) or split.hostname, split.path
 
-            code = data.get("errorCode")
-            if not code and data.get("serverErrorCode"):
-                code = data.get("serverErrorCode")
+    def _record_retry(self, url):
+        if self.metrics is not None:
+            self.metrics.record_retry(*self._metrics_endpoint(url))
 
-            if reason:
-                self._raise_error(code, reason)
+    def _is_findme(self, url):
+        """Returns True if the URL is served by Find My iPhone."""
+        try:
+            # pylint: disable=protected-access
+            return self.service._get_webservice_url("findme") in url
+        except Exception:  # pylint: disable=broad-except
+            return False
 
-        return response
+    def close(self):
+        """Writes pending session changes and closes the session."""
+        self.writer.close()
+        super().close()
 
     def _raise_error(self, code, reason):
         if (
@@ -217,6 +522,15 @@ class PyiCloudService:
         verify=True,
         client_id=None,
         with_family=True,
+        session_flush_interval=FLUSH_INTERVAL,
+        session_store=None,
+        retry_policy=None,
+        rate_limiter=None,
+        metrics=None,
+        lazy_auth=False,
+        webservices_ttl=None,
+        service_ttls=None,
+        timeout_policy=None,
     ):
         if password is None:
             password = get_password_from_keyring(apple_id)
@@ -226,66 +540,84 @@ class PyiCloudService:
         self.params = {}
         self.client_id = client_id or ("auth-%s" % str(uuid1()).lower())
         self.with_family = with_family
+        if webservices_ttl is None and lazy_auth:
+            webservices_ttl = WEBSERVICES_TTL
+        self.webservices_ttl = webservices_ttl
+        self._webservices = None
+        self._authenticating = False
+        # Service name -> seconds its instance is reused, None for ever
+        self.service_ttls = dict(service_ttls or {})
+        self._services = {}
+        self._service_locks = {}
 
         self.password_filter = PyiCloudPasswordFilter(password)
         LOGGER.addFilter(self.password_filter)
 
         if cookie_directory:
             self._cookie_directory = path.expanduser(path.normpath(cookie_directory))
-            if not path.exists(self._cookie_directory):
+            if not path.exists(self._cookie_directory) and session_store is None:
                 mkdir(self._cookie_directory, 0o700)
         else:
             topdir = path.join(gettempdir(), "pyicloud")
             self._cookie_directory = path.join(topdir, getpass.getuser())
-            if not path.exists(topdir):
-                mkdir(topdir, 0o777)
-            if not path.exists(self._cookie_directory):
-                mkdir(self._cookie_directory, 0o700)
+            if session_store is None:
+                if not path.exists(topdir):
+                    mkdir(topdir, 0o777)
+                if not path.exists(self._cookie_directory):
+                    mkdir(self._cookie_directory, 0o700)
 
-        LOGGER.debug("Using session file %s", self.session_path)
+        self.session_store = session_store or FileSessionStore(self._cookie_directory)
+        if isinstance(self.session_store, FileSessionStore):
+            LOGGER.debug("Using session file %s", self.session_path)
 
         self.session_data = {}
-        try:
-            with open(self.session_path, encoding="utf-8") as session_f:
-                self.session_data = json.load(session_f)
-        except:  # pylint: disable=bare-except
-            LOGGER.info("Session file does not exist")
-        if self.session_data.get("client_id"):
-            self.client_id = self.session_data.get("client_id")
-        else:
-            self.session_data.update({"client_id": self.client_id})
-
-        self.session = PyiCloudSession(self)
+        self.session = PyiCloudSession(
+            self,
+            session_flush_interval,
+            retry_policy,
+            rate_limiter,
+            metrics,
+            timeout_policy,
+        )
         self.session.verify = verify
         self.session.headers.update(
             {"Origin": self.HOME_ENDPOINT, "Referer": "%s/" % self.HOME_ENDPOINT}
         )
+        self.session.cookies = SessionCookieJar(filename=self.cookiejar_path)
+        self.session.writer.load()
 
-        cookiejar_path = self.cookiejar_path
-        self.session.cookies = cookielib.LWPCookieJar(filename=cookiejar_path)
-        if path.exists(cookiejar_path):
-            try:
-                self.session.cookies.load(ignore_discard=True, ignore_expires=True)
-                LOGGER.debug("Read cookies from %s", cookiejar_path)
-            except:  # pylint: disable=bare-except
-                # Most likely a pickled cookiejar from earlier versions.
-                # The cookiejar will get replaced with a valid one after
-                # successful authentication.
-                LOGGER.warning("Failed to read cookiejar %s", cookiejar_path)
-
-        self.authenticate()
+        if self.session_data.get("client_id"):
+            self.client_id = self.session_data.get("client_id")
+        else:
+            self.session_data.update({"client_id": self.client_id})
+            self.session.writer.mark_dirty(session_data=True)
 
-        self._drive = None
-        self._files = None
-        self._photos = None
+        if not lazy_auth:
+            self._ensure_authenticated()
+        elif self._load_webservices():
+            # Validated reactively, if a webservice rejects the session
+            LOGGER.debug("Using cached webservices")
+            self.session.revalidate = self._revalidate
 
     def authenticate(self, force_refresh=False, service=None):
         """
         Handles authentication, and persists cookies so that
         subsequent logins will not cause additional e-mails from Apple.
         """
+        with self.session.lock:
+            self._authenticate(force_refresh, service)
 
+    def _authenticate(self, force_refresh, service):
         login_successful = False
+        if force_refresh:
+            # Another process sharing the session store may have already
+            # re-authenticated: pick up its session before logging in again.
+            session_token = self.session_data.get("session_token")
+            self.session.writer.sync()
+            if self.session_data.get("session_token") != session_token:
+                LOGGER.debug("Session was refreshed by another client")
+                force_refresh = False
+
         if self.session_data.get("session_token") and not force_refresh:
             LOGGER.debug("Checking session token validity")
             try:
@@ -309,6 +641,8 @@ class PyiCloudService:
                     )
 
         if not login_successful:
+            import srp  # pylint: disable=import-outside-toplevel
+
             LOGGER.debug("Authenticating as %s", self.user["accountName"])
 
             headers = self._get_auth_headers()
@@ -404,10 +738,68 @@ class PyiCloudService:
 
             self._authenticate_with_token()
 
+        if self._webservices not in (None, self.data["webservices"]):
+            # Services built for the former webservices URLs
+            self.invalidate()
         self._webservices = self.data["webservices"]
+        self.session.revalidate = None
+        self.session.auth_generation += 1
+        self._save_webservices()
 
         LOGGER.debug("Authentication completed successfully")
 
+    def _ensure_authenticated(self):
+        """Authenticates the service if it was not yet."""
+        if self._webservices is not None:
+            return
+        with self.session.lock:
+            if self._webservices is None and not self._authenticating:
+                self._authenticating = True
+                try:
+                    self.authenticate()
+                finally:
+                    self._authenticating = False
+
+    def _load_webservices(self):
+        """Loads the account data cached in the session, if still valid."""
+        cached = self.session_data.get("webservices")
+        if not cached or not self.session_data.get("session_token"):
+            return False
+        if cached.get("expires", 0) <= time.time():
+            LOGGER.debug("Cached webservices expired")
+            return False
+        self.data = dict(cached["data"])
+        self._webservices = self.data["webservices"]
+        return True
+
+    def _save_webservices(self):
+        """Caches the webservices and account info in the session."""
+        if not self.webservices_ttl:
+            # Not kept with the session when it is not used
+            if self.session_data.get("webservices") is not None:
+                self.session_data["webservices"] = None
+                self.session.writer.mark_dirty(session_data=True)
+            return
+        self.session_data["webservices"] = {
+            "expires": time.time() + self.webservices_ttl,
+            "data": {key: self.data[key] for key in CACHED_DATA if key in self.data},
+        }
+        self.session.writer.mark_dirty(session_data=True)
+
+    def _revalidate(self, url):
+        """Validates a session started from cached webservices.
+
+        Returns the URL to retry, moved if its webservice moved.
+        """
+        webservices = self._webservices
+        self.authenticate()
+        for ws_key, webservice in webservices.items():
+            old_root = (webservice or {}).get("url")
+            new_root = (self._webservices.get(ws_key) or {}).get("url")
+            if old_root and new_root and url.startswith(old_root):
+                return new_root + url[len(old_root) :]
+        return url
+
     def _authenticate_with_token(self):
         """Authenticate using session token."""
         data = {
@@ -484,26 +876,25 @@ class PyiCloudService:
             headers.update(overrides)
         return headers
 
+    @property
+    def account_key(self):
+        """Get the key the account is persisted under."""
+        return sub(r"\W", "", self.user.get("accountName"))
+
     @property
     def cookiejar_path(self):
         """Get path for cookiejar file."""
-        return path.join(
-            self._cookie_directory,
-            "".join([c for c in self.user.get("accountName") if match(r"\w", c)]),
-        )
+        return path.join(self._cookie_directory, self.account_key)
 
     @property
     def session_path(self):
         """Get path for session data file."""
-        return path.join(
-            self._cookie_directory,
-            "".join([c for c in self.user.get("accountName") if match(r"\w", c)])
-            + ".session",
-        )
+        return path.join(self._cookie_directory, self.account_key + ".session")
 
     @property
     def requires_2sa(self):
         """Returns True if two-step authentication is required."""
+        self._ensure_authenticated()
         return self.data.get("dsInfo", {}).get("hsaVersion", 0) >= 1 and (
             self.data.get("hsaChallengeRequired", False) or not self.is_trusted_session
         )
@@ -511,6 +902,7 @@ class PyiCloudService:
     @property
     def requires_2fa(self):
         """Returns True if two-factor authentication is required."""
+        self._ensure_authenticated()
         return self.data["dsInfo"].get("hsaVersion", 0) == 2 and (
             self.data.get("hsaChallengeRequired", False) or not self.is_trusted_session
         )
@@ -518,6 +910,7 @@ class PyiCloudService:
     @property
     def is_trusted_session(self):
         """Returns True if the session is trusted."""
+        self._ensure_authenticated()
         return self.data.get("hsaTrustedBrowser", False)
 
     @property
@@ -610,20 +1003,71 @@ class PyiCloudService:
             LOGGER.error("Session trust failed.")
             return False
 
+    def set_retry_policy(self, retry_policy, ws_key=None):
+        """Sets the retry policy of a webservice, or the default one."""
+        if ws_key is None:
+            self.session.retry_policy = retry_policy
+        else:
+            self.session.retry_policies[ws_key] = retry_policy
+
     def _get_webservice_url(self, ws_key):
         """Get webservice URL, raise an exception if not exists."""
+        self._ensure_authenticated()
         if self._webservices.get(ws_key) is None:
             raise PyiCloudServiceNotActivatedException(
                 "Webservice not available", ws_key
             )
         return self._webservices[ws_key]["url"]
 
+    def _get_service(self, name, factory):
+        """Returns the cached instance of a service, built again if expired."""
+        service = self._get_cached_service(name)
+        if service is not None:
+            return service
+
+        # Built by one thread, the others wait for it, not for the session
+        with self.session.lock:
+            lock = self._service_locks.setdefault(name, threading.Lock())
+        with lock:
+            service = self._get_cached_service(name)
+            if service is None:
+                service = factory()
+                with self.session.lock:
+                    self._services[name] = (service, time.monotonic())
+            return service
+
+    def _get_cached_service(self, name):
+        """Returns the cached instance of a service, None if expired."""
+        cached = self._services.get(name)
+        if cached is not None:
+            service, created = cached
+            ttl = self.service_ttls.get(name)
+            if ttl is None or time.monotonic() - created < ttl:
+                return service
+        return None
+
+    def invalidate(self, name=None):
+        """Drops the cached instance of a service ('notes'...), or of all.
+
+        The service is built again, and refreshed, on next access.
+        """
+        with self.session.lock:
+            if name is None:
+                self._services.clear()
+            else:
+                self._services.pop(name, None)
+
     @property
     def devices(self):
         """Returns all devices."""
-        service_root = self._get_webservice_url("findme")
-        return FindMyiPhoneServiceManager(
-            service_root, self.session, self.params, self.with_family
+        return self._get_service(
+            "devices",
+            lambda: services.FindMyiPhoneServiceManager(
+                self._get_webservice_url("findme"),
+                self.session,
+                self.params,
+                self.with_family,
+            ),
         )
 
     @property
@@ -634,59 +1078,85 @@ class PyiCloudService:
     @property
     def account(self):
         """Gets the 'Account' service."""
-        service_root = self._get_webservice_url("account")
-        return AccountService(service_root, self.session, self.params)
+        return self._get_service(
+            "account",
+            lambda: services.AccountService(
+                self._get_webservice_url("account"), self.session, self.params
+            ),
+        )
 
     @property
     def files(self):
         """Gets the 'File' service."""
-        if not self._files:
-            service_root = self._get_webservice_url("ubiquity")
-            self._files = UbiquityService(service_root, self.session, self.params)
-        return self._files
+        return self._get_service(
+            "files",
+            lambda: services.UbiquityService(
+                self._get_webservice_url("ubiquity"), self.session, self.params
+            ),
+        )
 
     @property
     def photos(self):
         """Gets the 'Photo' service."""
-        if not self._photos:
-            service_root = self._get_webservice_url("ckdatabasews")
-            self._photos = PhotosService(service_root, self.session, self.params)
-        return self._photos
+        return self._get_service(
+            "photos",
+            lambda: services.PhotosService(
+                self._get_webservice_url("ckdatabasews"), self.session, self.params
+            ),
+        )
 
     @property
     def calendar(self):
         """Gets the 'Calendar' service."""
-        service_root = self._get_webservice_url("calendar")
-        return CalendarService(service_root, self.session, self.params)
+        return self._get_service(
+            "calendar",
+            lambda: services.CalendarService(
+                self._get_webservice_url("calendar"), self.session, self.params
+            ),
+        )
 
     @property
     def contacts(self):
         """Gets the 'Contacts' service."""
-        service_root = self._get_webservice_url("contacts")
-        return ContactsService(service_root, self.session, self.params)
+        return self._get_service(
+            "contacts",
+            lambda: services.ContactsService(
+                self._get_webservice_url("contacts"), self.session, self.params
+            ),
+        )
 
     @property
     def reminders(self):
         """Gets the 'Reminders' service."""
-        service_root = self._get_webservice_url("reminders")
-        return RemindersService(service_root, self.session, self.params)
+        return self._get_service(
+            "reminders",
+            lambda: services.RemindersService(
+                self._get_webservice_url("reminders"), self.session, self.params
+            ),
+        )
 
     @property
     def drive(self):
         """Gets the 'Drive' service."""
-        if not self._drive:
-            self._drive = DriveService(
+        return self._get_service(
+            "drive",
+            lambda: services.DriveService(
                 service_root=self._get_webservice_url("drivews"),
                 document_root=self._get_webservice_url("docws"),
                 session=self.session,
                 params=self.params,
-            )
-        return self._drive
+            ),
+        )
 
     @property
     def notes(self):
-        service_root = self._get_webservice_url("ckdatabasews")
-        return NotesService(service_root, self.session, self.params)
+        """Gets the 'Notes' service."""
+        return self._get_service(
+            "notes",
+            lambda: services.NotesService(
+                self._get_webservice_url("ckdatabasews"), self.session, self.params
+            ),
+        )
 
     def __str__(self):
         return f"iCloud API: {self.user.get('apple_id')}"
@@ -26,6 +26,12 @@ class PyiCloudServiceNotActivatedException(PyiCloudAPIResponseException):
     pass
 
 
+class PyiCloudDeadlineExceededException(PyiCloudException):
+    """Operation deadline exceeded exception."""
+    def __init__(self, message="Deadline exceeded"):
+        super().__init__(message)
+
+
 # Login
 class PyiCloudFailedLoginException(PyiCloudException):
     """iCloud failed login exception."""
@@ -0,0 +1,198 @@
+"""Request metrics."""
+from bisect import bisect_left
+import threading
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+OTHER_PATH = "other"
+
+
+class Histogram:
+    """Latency histogram with fixed buckets, in seconds."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Adds a value."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, quantile):
+        """Returns a quantile estimated by interpolating within its bucket."""
+        if not self.count:
+            return None
+
+        rank = quantile * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                if index == len(self.buckets):
+                    return lower
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class EndpointMetrics:
+    """Metrics of the requests made to one webservice path."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.requests = 0
+        self.statuses = {}
+        self.retries = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency = Histogram(buckets)
+
+    def as_dict(self):
+        """Returns the metrics as a dict."""
+        return {
+            "requests": self.requests,
+            "statuses": dict(self.statuses),
+            "retries": self.retries,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "latency": {
+                "count": self.latency.count,
+                "sum": self.latency.sum,
+                "p50": self.latency.quantile(0.5),
+                "p95": self.latency.quantile(0.95),
+                "p99": self.latency.quantile(0.99),
+            },
+        }
+
+
+class SessionMetrics:
+    """Collects request metrics per webservice and path.
+
+    A single instance can be shared by several sessions. Past `max_paths`
+    distinct paths for a webservice, new ones are counted as "other".
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, max_paths=100):
+        self.buckets = tuple(buckets)
+        self.max_paths = max_paths
+        self._endpoints = {}
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def _endpoint(self, webservice, path):
+        paths = self._paths.setdefault(webservice, set())
+        if path not in paths:
+            if len(paths) >= self.max_paths:
+                path = OTHER_PATH
+            paths.add(path)
+
+        key = (webservice, path)
+        endpoint = self._endpoints.get(key)
+        if endpoint is None:
+            endpoint = self._endpoints[key] = EndpointMetrics(self.buckets)
+        return endpoint
+
+    def record(self, webservice, path, status, elapsed, bytes_in=0, bytes_out=0):
+        """Records a request; status is None if no response was received."""
+        with self._lock:
+            endpoint = self._endpoint(webservice, path)
+            endpoint.requests += 1
+            status = "error" if status is None else str(status)
+            endpoint.statuses[status] = endpoint.statuses.get(status, 0) + 1
+            endpoint.bytes_in += bytes_in
+            endpoint.bytes_out += bytes_out
+            endpoint.latency.observe(elapsed)
+
+    def record_retry(self, webservice, path):
+        """Records a retried request."""
+        with self._lock:
+            self._endpoint(webservice, path).retries += 1
+
+    def reset(self):
+        """Clears the metrics."""
+        with self._lock:
+            self._endpoints.clear()
+            self._paths.clear()
+
+    def _sorted_endpoints(self):
+        return sorted(
+            self._endpoints.items(), key=lambda item: (str(item[0][0]), item[0][1])
+        )
+
+    def snapshot(self):
+        """Returns the metrics, as a list of dicts sorted by endpoint."""
+        with self._lock:
+            return [
+                dict(webservice=webservice, path=path, **endpoint.as_dict())
+                for (webservice, path), endpoint in self._sorted_endpoints()
+            ]
+
+    def prometheus(self, prefix="pyicloud"):
+        """Returns the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            endpoints = self._sorted_endpoints()
+            lines = []
+
+            def family(name, kind, doc):
+                lines.append(f"# HELP {prefix}_{name} {doc}")
+                lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+            family("requests_total", "counter", "Requests made.")
+            for key, endpoint in endpoints:
+                for status, count in sorted(endpoint.statuses.items()):
+                    labels = _labels(key, status=status)
+                    lines.append(f"{prefix}_requests_total{{{labels}}} {count}")
+
+            for name, attribute, doc in (
+                ("retries_total", "retries", "Requests retried."),
+                ("request_bytes_total", "bytes_out", "Bytes sent."),
+                ("response_bytes_total", "bytes_in", "Bytes received."),
+            ):
+                family(name, "counter", doc)
+                for key, endpoint in endpoints:
+                    value = getattr(endpoint, attribute)
+                    lines.append(f"{prefix}_{name}{{{_labels(key)}}} {value}")
+
+            name = f"{prefix}_request_duration_seconds"
+            family("request_duration_seconds", "histogram", "Request latency.")
+            for key, endpoint in endpoints:
+                histogram = endpoint.latency
+                cumulative = 0
+                for bound, count in zip(
+                    self.buckets + (float("inf"),), histogram.counts
+                ):
+                    cumulative += count
+                    labels = _labels(key, le="+Inf" if bound == float("inf") else bound)
+                    lines.append(f"{name}_bucket{{{labels}}} {cumulative}")
+                lines.append(f"{name}_sum{{{_labels(key)}}} {histogram.sum}")
+                lines.append(f"{name}_count{{{_labels(key)}}} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(key, **extra):
+    webservice, path = key
+    labels = {"webservice": webservice or "", "path": path}
+    labels.update(extra)
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
@@ -0,0 +1,216 @@
+"""Pool of iCloud accounts."""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import logging
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+
+from pyicloud import timeouts
+from pyicloud.base import PyiCloudService
+from pyicloud.exceptions import PyiCloudDeadlineExceededException
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Hosts kept in the connection pool: idmsa and setup, and the pNN- partition
+# hosts of each webservice, which differ across the accounts of a fleet
+POOL_CONNECTIONS = 100
+
+
+class PoolResult(namedtuple("PoolResult", ["account", "result", "error"])):
+    """Outcome of a job for one account: its result, or the error raised."""
+
+    __slots__ = ()
+
+    @property
+    def ok(self):  # pylint: disable=invalid-name
+        """Returns True if the job succeeded."""
+        return self.error is None
+
+
+class PyiCloudPool:
+    """Authenticated accounts sharing connections and worker threads.
+
+    The sessions of all the accounts send their requests through a single
+    transport adapter, which keeps a connection pool per iCloud host, so
+    TLS connections are reused across accounts. Jobs run for many accounts
+    on a bounded thread pool, at most one job per account at a time.
+
+    Keyword arguments are passed to every `PyiCloudService`, so accounts
+    can share a session store, a rate limiter or metrics. `pool_connections`
+    is the number of hosts whose connections are kept; hosts beyond it
+    have their connections closed, the least recently used first.
+
+    Usage:
+        with PyiCloudPool(max_workers=8, session_store=store) as pool:
+            pool.add_all({'user1@icloud.com': 'password1', ...})
+            for result in pool.refresh_devices().values():
+                print(result.account, result.result or result.error)
+    """
+
+    def __init__(
+        self, max_workers=8, pool_connections=POOL_CONNECTIONS, **service_kwargs
+    ):
+        self.max_workers = max_workers
+        self.service_kwargs = service_kwargs
+        # Connections kept per host: one per worker, so none is discarded
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=max_workers
+        )
+        self._accounts = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def accounts(self):
+        """Gets the Apple IDs of the pool."""
+        return list(self._accounts)
+
+    def __getitem__(self, apple_id):
+        return self._accounts[apple_id]
+
+    def __contains__(self, apple_id):
+        return apple_id in self._accounts
+
+    def __len__(self):
+        return len(self._accounts)
+
+    @property
+    def executor(self):
+        """Gets the thread pool running the jobs."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="pyicloud"
+                )
+            return self._executor
+
+    def add(self, apple_id, password=None, **kwargs):
+        """Authenticates an account and adds it to the pool.
+
+        With `lazy_auth`, an account started from cached webservices is
+        only validated if a webservice rejects its session.
+        """
+        options = dict(self.service_kwargs, **kwargs)
+        lazy_auth = options.pop("lazy_auth", False)
+        if not lazy_auth:
+            # Webservices not cached, as by a service without lazy_auth
+            options.setdefault("webservices_ttl", 0)
+        # Authenticate once the session uses the shared adapter
+        service = PyiCloudService(apple_id, password, lazy_auth=True, **options)
+        self.add_service(service)
+        if not lazy_auth:
+            # Validated even if started from cached webservices
+            service.authenticate()
+        return service
+
+    def add_service(self, service):
+        """Adds an account already authenticated."""
+        service.session.mount("https://", self.adapter)
+        service.session.mount("http://", self.adapter)
+        apple_id = service.user["accountName"]
+        with self._lock:
+            self._accounts[apple_id] = service
+            self._locks.setdefault(apple_id, threading.Lock())
+        return service
+
+    def add_all(self, credentials, **kwargs):
+        """Authenticates accounts in parallel.
+
+        `credentials` maps Apple IDs to their password, or to None to get it
+        from the keyring. Returns a PoolResult per Apple ID.
+        """
+        futures = {
+            apple_id: self.executor.submit(self.add, apple_id, password, **kwargs)
+            for apple_id, password in credentials.items()
+        }
+        return {
+            apple_id: _result(apple_id, future) for apple_id, future in futures.items()
+        }
+
+    def remove(self, apple_id):
+        """Removes an account, writing its pending session changes."""
+        with self._lock:
+            service = self._accounts.pop(apple_id)
+            self._locks.pop(apple_id, None)
+        # Closing the session would close the shared adapter
+        service.session.writer.close()
+        return service
+
+    def map(self, func, accounts=None, timeout=None):
+        """Runs func(service) for each account (all by default).
+
+        Returns a PoolResult per Apple ID, in the order of the accounts.
+        Errors raised by func are returned, not raised. `timeout` bounds the
+        whole job: the requests of the jobs still running are bounded by
+        it, those not started are cancelled, and the accounts unfinished get
+        a PyiCloudDeadlineExceededException error.
+        """
+        accounts = self.accounts if accounts is None else list(accounts)
+        deadline = timeouts.expiry(timeout)
+        futures = {
+            apple_id: self.executor.submit(self._run, func, apple_id, deadline)
+            for apple_id in accounts
+        }
+        return {
+            apple_id: _result(apple_id, future, deadline)
+            for apple_id, future in futures.items()
+        }
+
+    def _run(self, func, apple_id, deadline=None):
+        with timeouts.deadline(expires=deadline):
+            with self._locks[apple_id]:
+                return func(self._accounts[apple_id])
+
+    def refresh_devices(self, accounts=None, timeout=None):
+        """Refreshes the Find My iPhone devices of the accounts."""
+
+        def refresh(service):
+            service.invalidate("devices")
+            return service.devices
+
+        return self.map(refresh, accounts, timeout)
+
+    def album_counts(self, accounts=None, timeout=None):
+        """Counts the photos of each album of the accounts."""
+
+        def count(service):
+            return {name: len(album) for name, album in service.photos.albums.items()}
+
+        return self.map(count, accounts, timeout)
+
+    def close(self):
+        """Waits for the running jobs, writes the sessions and closes the pool."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        for service in list(self._accounts.values()):
+            service.session.writer.close()
+        self.adapter.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {len(self)} accounts>"
+
+
+def _result(apple_id, future, deadline=None):
+    timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+    try:
+        return PoolResult(apple_id, future.result(timeout), None)
+    except FutureTimeoutError:
+        future.cancel()
+        LOGGER.debug("Job timed out for %s", apple_id)
+        return PoolResult(apple_id, None, PyiCloudDeadlineExceededException())
+    except Exception as error:  # pylint: disable=broad-except
+        LOGGER.debug("Job failed for %s: %s", apple_id, error)
+        return PoolResult(apple_id, None, error)
@@ -0,0 +1,158 @@
+"""Client side rate limiting."""
+import logging
+import os
+import threading
+import time
+
+from pyicloud.exceptions import PyiCloudDeadlineExceededException
+from pyicloud.timeouts import remaining
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket shared by the threads of a process.
+
+    Tokens are added at `rate` per second, up to `capacity` (the allowed
+    burst). A request takes a token, or reserves the next one and waits
+    for it, so concurrent callers are served in order at the bucket rate.
+    A token only available after the deadline of the operation (see
+    `pyicloud.timeouts`) is not taken: PyiCloudDeadlineExceededException
+    is raised instead.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def reserve(self, tokens=1):
+        """Takes tokens and returns the delay to wait before using them."""
+        delay = self._reserve(tokens)
+        left = remaining()
+        if delay and left is not None and delay >= left:
+            # Given back, for the requests which can still wait for them
+            self._reserve(-tokens)
+            raise PyiCloudDeadlineExceededException()
+        return delay
+
+    def _reserve(self, tokens):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens, self._updated = self._take(
+                self._tokens, self._updated, now, tokens
+            )
+            return max(-self._tokens / self.rate, 0.0)
+
+    def acquire(self, tokens=1):
+        """Takes tokens, waiting for them if needed. Returns the delay waited."""
+        delay = self.reserve(tokens)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    def _take(self, available, updated, now, tokens):
+        """Returns the (tokens, updated) state once tokens are taken."""
+        available = min(self.capacity, available + (now - updated) * self.rate)
+        return available - tokens, now
+
+
+class FileTokenBucket(TokenBucket):
+    """Token bucket shared by the processes using the same state file.
+
+    The bucket state is read and written under an `fcntl` lock, with wall
+    clock timestamps. Without `fcntl`, it is only shared between threads.
+    """
+
+    def __init__(self, path, rate, capacity=None):
+        super().__init__(rate, capacity)
+        self.path = path
+        if fcntl is None:  # pragma: no cover
+            LOGGER.warning("fcntl is not available, %s is not shared", path)
+
+    def _reserve(self, tokens):
+        if fcntl is None:  # pragma: no cover
+            return super()._reserve(tokens)
+
+        with self._lock:
+            with open(self.path, "a+", encoding="utf-8") as state_file:
+                fcntl.flock(state_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    now = time.time()
+                    state_file.seek(0)
+                    try:
+                        available, updated = map(float, state_file.read().split())
+                    except ValueError:
+                        available, updated = self.capacity, now
+                    available, updated = self._take(available, updated, now, tokens)
+                    state_file.seek(0)
+                    state_file.truncate()
+                    state_file.write(f"{available!r} {updated!r}")
+                    state_file.flush()
+                finally:
+                    fcntl.flock(state_file.fileno(), fcntl.LOCK_UN)
+        return max(-available / self.rate, 0.0)
+
+
+class RateLimiter:
+    """Rate limits requests per webservice (`ckdatabasews`, `drivews`...).
+
+    `rates` maps a webservice key to its rate in requests per second, or
+    to a (rate, burst) tuple; `default` applies to the other webservices,
+    which are not limited if it is None. Buckets are shared by every
+    session using the limiter; with a `directory`, they are also shared
+    across processes through a state file per webservice.
+    """
+
+    def __init__(self, rates=None, default=None, directory=None):
+        self.rates = dict(rates or {})
+        self.default = default
+        self.directory = directory
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, ws_key):
+        """Returns the bucket of a webservice, or None if it is not limited."""
+        bucket = self._buckets.get(ws_key)
+        if bucket is not None or ws_key in self._buckets:
+            return bucket
+
+        with self._lock:
+            if ws_key not in self._buckets:
+                self._buckets[ws_key] = self._create_bucket(ws_key)
+            return self._buckets[ws_key]
+
+    def _create_bucket(self, ws_key):
+        rate = self.rates.get(ws_key, self.default)
+        if rate is None:
+            return None
+        rate, capacity = rate if isinstance(rate, tuple) else (rate, None)
+
+        if self.directory:
+            name = ws_key or "default"
+            path = os.path.join(self.directory, f"{name}.bucket")
+            return FileTokenBucket(path, rate, capacity)
+        return TokenBucket(rate, capacity)
+
+    def reserve(self, ws_key, tokens=1):
+        """Takes tokens for a webservice and returns the delay to wait."""
+        bucket = self.bucket(ws_key)
+        if bucket is None:
+            return 0.0
+        return bucket.reserve(tokens)
+
+    def acquire(self, ws_key, tokens=1):
+        """Takes tokens for a webservice, waiting for them if needed."""
+        delay = self.reserve(ws_key, tokens)
+        if delay:
+            LOGGER.debug("Rate limiting %s for %.2fs", ws_key, delay)
+            time.sleep(delay)
+        return delay
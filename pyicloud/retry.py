@@ -0,0 +1,162 @@
+"""Request retry policies."""
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import random
+import time
+
+from pyicloud.timeouts import remaining
+
+
+def parse_retry_after(value, now=None):
+    """Returns the delay in seconds requested by a Retry-After header.
+
+    The header holds either a number of seconds or an HTTP date. Returns
+    None if the value is missing or invalid.
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date is None:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+
+    now = now or datetime.now(timezone.utc)
+    return max((date - now).total_seconds(), 0.0)
+
+
+class RetryPolicy:
+    """Decides which failed requests are retried, and when.
+
+    Rules map an HTTP status code or an iCloud error code to the number of
+    retries allowed for it, `None` meaning `max_retries`. Delays follow a
+    capped exponential backoff with full jitter, unless the server asks
+    for a longer one with a Retry-After header, also capped to
+    `max_backoff`. No retry is attempted if it would end, or if the server
+    asks to wait until, after `deadline` seconds from the first attempt or
+    after the deadline of the operation (see `pyicloud.timeouts`).
+    """
+
+    DEFAULT_STATUS_RULES = {
+        # Authentication required, the session re-authenticates Find My
+        421: 1,
+        450: 1,
+        500: 1,
+        # Throttling and transient server errors
+        429: None,
+        502: None,
+        503: None,
+        504: None,
+    }
+
+    DEFAULT_ERROR_CODE_RULES = {
+        "ACCESS_DENIED": None,
+    }
+
+    def __init__(
+        self,
+        max_retries=3,
+        backoff_factor=0.5,
+        max_backoff=30.0,
+        deadline=None,
+        status_rules=None,
+        error_code_rules=None,
+        respect_retry_after=True,
+        sleep=time.sleep,
+    ):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.status_rules = dict(
+            self.DEFAULT_STATUS_RULES if status_rules is None else status_rules
+        )
+        self.error_code_rules = dict(
+            self.DEFAULT_ERROR_CODE_RULES
+            if error_code_rules is None
+            else error_code_rules
+        )
+        self.respect_retry_after = respect_retry_after
+        self.sleep = sleep
+
+    def retry_limit(self, status=None, error_code=None):
+        """Returns how many times a failure may be retried."""
+        if error_code is not None and error_code in self.error_code_rules:
+            limit = self.error_code_rules[error_code]
+        elif status is not None and status in self.status_rules:
+            limit = self.status_rules[status]
+        else:
+            return 0
+        return self.max_retries if limit is None else min(limit, self.max_retries)
+
+    def backoff(self, retry):
+        """Returns the jittered delay before the given retry (0 based)."""
+        cap = min(self.max_backoff, self.backoff_factor * (2**retry))
+        return random.uniform(0, cap)
+
+    def delay(self, retry, retry_after=None):
+        """Returns the delay before the given retry (0 based)."""
+        delay = self.backoff(retry)
+        if self.respect_retry_after and retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_backoff))
+        return delay
+
+    def start(self):
+        """Returns the retry state of a new request."""
+        return RetryState(self)
+
+    def __repr__(self):
+        return (
+            f"<{type(self).__name__}: max_retries={self.max_retries}, "
+            f"backoff_factor={self.backoff_factor}, deadline={self.deadline}>"
+        )
+
+
+class RetryState:
+    """Retries made so far for a request."""
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.retries = 0
+        self.next_delay = None
+        self._started = time.monotonic()
+
+    def should_retry(self, status=None, error_code=None, retry_after=None):
+        """Returns True if the failure should be retried.
+
+        On True, `next_delay` holds the delay to wait with `wait()`.
+        """
+        if self.retries >= self.policy.retry_limit(status, error_code):
+            return False
+
+        retry_after = parse_retry_after(retry_after)
+        delay = self.policy.delay(self.retries, retry_after)
+        # A retry sent before the server asked is only worth it in time
+        earliest = delay
+        if self.policy.respect_retry_after and retry_after is not None:
+            earliest = max(delay, retry_after)
+        if self.policy.deadline is not None:
+            elapsed = time.monotonic() - self._started
+            if elapsed + earliest > self.policy.deadline:
+                return False
+        left = remaining()
+        if left is not None and earliest >= left:
+            # The retry would not be sent before the operation deadline
+            return False
+
+        self.retries += 1
+        self.next_delay = delay
+        return True
+
+    def wait(self):
+        """Waits before the next retry."""
+        if self.next_delay:
+            self.policy.sleep(self.next_delay)
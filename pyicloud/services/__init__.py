@@ -1,10 +1,32 @@
-"""Services."""
-from pyicloud.services.calendar import CalendarService
-from pyicloud.services.findmyiphone import FindMyiPhoneServiceManager
-from pyicloud.services.ubiquity import UbiquityService
-from pyicloud.services.contacts import ContactsService
-from pyicloud.services.reminders import RemindersService
-from pyicloud.services.photos import PhotosService
-from pyicloud.services.account import AccountService
-from pyicloud.services.drive import DriveService
-from pyicloud.services.notes import NotesService
+"""Services.
+
+Service modules, and their dependencies, are only imported on first use.
+"""
+from importlib import import_module
+
+_SERVICES = {
+    "CalendarService": "pyicloud.services.calendar",
+    "FindMyiPhoneServiceManager": "pyicloud.services.findmyiphone",
+    "UbiquityService": "pyicloud.services.ubiquity",
+    "ContactsService": "pyicloud.services.contacts",
+    "RemindersService": "pyicloud.services.reminders",
+    "PhotosService": "pyicloud.services.photos",
+    "AccountService": "pyicloud.services.account",
+    "DriveService": "pyicloud.services.drive",
+    "NotesService": "pyicloud.services.notes",
+}
+
+__all__ = list(_SERVICES)
+
+
+def __getattr__(name):
+    module = _SERVICES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    service = getattr(import_module(module), name)
+    globals()[name] = service
+    return service
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
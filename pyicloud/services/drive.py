@@ -9,6 +9,7 @@ import time
 from re import search
 from requests import Response
 
+from pyicloud import timeouts
 from pyicloud.exceptions import PyiCloudAPIResponseException
 
 
@@ -272,6 +273,26 @@ class DriveNode:
             ]
         return self._children
 
+    def walk(self, deadline=None):
+        """Yields (folder, subfolders, files) for the tree of a folder.
+
+        Folders are walked top-down, like `os.walk`: removing folders from
+        `subfolders` skips them. `deadline` bounds the requests fetching
+        the whole tree to a number of seconds, raising
+        PyiCloudDeadlineExceededException once passed.
+        """
+        expires = timeouts.expiry(deadline)
+        folders = [self]
+        while folders:
+            folder = folders.pop()
+            with timeouts.deadline(expires=expires):
+                timeouts.check_deadline()
+                children = folder.get_children()
+            subfolders = [child for child in children if child.type != "file"]
+            files = [child for child in children if child.type == "file"]
+            yield folder, subfolders, files
+            folders.extend(reversed(subfolders))
+
     @property
     def size(self):
         """Gets the node size."""
@@ -34,46 +34,7 @@ class NotesService:
                 "dsid": self.session.service.data["dsInfo"]["dsid"],
             }
             url = f"{self.service_endpoint}/changes/zone?{urlencode(params)}"
-            body = json.dumps(
-                {
-                    "zones": [
-                        {
-                            "zoneID": {
-                                "zoneName": "Notes",
-                                "zoneType": "REGULAR_CUSTOM_ZONE",
-                            },
-                            "desiredKeys": [
-                                "TitleEncrypted",
-                                "SnippetEncrypted",
-                                # "FirstAttachmentUTIEncrypted",
-                                # "FirstAttachmentThumbnail",
-                                # "FirstAttachmentThumbnailOrientation",
-                                "ModificationDate",
-                                "Deleted",
-                                # "Folders",
-                                "Folder",
-                                # "Attachments",
-                                "ParentFolder",
-                                "Note",
-                                # "LastViewedModificationDate",
-                                # "MinimumSupportedNotesVersion",
-                            ],
-                            "desiredRecordTypes": [
-                                # "Note",
-                                # "SearchIndexes",
-                                # "Folder",
-                                # "PasswordProtectedNote",
-                                # "User",
-                                # "Users",
-                                # "Note_UserSpecific",
-                                # "cloudkit.share",
-                            ],
-                            "syncToken": sync_token,
-                            "reverse": True,
-                        },
-                    ]
-                }
-            )
+            body = _changes_zone_body(sync_token)
 
             request = self.session.post(
                 url, data=body, headers={"Content-type": "text/plain"}
@@ -99,90 +60,15 @@ class NotesService:
         resolved_records = []
 
         for i in range(0, len(records), 50):
-            body = json.dumps(
-                {
-                    "records": [
-                        {"recordName": record["recordName"]}
-                        for record in records[i : i + 50]
-                    ],
-                    "zoneID": {
-                        "zoneName": "Notes",
-                    },
-                }
-            )
+            body = _lookup_body(records[i : i + 50])
 
             request = self.session.post(
                 url, data=body, headers={"Content-type": "text/plain"}
             )
 
-            def resolver(last, current):
-
-                # resolve notes
-                # moved handling of user specific notes, only resolve "Notes" here
-                if current["recordType"] in ["Note"]:
-                    # print("resolve note")
-                    current["fields"]["title"] = base64.b64decode(
-                        current["fields"]["TitleEncrypted"]["value"]
-                    ).decode("utf-8")
-                    # print(current["fields"]["title"])
-                    # grab snippet only if it exists
-                    if ("SnippetEncrypted" in current["fields"]):
-                        current["fields"]["snippet"] = base64.b64decode(
-                            current["fields"]["SnippetEncrypted"]["value"]
-                        ).decode("utf-8")
-                    else:
-                        current["fields"]["snippet"] = ""
-
-                    text_data = base64.b64decode(
-                        current["fields"]["TextDataEncrypted"]["value"]
-                    )
-                    text_data = (
-                        gzip.decompress(text_data)
-                        if text_data[0] == 0x1F and text_data[1] == 0x8B
-                        else zlib.decompress(text_data)
-                    )
-
-                    proto_document = Document()
-                    proto_document.ParseFromString(text_data)
-                    current["fields"]["TextData"] = MessageToDict(proto_document)
-
-                    version = proto_document.version
-
-                    proto_string = String()
-                    proto_string.ParseFromString(version[-1].data)
-                    current["fields"]["Text"] = MessageToDict(proto_string)
-
-                    last.append(current)
-
-                # resolve folders
-                if current["recordType"] in ["Folder"]:
-                    # print("resolve folder")
-                    # print(current["fields"])
-                    current["fields"]["title"] = base64.b64decode(
-                        current["fields"]["TitleEncrypted"]["value"]
-                    ).decode("utf-8")
-                    last.append(current)
-
-                # resolve timestamp
-
-                # TODO: resolve search indexes
-
-                # TODO: handle records of recordType Note_UserSpecific
-                # if current["recordType"] in ["Note_UserSpecific"]:
-                #     print("handle user specific note")
-                #     userSpecific_fields = current["fields"]
-                #     fields_list = []
-                #     for field in userSpecific_fields:
-                #         fields_list.append(field)
-                #     print(fields_list)
-                #     for item in current:
-                #         print(item)
-                #     print(current["fields"]["Note"])
-                #     print()
-
-                return last
-
-            resolved_records.extend(reduce(resolver, request.json()["records"], []))
+            resolved_records.extend(
+                reduce(_resolve_record, request.json()["records"], [])
+            )
 
         self.records = resolved_records
 
@@ -214,3 +100,126 @@ class NotesService:
         if folder_field:
             return folder_field["value"] == folder["recordName"]
         return False
+
+
+def _changes_zone_body(sync_token=None):
+    """Returns the body of a changes/zone request on the Notes zone."""
+    return json.dumps(
+        {
+            "zones": [
+                {
+                    "zoneID": {
+                        "zoneName": "Notes",
+                        "zoneType": "REGULAR_CUSTOM_ZONE",
+                    },
+                    "desiredKeys": [
+                        "TitleEncrypted",
+                        "SnippetEncrypted",
+                        # "FirstAttachmentUTIEncrypted",
+                        # "FirstAttachmentThumbnail",
+                        # "FirstAttachmentThumbnailOrientation",
+                        "ModificationDate",
+                        "Deleted",
+                        # "Folders",
+                        "Folder",
+                        # "Attachments",
+                        "ParentFolder",
+                        "Note",
+                        # "LastViewedModificationDate",
+                        # "MinimumSupportedNotesVersion",
+                    ],
+                    "desiredRecordTypes": [
+                        # "Note",
+                        # "SearchIndexes",
+                        # "Folder",
+                        # "PasswordProtectedNote",
+                        # "User",
+                        # "Users",
+                        # "Note_UserSpecific",
+                        # "cloudkit.share",
+                    ],
+                    "syncToken": sync_token,
+                    "reverse": True,
+                },
+            ]
+        }
+    )
+
+
+def _lookup_body(records):
+    """Returns the body of a records/lookup request."""
+    return json.dumps(
+        {
+            "records": [{"recordName": record["recordName"]} for record in records],
+            "zoneID": {
+                "zoneName": "Notes",
+            },
+        }
+    )
+
+
+def _resolve_record(last, current):
+    """Decodes a looked up Note or Folder record, skipping other types."""
+
+    # resolve notes
+    # moved handling of user specific notes, only resolve "Notes" here
+    if current["recordType"] in ["Note"]:
+        # print("resolve note")
+        current["fields"]["title"] = base64.b64decode(
+            current["fields"]["TitleEncrypted"]["value"]
+        ).decode("utf-8")
+        # print(current["fields"]["title"])
+        # grab snippet only if it exists
+        if "SnippetEncrypted" in current["fields"]:
+            current["fields"]["snippet"] = base64.b64decode(
+                current["fields"]["SnippetEncrypted"]["value"]
+            ).decode("utf-8")
+        else:
+            current["fields"]["snippet"] = ""
+
+        text_data = base64.b64decode(current["fields"]["TextDataEncrypted"]["value"])
+        text_data = (
+            gzip.decompress(text_data)
+            if text_data[0] == 0x1F and text_data[1] == 0x8B
+            else zlib.decompress(text_data)
+        )
+
+        proto_document = Document()
+        proto_document.ParseFromString(text_data)
+        current["fields"]["TextData"] = MessageToDict(proto_document)
+
+        version = proto_document.version
+
+        proto_string = String()
+        proto_string.ParseFromString(version[-1].data)
+        current["fields"]["Text"] = MessageToDict(proto_string)
+
+        last.append(current)
+
+    # resolve folders
+    if current["recordType"] in ["Folder"]:
+        # print("resolve folder")
+        # print(current["fields"])
+        current["fields"]["title"] = base64.b64decode(
+            current["fields"]["TitleEncrypted"]["value"]
+        ).decode("utf-8")
+        last.append(current)
+
+    # resolve timestamp
+
+    # TODO: resolve search indexes
+
+    # TODO: handle records of recordType Note_UserSpecific
+    # if current["recordType"] in ["Note_UserSpecific"]:
+    #     print("handle user specific note")
+    #     userSpecific_fields = current["fields"]
+    #     fields_list = []
+    #     for field in userSpecific_fields:
+    #         fields_list.append(field)
+    #     print(fields_list)
+    #     for item in current:
+    #         print(item)
+    #     print(current["fields"]["Note"])
+    #     print()
+
+    return last
@@ -0,0 +1,447 @@
+"""Local index of the photo library metadata."""
+import base64
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import logging
+import threading
+
+from pyicloud.exceptions import PyiCloudAPIResponseException
+
+LOGGER = logging.getLogger(__name__)
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS photos ("
+    "id TEXT PRIMARY KEY, "
+    "asset_id TEXT NOT NULL UNIQUE, "
+    "filename TEXT, "
+    "item_type TEXT, "
+    "size INTEGER, "
+    "width INTEGER, "
+    "height INTEGER, "
+    "asset_date INTEGER, "
+    "added_date INTEGER, "
+    "favorite INTEGER NOT NULL DEFAULT 0, "
+    "hidden INTEGER NOT NULL DEFAULT 0, "
+    "fingerprint TEXT"
+    ")",
+    "CREATE INDEX IF NOT EXISTS photos_asset_date ON photos (asset_date)",
+    "CREATE INDEX IF NOT EXISTS photos_added_date ON photos (added_date)",
+    "CREATE INDEX IF NOT EXISTS photos_type ON photos (item_type, asset_date)",
+    "CREATE INDEX IF NOT EXISTS photos_size ON photos (size)",
+    "CREATE INDEX IF NOT EXISTS photos_favorite ON photos (favorite, asset_date)",
+    "CREATE INDEX IF NOT EXISTS photos_hidden ON photos (hidden, asset_date)",
+    "CREATE INDEX IF NOT EXISTS photos_filename ON photos (filename)",
+    "CREATE INDEX IF NOT EXISTS photos_fingerprint ON photos (fingerprint)",
+    "CREATE TABLE IF NOT EXISTS albums (id TEXT PRIMARY KEY, name TEXT)",
+    "CREATE INDEX IF NOT EXISTS albums_name ON albums (name)",
+    "CREATE TABLE IF NOT EXISTS album_photos ("
+    "id TEXT PRIMARY KEY, "
+    "album_id TEXT NOT NULL, "
+    "asset_id TEXT NOT NULL"
+    ") WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS album_photos_album ON album_photos (album_id)",
+    "CREATE INDEX IF NOT EXISTS album_photos_asset ON album_photos (asset_id)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT) "
+    "WITHOUT ROWID",
+)
+
+COLUMNS = (
+    "id",
+    "asset_id",
+    "filename",
+    "item_type",
+    "size",
+    "width",
+    "height",
+    "asset_date",
+    "added_date",
+    "favorite",
+    "hidden",
+    "fingerprint",
+)
+
+# Listings with fewer fields (see FIELD_PROFILES) leave the fields
+# missing from them, passed as None, as indexed
+UPSERT_PHOTO = "INSERT INTO photos VALUES (%s) ON CONFLICT (id) DO UPDATE SET %s" % (
+    ", ".join(
+        "coalesce(?%d, 0)" % number
+        if column in ("favorite", "hidden")
+        else "?%d" % number
+        for number, column in enumerate(COLUMNS, 1)
+    ),
+    ", ".join(
+        "%s = coalesce(?%d, %s)" % (column, number, column)
+        for number, column in enumerate(COLUMNS, 1)
+        if column != "id"
+    ),
+)
+
+# Photos written per transaction when indexing an album
+BATCH_SIZE = 500
+
+# Prefix of the object type of the albums created by the user
+ALBUM_OBJ_TYPE = "CPLContainerRelationNotDeletedByAssetDate:"
+
+
+class IndexedPhoto(namedtuple("IndexedPhoto", COLUMNS)):
+    """Metadata of a photo, as indexed.
+
+    Dates are aware UTC datetimes, sizes are in bytes.
+    """
+
+    __slots__ = ()
+
+
+IndexSync = namedtuple("IndexSync", ["changed", "deleted", "full"])
+
+
+class PhotoIndex:
+    """Photo library metadata indexed in a SQLite database.
+
+    The decoded fields of the CPLMaster and CPLAsset records are stored
+    with the album membership, so questions such as "videos of 2021 over
+    500 MB" are answered from indexes, without network:
+
+        index = PhotoIndex('photos.db')
+        index.sync(api.photos)
+        index.query(item_type='movie', since=datetime(2021, 1, 1),
+                    until=datetime(2022, 1, 1), min_size=500e6)
+
+    `sync` indexes the changes since the former sync, a page of changes per
+    transaction, so an interrupted sync resumes where it stopped. As with
+    SQLiteSessionStore, each thread gets its own connection to the
+    database, which runs in WAL mode.
+    """
+
+    def __init__(self, database, timeout=30.0):
+        self.database = database
+        self.timeout = timeout
+        self._local = threading.local()
+
+        with self._transaction() as connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+    @property
+    def _connection(self):
+        """Gets the connection of the current thread."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            import sqlite3  # pylint: disable=import-outside-toplevel
+
+            connection = sqlite3.connect(
+                self.database, timeout=self.timeout, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def close(self):
+        """Closes the connection of the current thread."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    @property
+    def sync_token(self):
+        """Gets the sync token of the last sync, None before the first."""
+        row = self._connection.execute(
+            "SELECT value FROM meta WHERE key = 'sync_token'"
+        ).fetchone()
+        return row[0] if row else None
+
+    def sync(self, photos, full=False):
+        """Indexes the changes of the library since the last sync.
+
+        `photos` is the PhotosService of the account. The first sync, one
+        with `full` or one whose token expired indexes the whole library
+        again. Returns the IndexSync counts of the changes.
+        """
+        sync_token = None if full else self.sync_token
+        try:
+            return self._apply_changes(photos.iter_changes(sync_token))
+        except PyiCloudAPIResponseException as error:
+            if sync_token is None or error.code != "CHANGE_TOKEN_EXPIRED":
+                raise
+            LOGGER.debug("Photos sync token expired, indexing the whole library")
+            return self._apply_changes(photos.iter_changes())
+
+    def _apply_changes(self, pages):
+        changed = deleted = 0
+        full = False
+        for index, page in enumerate(pages):
+            with self._transaction() as connection:
+                if index == 0 and page.full:
+                    full = True
+                    for table in ("photos", "albums", "album_photos"):
+                        connection.execute("DELETE FROM %s" % table)
+                self._write_photos(connection, page.photos)
+                for record in page.records:
+                    self._write_record(connection, record)
+                self._delete(connection, page.deleted + page.deleted_records)
+                connection.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('sync_token', ?)",
+                    (page.sync_token,),
+                )
+            changed += len(page.photos)
+            deleted += len(page.deleted) + len(page.deleted_records)
+        LOGGER.debug("Indexed %d changed photos, %d deleted", changed, deleted)
+        return IndexSync(changed, deleted, full)
+
+    def add(self, photos):
+        """Indexes photos, an iterable of PhotoAsset. Returns their number."""
+        return self._add(photos)
+
+    def add_album(self, album):
+        """Indexes the photos of an album, and their membership.
+
+        Only the albums created by the user have members; smart albums
+        are answered by the photo fields.
+        """
+        album_id = None
+        if album.obj_type.startswith(ALBUM_OBJ_TYPE):
+            album_id = album.obj_type[len(ALBUM_OBJ_TYPE) :]
+            with self._transaction() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO albums VALUES (?, ?)",
+                    (album_id, album.name),
+                )
+                connection.execute(
+                    "DELETE FROM album_photos WHERE album_id = ?", (album_id,)
+                )
+        fields = "originals" if album.fields is None else None
+        return self._add(album.iter_photos(fields=fields), album_id)
+
+    def _add(self, photos, album_id=None):
+        count = 0
+        batch = []
+        for photo in photos:
+            batch.append(photo)
+            if len(batch) >= BATCH_SIZE:
+                count += self._add_batch(batch, album_id)
+                batch = []
+        if batch:
+            count += self._add_batch(batch, album_id)
+        return count
+
+    def _add_batch(self, photos, album_id):
+        with self._transaction() as connection:
+            self._write_photos(connection, photos)
+            if album_id is not None:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO album_photos VALUES (?, ?, ?)",
+                    [
+                        (
+                            "%s-IN-%s" % (photo.asset_id, album_id),
+                            album_id,
+                            photo.asset_id,
+                        )
+                        for photo in photos
+                    ],
+                )
+        return len(photos)
+
+    def remove(self, ids):
+        """Removes photos, or other records, by id."""
+        with self._transaction() as connection:
+            self._delete(connection, ids)
+
+    @staticmethod
+    def _write_photos(connection, photos):
+        rows = []
+        for photo in photos:
+            width, height = photo.dimensions
+            rows.append(
+                (
+                    photo.id,
+                    photo.asset_id,
+                    photo.filename,
+                    photo.item_type,
+                    photo.size,
+                    width,
+                    height,
+                    _timestamp(photo.asset_date),
+                    _timestamp(photo.added_date),
+                    photo.is_favorite,
+                    photo.is_hidden,
+                    photo.fingerprint,
+                )
+            )
+        connection.executemany(UPSERT_PHOTO, rows)
+
+    @staticmethod
+    def _write_record(connection, record):
+        """Indexes an album or album membership record."""
+        fields = record.get("fields", {})
+        deleted = fields.get("isDeleted", {}).get("value")
+        if record["recordType"] == "CPLAlbum":
+            if deleted:
+                PhotoIndex._delete(connection, [record["recordName"]])
+            elif "albumNameEnc" in fields:
+                connection.execute(
+                    "INSERT OR REPLACE INTO albums VALUES (?, ?)",
+                    (record["recordName"], _decode(fields["albumNameEnc"]["value"])),
+                )
+        elif record["recordType"] == "CPLContainerRelation":
+            if deleted:
+                PhotoIndex._delete(connection, [record["recordName"]])
+            elif "containerId" in fields and "itemId" in fields:
+                connection.execute(
+                    "INSERT OR REPLACE INTO album_photos VALUES (?, ?, ?)",
+                    (
+                        record["recordName"],
+                        fields["containerId"]["value"],
+                        fields["itemId"]["value"],
+                    ),
+                )
+
+    @staticmethod
+    def _delete(connection, ids):
+        for record_id in ids:
+            connection.execute(
+                "DELETE FROM album_photos WHERE id = ? OR album_id = ? OR asset_id "
+                "IN (SELECT asset_id FROM photos WHERE id = ? OR asset_id = ?)",
+                (record_id,) * 4,
+            )
+            connection.execute(
+                "DELETE FROM photos WHERE id = ? OR asset_id = ?",
+                (record_id, record_id),
+            )
+            connection.execute("DELETE FROM albums WHERE id = ?", (record_id,))
+
+    def query(self, order_by="asset_date", descending=False, limit=None, **filters):
+        """Returns the IndexedPhoto of the photos matching filters.
+
+        Filters:
+            item_type: 'image' or 'movie'
+            since, until: asset date range, `until` excluded
+            added_since, added_until: added date range, `added_until` excluded
+            min_size, max_size: original file size range, in bytes
+            favorite, hidden: True or False
+            album: name of an album the photos belong to
+            filename: file name, or glob pattern such as 'IMG_*.HEIC'
+            fingerprint: fingerprint of the original file
+        Naive datetimes are taken as UTC.
+        """
+        if order_by not in COLUMNS:
+            raise ValueError("Unknown column: %s" % order_by)
+        where, params = _where(filters)
+        sql = "SELECT %s FROM photos%s ORDER BY %s%s" % (
+            ", ".join(COLUMNS),
+            where,
+            order_by,
+            " DESC" if descending else "",
+        )
+        if limit is not None:
+            sql += " LIMIT %d" % limit
+        rows = self._connection.execute(sql, params)
+        return [_indexed_photo(row) for row in rows]
+
+    def count(self, **filters):
+        """Returns the number of photos matching filters, see `query`."""
+        where, params = _where(filters)
+        sql = "SELECT count(*) FROM photos" + where
+        return self._connection.execute(sql, params).fetchone()[0]
+
+    def get(self, photo_id):
+        """Returns the IndexedPhoto of a photo, or None."""
+        row = self._connection.execute(
+            "SELECT %s FROM photos WHERE id = ?" % ", ".join(COLUMNS), (photo_id,)
+        ).fetchone()
+        return _indexed_photo(row) if row else None
+
+    def albums(self):
+        """Returns the names of the albums indexed."""
+        rows = self._connection.execute("SELECT name FROM albums ORDER BY name")
+        return [row[0] for row in rows]
+
+    def __len__(self):
+        return self.count()
+
+
+def _where(filters):
+    """Returns the WHERE clause and parameters of query filters."""
+    conditions = []
+    params = []
+
+    def add(condition, *values):
+        conditions.append(condition)
+        params.extend(values)
+
+    filters = dict(filters)
+    for name, column, operator in (
+        ("item_type", "item_type", "="),
+        ("since", "asset_date", ">="),
+        ("until", "asset_date", "<"),
+        ("added_since", "added_date", ">="),
+        ("added_until", "added_date", "<"),
+        ("min_size", "size", ">="),
+        ("max_size", "size", "<="),
+        ("favorite", "favorite", "="),
+        ("hidden", "hidden", "="),
+        ("filename", "filename", "GLOB"),
+        ("fingerprint", "fingerprint", "="),
+    ):
+        value = filters.pop(name, None)
+        if value is None:
+            continue
+        if isinstance(value, datetime):
+            value = _timestamp(value)
+        elif isinstance(value, bool):
+            value = int(value)
+        add("%s %s ?" % (column, operator), value)
+
+    album = filters.pop("album", None)
+    if album is not None:
+        add(
+            "asset_id IN (SELECT asset_id FROM album_photos JOIN albums "
+            "ON albums.id = album_photos.album_id WHERE albums.name = ?)",
+            album,
+        )
+    if filters:
+        raise TypeError("Unknown filters: %s" % ", ".join(sorted(filters)))
+
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    return where, params
+
+
+def _timestamp(date):
+    """Returns a datetime in milliseconds since the epoch, as CloudKit does."""
+    if date is None:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return int(date.timestamp() * 1000)
+
+
+def _datetime(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp / 1000.0, timezone.utc)
+
+
+def _decode(value):
+    return base64.b64decode(value).decode("utf-8")
+
+
+def _indexed_photo(row):
+    row = list(row)
+    row[7] = _datetime(row[7])
+    row[8] = _datetime(row[8])
+    row[9] = bool(row[9])
+    row[10] = bool(row[10])
+    return IndexedPhoto(*row)
@@ -1,10 +1,189 @@
 """Photo service."""
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import contextvars
+from functools import partial
 import json
 import base64
+import logging
+import os
+import queue
+import threading
+import time
 from urllib.parse import urlencode
 
 from datetime import datetime, timezone
-from pyicloud.exceptions import PyiCloudServiceNotActivatedException
+from requests import RequestException
+
+from pyicloud import timeouts
+from pyicloud.exceptions import (
+    PyiCloudAPIResponseException,
+    PyiCloudException,
+    PyiCloudServiceNotActivatedException,
+)
+from pyicloud.retry import RetryPolicy
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Bytes written to disk at once by downloads
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Fields of the CPLMaster and CPLAsset records fetched by default
+DESIRED_KEYS = [
+    "resJPEGFullWidth",
+    "resJPEGFullHeight",
+    "resJPEGFullFileType",
+    "resJPEGFullFingerprint",
+    "resJPEGFullRes",
+    "resJPEGLargeWidth",
+    "resJPEGLargeHeight",
+    "resJPEGLargeFileType",
+    "resJPEGLargeFingerprint",
+    "resJPEGLargeRes",
+    "resJPEGMedWidth",
+    "resJPEGMedHeight",
+    "resJPEGMedFileType",
+    "resJPEGMedFingerprint",
+    "resJPEGMedRes",
+    "resJPEGThumbWidth",
+    "resJPEGThumbHeight",
+    "resJPEGThumbFileType",
+    "resJPEGThumbFingerprint",
+    "resJPEGThumbRes",
+    "resVidFullWidth",
+    "resVidFullHeight",
+    "resVidFullFileType",
+    "resVidFullFingerprint",
+    "resVidFullRes",
+    "resVidMedWidth",
+    "resVidMedHeight",
+    "resVidMedFileType",
+    "resVidMedFingerprint",
+    "resVidMedRes",
+    "resVidSmallWidth",
+    "resVidSmallHeight",
+    "resVidSmallFileType",
+    "resVidSmallFingerprint",
+    "resVidSmallRes",
+    "resSidecarWidth",
+    "resSidecarHeight",
+    "resSidecarFileType",
+    "resSidecarFingerprint",
+    "resSidecarRes",
+    "itemType",
+    "dataClassType",
+    "filenameEnc",
+    "originalOrientation",
+    "resOriginalWidth",
+    "resOriginalHeight",
+    "resOriginalFileType",
+    "resOriginalFingerprint",
+    "resOriginalRes",
+    "resOriginalAltWidth",
+    "resOriginalAltHeight",
+    "resOriginalAltFileType",
+    "resOriginalAltFingerprint",
+    "resOriginalAltRes",
+    "resOriginalVidComplWidth",
+    "resOriginalVidComplHeight",
+    "resOriginalVidComplFileType",
+    "resOriginalVidComplFingerprint",
+    "resOriginalVidComplRes",
+    "isDeleted",
+    "isExpunged",
+    "dateExpunged",
+    "remappedRef",
+    "recordName",
+    "recordType",
+    "recordChangeTag",
+    "masterRef",
+    "adjustmentRenderType",
+    "assetDate",
+    "addedDate",
+    "isFavorite",
+    "isHidden",
+    "orientation",
+    "duration",
+    "assetSubtype",
+    "assetSubtypeV2",
+    "assetHDRType",
+    "burstFlags",
+    "burstFlagsExt",
+    "burstId",
+    "captionEnc",
+    "locationEnc",
+    "locationV2Enc",
+    "locationLatitude",
+    "locationLongitude",
+    "adjustmentType",
+    "timeZoneOffset",
+    "vidComplDurValue",
+    "vidComplDurScale",
+    "vidComplDispValue",
+    "vidComplDispScale",
+    "vidComplVisibilityState",
+    "customRenderedValue",
+    "containerId",
+    "itemId",
+    "position",
+    "isKeyAsset",
+]
+
+# Fields of the other records listed by changes, such as CPLAlbum
+CHANGES_KEYS = DESIRED_KEYS + ["albumNameEnc", "albumType", "parentId"]
+
+# Keys pairing the CPLAsset records with their CPLMaster, always fetched
+RECORD_KEYS = [
+    "recordName",
+    "recordType",
+    "recordChangeTag",
+    "masterRef",
+    "isDeleted",
+]
+
+# Named sets of fields fetched when listing photos
+FIELD_PROFILES = {
+    "minimal": RECORD_KEYS
+    + [
+        "itemType",
+        "filenameEnc",
+        "assetDate",
+        "addedDate",
+        "isFavorite",
+        "isHidden",
+    ],
+}
+FIELD_PROFILES["originals"] = FIELD_PROFILES["minimal"] + [
+    "originalOrientation",
+    "resOriginalWidth",
+    "resOriginalHeight",
+    "resOriginalFileType",
+    "resOriginalFingerprint",
+    "resOriginalRes",
+]
+FIELD_PROFILES["full"] = DESIRED_KEYS
+
+# Session data key of the sync token of the library
+SYNC_TOKEN_KEY = "photos_sync_token"
+
+
+def desired_keys(fields=None):
+    """Returns the keys to fetch for a field profile name or set of fields.
+
+    None is the full profile; custom sets of fields get the keys pairing
+    assets with their master added.
+    """
+    if fields is None:
+        return DESIRED_KEYS
+    if isinstance(fields, str):
+        try:
+            return FIELD_PROFILES[fields]
+        except KeyError:
+            raise ValueError("Unknown field profile: %s" % fields) from None
+    keys = list(RECORD_KEYS)
+    keys.extend(key for key in fields if key not in keys)
+    return keys
 
 
 class PhotosService:
@@ -150,11 +329,7 @@ class PhotosService:
                 "Please try again in a few minutes."
             )
 
-        # TODO: Does syncToken ever change?  # pylint: disable=fixme
-        # self.params.update({
-        #     'syncToken': response['syncToken'],
-        #     'clientInstanceId': self.params.pop('clientId')
-        # })
+        # Changes since a former run are listed with sync() instead
 
         self._photo_assets = {}
 
@@ -180,30 +355,8 @@ class PhotosService:
                 ):
                     continue
 
-                folder_id = folder["recordName"]
-                folder_obj_type = (
-                    "CPLContainerRelationNotDeletedByAssetDate:%s" % folder_id
-                )
-                folder_name = base64.b64decode(
-                    folder["fields"]["albumNameEnc"]["value"]
-                ).decode("utf-8")
-                query_filter = [
-                    {
-                        "fieldName": "parentId",
-                        "comparator": "EQUALS",
-                        "fieldValue": {"type": "STRING", "value": folder_id},
-                    }
-                ]
-
-                album = PhotoAlbum(
-                    self,
-                    folder_name,
-                    "CPLContainerRelationLiveByAssetDate",
-                    folder_obj_type,
-                    "ASCENDING",
-                    query_filter,
-                )
-                self._albums[folder_name] = album
+                album = PhotoAlbum.from_folder(self, folder)
+                self._albums[album.name] = album
 
         return self._albums
 
@@ -226,9 +379,137 @@ class PhotosService:
         """Returns all photos."""
         return self.albums["All Photos"]
 
+    def download_all(self, dest, version="original", **kwargs):
+        """Downloads all the photos, see `PhotoAlbum.download_all`."""
+        return self.all.download_all(dest, version, **kwargs)
+
+    def sync(self, full=False):
+        """Yields the changes of the library since the last sync, by page.
+
+        Once the changes of a page are handled, its `commit` saves its sync
+        token with the session, so the next sync, even by another process,
+        resumes after it. The first sync, one with `full` or one whose token
+        expired lists the whole library.
+        """
+        sync_token = None
+        if not full:
+            sync_token = self.session.service.session_data.get(SYNC_TOKEN_KEY)
+        pages = self.iter_changes(sync_token)
+        try:
+            page = next(pages)
+        except PyiCloudAPIResponseException as error:
+            if sync_token is None or error.code != "CHANGE_TOKEN_EXPIRED":
+                raise
+            LOGGER.debug("Photos sync token expired, listing the whole library")
+            pages = self.iter_changes()
+            page = next(pages)
+        yield page
+        yield from pages
+
+    def iter_changes(self, sync_token=None):
+        """Yields the changes of the library since `sync_token`, by page.
+
+        Without a token, every photo is listed. Each PhotoChanges holds the
+        sync token to resume after it.
+        """
+        url = f"{self.service_endpoint}/changes/zone?{urlencode(self.params)}"
+        while True:
+            body = {
+                "zones": [
+                    {
+                        "zoneID": {"zoneName": "PrimarySync"},
+                        "desiredKeys": CHANGES_KEYS,
+                        "syncToken": sync_token,
+                        "reverse": False,
+                    }
+                ]
+            }
+            request = self.session.post(
+                url, data=json.dumps(body), headers={"Content-type": "text/plain"}
+            )
+            zone = request.json()["zones"][0]
+            if zone.get("serverErrorCode"):
+                raise PyiCloudAPIResponseException(
+                    zone.get("reason"), zone["serverErrorCode"]
+                )
+
+            changes = self._page_changes(zone["records"], zone["syncToken"])
+            changes.full = sync_token is None
+            yield changes
+            if not zone.get("moreComing"):
+                break
+            sync_token = zone["syncToken"]
+
+    def _page_changes(self, records, sync_token):
+        """Returns the changes of a page of changed records."""
+        assets = []
+        masters = {}
+        deleted = []
+        deleted_records = []
+        other_records = []
+        for record in records:
+            record_type = record.get("recordType")
+            if record.get("deleted"):
+                deleted_records.append(record["recordName"])
+            elif record_type == "CPLAsset":
+                master_id = record["fields"]["masterRef"]["value"]["recordName"]
+                if record["fields"].get("isDeleted", {}).get("value"):
+                    deleted.append(master_id)
+                else:
+                    assets.append(record)
+            elif record_type == "CPLMaster":
+                masters[record["recordName"]] = record
+            else:
+                other_records.append(record)
+
+        # Masters of the assets modified alone, or listed in another page
+        missing = [
+            asset["fields"]["masterRef"]["value"]["recordName"]
+            for asset in assets
+            if asset["fields"]["masterRef"]["value"]["recordName"] not in masters
+        ]
+        masters.update(self._lookup_records(missing))
+
+        photos = []
+        for asset in assets:
+            master = masters.get(asset["fields"]["masterRef"]["value"]["recordName"])
+            if master is not None:
+                photos.append(PhotoAsset(self, master, asset))
+        return PhotoChanges(
+            photos, deleted, deleted_records, other_records, sync_token, service=self
+        )
+
+    def _lookup_records(self, record_names):
+        """Returns the records with the given names, by name."""
+        url = f"{self.service_endpoint}/records/lookup?{urlencode(self.params)}"
+        records = {}
+        for i in range(0, len(record_names), 200):
+            body = {
+                "records": [
+                    {"recordName": record_name}
+                    for record_name in record_names[i : i + 200]
+                ],
+                "zoneID": {"zoneName": "PrimarySync"},
+                "desiredKeys": DESIRED_KEYS,
+            }
+            request = self.session.post(
+                url, data=json.dumps(body), headers={"Content-type": "text/plain"}
+            )
+            for record in request.json()["records"]:
+                if "recordType" in record:
+                    records[record["recordName"]] = record
+        return records
+
 
 class PhotoAlbum:
-    """A photo album."""
+    """A photo album.
+
+    `fields` selects the fields fetched for its photos: the name of a
+    profile of FIELD_PROFILES, a set of field names, or None for all.
+    The properties of the photos return None for fields not fetched.
+    With a `prefetch` depth, up to that many pages are listed ahead by a
+    background thread while the photos are consumed.
+    """
 
     def __init__(
         self,
@@ -239,6 +520,8 @@ class PhotoAlbum:
         direction,
         query_filter=None,
         page_size=100,
+        fields=None,
+        prefetch=0,
     ):
         self.name = name
         self.service = service
@@ -247,9 +530,36 @@ class PhotoAlbum:
         self.direction = direction
         self.query_filter = query_filter
         self.page_size = page_size
+        self.fields = fields
+        self.prefetch = prefetch
 
         self._len = None
 
+    @classmethod
+    def from_folder(cls, service, folder):
+        """Returns the album of a CPLAlbum folder record."""
+        folder_id = folder["recordName"]
+        folder_obj_type = "CPLContainerRelationNotDeletedByAssetDate:%s" % folder_id
+        folder_name = base64.b64decode(
+            folder["fields"]["albumNameEnc"]["value"]
+        ).decode("utf-8")
+        query_filter = [
+            {
+                "fieldName": "parentId",
+                "comparator": "EQUALS",
+                "fieldValue": {"type": "STRING", "value": folder_id},
+            }
+        ]
+
+        return cls(
+            service,
+            folder_name,
+            "CPLContainerRelationLiveByAssetDate",
+            folder_obj_type,
+            "ASCENDING",
+            query_filter,
+        )
+
     @property
     def title(self):
         """Gets the album name."""
@@ -260,34 +570,9 @@ class PhotoAlbum:
 
     def __len__(self):
         if self._len is None:
-            url = "{}/internal/records/query/batch?{}".format(
-                self.service.service_endpoint,
-                urlencode(self.service.params),
-            )
             request = self.service.session.post(
-                url,
-                data=json.dumps(
-                    {
-                        "batch": [
-                            {
-                                "resultsLimit": 1,
-                                "query": {
-                                    "filterBy": {
-                                        "fieldName": "indexCountID",
-                                        "fieldValue": {
-                                            "type": "STRING_LIST",
-                                            "value": [self.obj_type],
-                                        },
-                                        "comparator": "IN",
-                                    },
-                                    "recordType": "HyperionIndexCountLookup",
-                                },
-                                "zoneWide": True,
-                                "zoneID": {"zoneName": "PrimarySync"},
-                            }
-                        ]
-                    }
-                ),
+                self._count_query_url(),
+                data=json.dumps(self._count_query_gen()),
                 headers={"Content-type": "text/plain"},
             )
             response = request.json()
@@ -301,51 +586,182 @@ class PhotoAlbum:
     @property
     def photos(self):
         """Returns the album photos."""
+        return self.iter_photos()
+
+    def iter_photos(self, deadline=None, fields=None, prefetch=None):
+        """Yields the album photos.
+
+        `deadline` bounds the requests listing the photos to a number of
+        seconds, raising PyiCloudDeadlineExceededException once passed.
+        `fields` and `prefetch` override those of the album.
+        """
+        pages = self._iter_pages(timeouts.expiry(deadline), fields)
+        if prefetch is None:
+            prefetch = self.prefetch
+        if prefetch:
+            return _prefetch(pages, prefetch)
+        return (photo for page in pages for photo in page)
+
+    def _iter_pages(self, expires, fields):
+        """Yields the pages of album photos, until the deadline expires."""
         if self.direction == "DESCENDING":
-            offset = len(self) - 1
+            with timeouts.deadline(expires=expires):
+                offset = len(self) - 1
         else:
             offset = 0
 
         while True:
-            url = ("%s/records/query?" % self.service.service_endpoint) + urlencode(
-                self.service.params
-            )
-            request = self.service.session.post(
-                url,
-                data=json.dumps(
-                    self._list_query_gen(
-                        offset, self.list_type, self.direction, self.query_filter
-                    )
-                ),
-                headers={"Content-type": "text/plain"},
-            )
-            response = request.json()
+            with timeouts.deadline(expires=expires):
+                request = self.service.session.post(
+                    self._list_query_url(),
+                    data=json.dumps(
+                        self._list_query_gen(
+                            offset,
+                            self.list_type,
+                            self.direction,
+                            self.query_filter,
+                            fields,
+                        )
+                    ),
+                    headers={"Content-type": "text/plain"},
+                )
+                response = request.json()
 
-            asset_records = {}
-            master_records = []
-            for rec in response["records"]:
-                if rec["recordType"] == "CPLAsset":
-                    master_id = rec["fields"]["masterRef"]["value"]["recordName"]
-                    asset_records[master_id] = rec
-                elif rec["recordType"] == "CPLMaster":
-                    master_records.append(rec)
-
-            master_records_len = len(master_records)
-            if master_records_len:
+            photos = self._page_photos(response)
+            if photos:
                 if self.direction == "DESCENDING":
-                    offset = offset - master_records_len
+                    offset = offset - len(photos)
                 else:
-                    offset = offset + master_records_len
+                    offset = offset + len(photos)
 
-                for master_record in master_records:
-                    record_name = master_record["recordName"]
-                    yield PhotoAsset(
-                        self.service, master_record, asset_records[record_name]
-                    )
+                yield photos
             else:
                 break
 
-    def _list_query_gen(self, offset, list_type, direction, query_filter=None):
+    def download_all(
+        self,
+        dest,
+        version="original",
+        workers=4,
+        retries=3,
+        overwrite=False,
+        progress=None,
+    ):
+        """Downloads the album photos to the `dest` directory.
+
+        Downloads run on `workers` threads while the album pages are
+        listed; at most twice as many photos wait for a worker. Files are
+        streamed to disk, and skipped if already downloaded with the
+        expected size, unless `overwrite`. A failed download is retried
+        alone, up to `retries` times, with backoff.
+
+        `progress` is called with the DownloadResult of each photo and the
+        DownloadStats of the batch, from the worker threads, one call at a
+        time. Returns the DownloadResult of each photo, in completion order.
+        Unless the album selects its fields, originals are listed with the
+        fields of the originals profile only.
+        """
+        os.makedirs(dest, exist_ok=True)
+        retry_policy = RetryPolicy(max_retries=retries)
+        stats = DownloadStats()
+        results = []
+        results_lock = threading.Lock()
+        names = set()
+        pending = set()
+
+        def collect(photo, path, future):
+            error = future.exception()
+            if error is None:
+                result = future.result()
+            else:
+                stats.record(failed=1)
+                result = DownloadResult(photo, path, 0, error)
+            with results_lock:
+                results.append(result)
+                if progress is not None:
+                    progress(result, stats)
+
+        fields = None
+        if version == "original" and self.fields is None:
+            fields = "originals"
+
+        with ThreadPoolExecutor(
+            workers, thread_name_prefix="pyicloud-download"
+        ) as executor:
+            for photo in self.iter_photos(fields=fields):
+                if len(pending) >= workers * 2:
+                    pending = wait(pending, return_when=FIRST_COMPLETED).not_done
+                path = os.path.join(dest, _download_name(photo, version, names))
+                future = executor.submit(
+                    _download_photo,
+                    photo,
+                    version,
+                    path,
+                    retry_policy,
+                    overwrite,
+                    stats,
+                )
+                future.add_done_callback(partial(collect, photo, path))
+                pending.add(future)
+
+        LOGGER.debug("Downloaded %s: %s", self, stats)
+        return results
+
+    def _count_query_url(self):
+        return "{}/internal/records/query/batch?{}".format(
+            self.service.service_endpoint,
+            urlencode(self.service.params),
+        )
+
+    def _count_query_gen(self):
+        return {
+            "batch": [
+                {
+                    "resultsLimit": 1,
+                    "query": {
+                        "filterBy": {
+                            "fieldName": "indexCountID",
+                            "fieldValue": {
+                                "type": "STRING_LIST",
+                                "value": [self.obj_type],
+                            },
+                            "comparator": "IN",
+                        },
+                        "recordType": "HyperionIndexCountLookup",
+                    },
+                    "zoneWide": True,
+                    "zoneID": {"zoneName": "PrimarySync"},
+                }
+            ]
+        }
+
+    def _list_query_url(self):
+        return ("%s/records/query?" % self.service.service_endpoint) + urlencode(
+            self.service.params
+        )
+
+    def _page_photos(self, response):
+        """Returns the photos of a page of query results."""
+        asset_records = {}
+        master_records = []
+        for rec in response["records"]:
+            if rec["recordType"] == "CPLAsset":
+                master_id = rec["fields"]["masterRef"]["value"]["recordName"]
+                asset_records[master_id] = rec
+            elif rec["recordType"] == "CPLMaster":
+                master_records.append(rec)
+
+        return [
+            self._make_photo(master_record, asset_records[master_record["recordName"]])
+            for master_record in master_records
+        ]
+
+    def _make_photo(self, master_record, asset_record):
+        return PhotoAsset(self.service, master_record, asset_record)
+
+    def _list_query_gen(
+        self, offset, list_type, direction, query_filter=None, fields=None
+    ):
         query = {
             "query": {
                 "filterBy": [
@@ -363,105 +779,7 @@ class PhotoAlbum:
                 "recordType": list_type,
             },
             "resultsLimit": self.page_size * 2,
-            "desiredKeys": [
-                "resJPEGFullWidth",
-                "resJPEGFullHeight",
-                "resJPEGFullFileType",
-                "resJPEGFullFingerprint",
-                "resJPEGFullRes",
-                "resJPEGLargeWidth",
-                "resJPEGLargeHeight",
-                "resJPEGLargeFileType",
-                "resJPEGLargeFingerprint",
-                "resJPEGLargeRes",
-                "resJPEGMedWidth",
-                "resJPEGMedHeight",
-                "resJPEGMedFileType",
-                "resJPEGMedFingerprint",
-                "resJPEGMedRes",
-                "resJPEGThumbWidth",
-                "resJPEGThumbHeight",
-                "resJPEGThumbFileType",
-                "resJPEGThumbFingerprint",
-                "resJPEGThumbRes",
-                "resVidFullWidth",
-                "resVidFullHeight",
-                "resVidFullFileType",
-                "resVidFullFingerprint",
-                "resVidFullRes",
-                "resVidMedWidth",
-                "resVidMedHeight",
-                "resVidMedFileType",
-                "resVidMedFingerprint",
-                "resVidMedRes",
-                "resVidSmallWidth",
-                "resVidSmallHeight",
-                "resVidSmallFileType",
-                "resVidSmallFingerprint",
-                "resVidSmallRes",
-                "resSidecarWidth",
-                "resSidecarHeight",
-                "resSidecarFileType",
-                "resSidecarFingerprint",
-                "resSidecarRes",
-                "itemType",
-                "dataClassType",
-                "filenameEnc",
-                "originalOrientation",
-                "resOriginalWidth",
-                "resOriginalHeight",
-                "resOriginalFileType",
-                "resOriginalFingerprint",
-                "resOriginalRes",
-                "resOriginalAltWidth",
-                "resOriginalAltHeight",
-                "resOriginalAltFileType",
-                "resOriginalAltFingerprint",
-                "resOriginalAltRes",
-                "resOriginalVidComplWidth",
-                "resOriginalVidComplHeight",
-                "resOriginalVidComplFileType",
-                "resOriginalVidComplFingerprint",
-                "resOriginalVidComplRes",
-                "isDeleted",
-                "isExpunged",
-                "dateExpunged",
-                "remappedRef",
-                "recordName",
-                "recordType",
-                "recordChangeTag",
-                "masterRef",
-                "adjustmentRenderType",
-                "assetDate",
-                "addedDate",
-                "isFavorite",
-                "isHidden",
-                "orientation",
-                "duration",
-                "assetSubtype",
-                "assetSubtypeV2",
-                "assetHDRType",
-                "burstFlags",
-                "burstFlagsExt",
-                "burstId",
-                "captionEnc",
-                "locationEnc",
-                "locationV2Enc",
-                "locationLatitude",
-                "locationLongitude",
-                "adjustmentType",
-                "timeZoneOffset",
-                "vidComplDurValue",
-                "vidComplDurScale",
-                "vidComplDispValue",
-                "vidComplDispScale",
-                "vidComplVisibilityState",
-                "customRenderedValue",
-                "containerId",
-                "itemId",
-                "position",
-                "isKeyAsset",
-            ],
+            "desiredKeys": desired_keys(fields or self.fields),
             "zoneID": {"zoneName": "PrimarySync"},
         }
 
@@ -477,6 +795,233 @@ class PhotoAlbum:
         return f"<{type(self).__name__}: '{self}'>"
 
 
+class PhotoChanges:
+    """Changes of the photo library since a sync token.
+
+    `photos` are the photos added or modified and `deleted` the ids of
+    those deleted. `deleted_records` are the names of the records removed,
+    of any type: photo masters and assets, albums... `records` holds the
+    other records changed, such as albums. `full` is True for changes
+    listing the whole library, not a sync token's delta.
+    """
+
+    def __init__(
+        self,
+        photos,
+        deleted,
+        deleted_records,
+        records,
+        sync_token,
+        full=False,
+        service=None,
+    ):
+        self.photos = photos
+        self.deleted = deleted
+        self.deleted_records = deleted_records
+        self.records = records
+        self.sync_token = sync_token
+        self.full = full
+        self.service = service
+
+    def commit(self):
+        """Saves the sync token of the changes, once they are handled."""
+        session = self.service.session
+        with session.lock:
+            session.service.session_data[SYNC_TOKEN_KEY] = self.sync_token
+        session.writer.mark_dirty(session_data=True)
+        session.writer.flush()
+
+    def __repr__(self):
+        return (
+            f"<{type(self).__name__}: {len(self.photos)} photos changed, "
+            f"{len(self.deleted) + len(self.deleted_records)} deleted>"
+        )
+
+
+class DownloadResult(namedtuple("DownloadResult", ["photo", "path", "size", "error"])):
+    """Outcome of the download of a photo: its file, or the error raised.
+
+    The path is None for photos without the version downloaded.
+    """
+
+    __slots__ = ()
+
+    @property
+    def ok(self):  # pylint: disable=invalid-name
+        """Returns True if the download succeeded."""
+        return self.error is None
+
+
+class DownloadStats:
+    """Progress of a bulk download, updated by its worker threads."""
+
+    def __init__(self):
+        self.downloaded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.retries = 0
+        self.bytes = 0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        """Gets the number of photos processed."""
+        return self.downloaded + self.skipped + self.failed
+
+    @property
+    def elapsed(self):
+        """Gets the seconds elapsed since the download started."""
+        return time.monotonic() - self._started
+
+    @property
+    def throughput(self):
+        """Gets the bytes downloaded per second."""
+        elapsed = self.elapsed
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def record(self, downloaded=0, skipped=0, failed=0, retries=0, size=0):
+        """Records the outcome of downloads."""
+        with self._lock:
+            self.downloaded += downloaded
+            self.skipped += skipped
+            self.failed += failed
+            self.retries += retries
+            self.bytes += size
+
+    def __repr__(self):
+        return (
+            f"<{type(self).__name__}: {self.downloaded} downloaded, "
+            f"{self.skipped} skipped, {self.failed} failed, "
+            f"{self.throughput / 1e6:.1f} MB/s>"
+        )
+
+
+def _prefetch(pages, depth):
+    """Yields the items of `pages`, listed up to `depth` pages ahead.
+
+    The pages are listed by a thread, in the context of the caller, and
+    wait in a queue of `depth` pages; the listing pauses while the queue
+    is full, and stops once the generator is closed. Errors are raised to
+    the consumer.
+    """
+    buffer = queue.Queue(depth)
+    stopped = threading.Event()
+
+    def put(page, error=None):
+        """Queues a page, returns False once the consumer is gone."""
+        if not stopped.is_set():
+            buffer.put((page, error))
+        return not stopped.is_set()
+
+    def produce():
+        try:
+            for page in pages:
+                if not put(page):
+                    return
+        except BaseException as error:  # pylint: disable=broad-except
+            put(None, error)
+            return
+        put(None)
+
+    thread = threading.Thread(
+        target=contextvars.copy_context().run,
+        args=(produce,),
+        name="pyicloud-prefetch",
+        daemon=True,
+    )
+    thread.start()
+    try:
+        while True:
+            page, error = buffer.get()
+            if error is not None:
+                raise error
+            if page is None:
+                return
+            yield from page
+    finally:
+        # Unblock the thread, which puts at most one more page once stopped
+        stopped.set()
+        while not buffer.empty():
+            buffer.get_nowait()
+
+
+def _download_name(photo, version, names):
+    """Returns a file name for a photo version not in `names`, and adds it.
+
+    Photos sharing a name get their id appended, so names are stable
+    across runs. The ids are base64: their separators are re-encoded
+    URL-safe, as they may contain slashes.
+    """
+    photo_id = photo.id.replace("+", "-").replace("/", "_").rstrip("=")
+    if photo.filename:
+        root, ext = os.path.splitext(os.path.basename(photo.filename))
+    else:
+        root, ext = photo_id, ""
+    if version != "original":
+        root = "%s_%s" % (root, version)
+    name = root + ext
+    if name in names:
+        name = "%s_%s%s" % (root, photo_id[:12], ext)
+    names.add(name)
+    return name
+
+
+def _download_photo(photo, version, path, retry_policy, overwrite, stats):
+    """Downloads a photo version to a file, retrying failures."""
+    if version not in photo.versions:
+        stats.record(skipped=1)
+        return DownloadResult(photo, None, 0, None)
+
+    size = photo.versions[version]["size"]
+    if not overwrite and os.path.exists(path) and size == os.path.getsize(path):
+        stats.record(skipped=1)
+        return DownloadResult(photo, path, size, None)
+
+    retry = 0
+    while True:
+        try:
+            written = _stream_to_file(photo.download(version), path)
+            if size is not None and written != size:
+                raise IOError("Downloaded %d bytes of %d" % (written, size))
+            stats.record(downloaded=1, size=written)
+            return DownloadResult(photo, path, written, None)
+        except (RequestException, PyiCloudException, IOError) as error:
+            if retry >= retry_policy.max_retries:
+                LOGGER.warning("Failed to download %s: %s", photo.filename, error)
+                stats.record(failed=1)
+                return DownloadResult(photo, path, 0, error)
+            delay = retry_policy.backoff(retry)
+            LOGGER.debug(
+                "Failed to download %s: %s, retrying in %.2fs",
+                photo.filename,
+                error,
+                delay,
+            )
+            retry += 1
+            stats.record(retries=1)
+            time.sleep(delay)
+
+
+def _stream_to_file(response, path):
+    """Writes a streamed response to a file, returns its size."""
+    part_path = path + ".part"
+    written = 0
+    try:
+        with open(part_path, "wb") as part:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                part.write(chunk)
+                written += len(chunk)
+        os.replace(part_path, path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.unlink(part_path)
+        raise
+    finally:
+        response.close()
+    return written
+
+
 class PhotoAsset:
     """A photo."""
 
@@ -499,22 +1044,77 @@ class PhotoAsset:
         "thumb": "resVidSmall",
     }
 
+    ITEM_TYPES = {
+        "public.heic": "image",
+        "public.heif": "image",
+        "public.jpeg": "image",
+        "public.png": "image",
+        "public.tiff": "image",
+        "com.compuserve.gif": "image",
+        "org.webmproject.webp": "image",
+        "com.adobe.raw-image": "image",
+        "public.camera-raw-image": "image",
+        "com.apple.quicktime-movie": "movie",
+        "com.apple.m4v-video": "movie",
+        "public.mpeg-4": "movie",
+        "public.mpeg": "movie",
+        "public.avi": "movie",
+        "public.3gpp": "movie",
+        "public.3gpp2": "movie",
+    }
+
     @property
     def id(self):
         """Gets the photo id."""
         return self._master_record["recordName"]
 
+    @property
+    def asset_id(self):
+        """Gets the id of the photo asset record."""
+        return self._asset_record["recordName"]
+
+    @property
+    def item_type(self):
+        """Gets the photo type: 'image' or 'movie'."""
+        fields = self._master_record["fields"]
+        item_type = fields.get("itemType", {}).get("value")
+        if item_type in self.ITEM_TYPES:
+            return self.ITEM_TYPES[item_type]
+        if "resVidSmallRes" in fields:
+            return "movie"
+        return None if item_type is None else "image"
+
+    @property
+    def is_favorite(self):
+        """Returns True if the photo is a favorite."""
+        favorite = self._asset_record["fields"].get("isFavorite")
+        return bool(favorite["value"]) if favorite else None
+
+    @property
+    def is_hidden(self):
+        """Returns True if the photo is hidden."""
+        hidden = self._asset_record["fields"].get("isHidden")
+        return bool(hidden["value"]) if hidden else None
+
+    @property
+    def fingerprint(self):
+        """Gets the fingerprint of the original file."""
+        fingerprint = self._master_record["fields"].get("resOriginalFingerprint")
+        return fingerprint["value"] if fingerprint else None
+
     @property
     def filename(self):
         """Gets the photo file name."""
-        return base64.b64decode(
-            self._master_record["fields"]["filenameEnc"]["value"]
-        ).decode("utf-8")
+        filename = self._master_record["fields"].get("filenameEnc")
+        if filename is None:
+            return None
+        return base64.b64decode(filename["value"]).decode("utf-8")
 
     @property
     def size(self):
         """Gets the photo size."""
-        return self._master_record["fields"]["resOriginalRes"]["value"]["size"]
+        original = self._master_record["fields"].get("resOriginalRes")
+        return original["value"]["size"] if original else None
 
     @property
     def created(self):
@@ -524,26 +1124,30 @@ class PhotoAsset:
     @property
     def asset_date(self):
         """Gets the photo asset date."""
-        try:
-            return datetime.utcfromtimestamp(
-                self._asset_record["fields"]["assetDate"]["value"] / 1000.0
-            ).replace(tzinfo=timezone.utc)
-        except KeyError:
-            return datetime.utcfromtimestamp(0).replace(tzinfo=timezone.utc)
+        asset_date = self._asset_record["fields"].get("assetDate")
+        if asset_date is None:
+            return None
+        return datetime.utcfromtimestamp(asset_date["value"] / 1000.0).replace(
+            tzinfo=timezone.utc
+        )
 
     @property
     def added_date(self):
         """Gets the photo added date."""
-        return datetime.utcfromtimestamp(
-            self._asset_record["fields"]["addedDate"]["value"] / 1000.0
-        ).replace(tzinfo=timezone.utc)
+        added_date = self._asset_record["fields"].get("addedDate")
+        if added_date is None:
+            return None
+        return datetime.utcfromtimestamp(added_date["value"] / 1000.0).replace(
+            tzinfo=timezone.utc
+        )
 
     @property
     def dimensions(self):
-        """Gets the photo dimensions."""
+        """Gets the photo dimensions, (None, None) if not fetched."""
+        fields = self._master_record["fields"]
         return (
-            self._master_record["fields"]["resOriginalWidth"]["value"],
-            self._master_record["fields"]["resOriginalHeight"]["value"],
+            fields.get("resOriginalWidth", {}).get("value"),
+            fields.get("resOriginalHeight", {}).get("value"),
         )
 
     @property
@@ -602,11 +1206,13 @@ class PhotoAsset:
 
     def delete(self):
         """Deletes the photo."""
-        json_data = (
-            '{"query":{"recordType":"CheckIndexingState"},'
-            '"zoneID":{"zoneName":"PrimarySync"}}'
+        url, json_data = self._delete_request()
+        return self._service.session.post(
+            url, data=json_data, headers={"Content-type": "text/plain"}
         )
 
+    def _delete_request(self):
+        """Returns the URL and body of the request deleting the photo."""
         json_data = (
             '{"operations":[{'
             '"operationType":"update",'
@@ -630,9 +1236,7 @@ class PhotoAsset:
         params = urlencode(self._service.params)
         url = f"{endpoint}/records/modify?{params}"
 
-        return self._service.session.post(
-            url, data=json_data, headers={"Content-type": "text/plain"}
-        )
+        return url, json_data
 
     def __repr__(self):
         return f"<{type(self).__name__}: id={self.id}>"
@@ -0,0 +1,603 @@
+"""Session persistence."""
+import atexit
+from contextlib import contextmanager
+import http.cookiejar as cookielib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import weakref
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+
+LOGGER = logging.getLogger(__name__)
+
+_WRITERS = weakref.WeakSet()
+
+# Seconds between the writes of the session changes, by default
+FLUSH_INTERVAL = 1.0
+
+# Seconds between the writes of deferred changes, without a flush interval
+DEFERRED_FLUSH_INTERVAL = 1.0
+
+
+def atomic_write(filename, writer, mode="w", encoding="utf-8"):
+    """Writes a file atomically.
+
+    `writer` is called with an open temporary file located next to
+    `filename`, which then replaces `filename` in a single rename.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=".%s." % os.path.basename(filename), dir=directory
+    )
+    try:
+        with os.fdopen(fd, mode, encoding=None if "b" in mode else encoding) as tmp:
+            writer(tmp)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.replace(tmp_path, filename)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def save_cookiejar(cookiejar, filename):
+    """Saves a file based cookie jar atomically."""
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=".%s." % os.path.basename(filename), dir=directory
+    )
+    os.close(fd)
+    try:
+        cookiejar.save(tmp_path, ignore_discard=True, ignore_expires=True)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _cookie_key(cookie):
+    return (cookie.domain, cookie.path, cookie.name)
+
+
+def list_cookies(cookiejar):
+    """Returns the cookies of a jar, safely against concurrent updates."""
+    lock = getattr(cookiejar, "_cookies_lock", None)
+    if lock is None:
+        return list(cookiejar)
+    with lock:
+        return list(cookiejar)
+
+
+class SessionCookieJar(cookielib.LWPCookieJar):
+    """LWP cookie jar iterable while other threads update it.
+
+    Requests iterates the session cookies to prepare each request, while
+    the responses of other threads set cookies.
+    """
+
+    def __iter__(self):
+        with self._cookies_lock:
+            return iter(list(super().__iter__()))
+
+    def __len__(self):
+        with self._cookies_lock:
+            return super().__len__()
+
+
+def cookie_snapshot(cookiejar):
+    """Returns a comparable snapshot of the cookies of a jar."""
+    return {
+        _cookie_key(cookie): (cookie.value, cookie.expires)
+        for cookie in list_cookies(cookiejar)
+    }
+
+
+class SessionStore:
+    """Base class of the session stores.
+
+    A store persists, per account, the session data and the cookies of a
+    `PyiCloudService`. Several services, possibly in different processes,
+    can share an account: `update` merges the changes of one of them into
+    the stored state instead of replacing it, and returns the merged state.
+
+    Subclasses implement `accounts`, `_read`, `_write` and, when the
+    backend is shared between processes, `_lock`.
+    """
+
+    def accounts(self):
+        """Returns the keys of the stored accounts."""
+        raise NotImplementedError
+
+    def load(self, account):
+        """Returns the stored (session_data, cookiejar) of an account."""
+        with self._lock(account, shared=True):
+            return self._read(account)
+
+    def save(self, account, session_data, cookiejar):
+        """Replaces the stored session data and cookies of an account."""
+        with self._lock(account):
+            self._write(account, session_data, cookiejar)
+
+    def update(self, account, data_changes, cookie_changes=(), removed_cookies=()):
+        """Merges changes into the stored state of an account.
+
+        `data_changes` is a dict of session data values to set,
+        `cookie_changes` an iterable of cookies to set and `removed_cookies`
+        an iterable of (domain, path, name) keys of cookies to remove.
+        Returns the merged (session_data, cookiejar).
+        """
+        with self._lock(account):
+            session_data, cookiejar = self._read(account)
+
+            session_data.update(data_changes)
+
+            cookies_changed = False
+            for cookie in cookie_changes:
+                cookiejar.set_cookie(cookie)
+                cookies_changed = True
+            for domain, cookie_path, name in removed_cookies:
+                try:
+                    cookiejar.clear(domain, cookie_path, name)
+                    cookies_changed = True
+                except KeyError:
+                    pass
+
+            self._write(
+                account,
+                session_data if data_changes else None,
+                cookiejar if cookies_changed else None,
+            )
+            return session_data, cookiejar
+
+    @contextmanager
+    def _lock(self, account, shared=False):  # pylint: disable=unused-argument
+        """Locks the stored state of an account."""
+        yield
+
+    def _read(self, account):
+        """Reads the (session_data, cookiejar) of an account."""
+        raise NotImplementedError
+
+    def _write(self, account, session_data=None, cookiejar=None):
+        """Writes the session data and/or the cookies of an account."""
+        raise NotImplementedError
+
+
+class FileSessionStore(SessionStore):
+    """Stores each account as a session file and an LWP cookie jar.
+
+    Files are replaced atomically, and read-merge-write cycles are
+    serialized across processes with an `fcntl` lock on `<account>.lock`.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def accounts(self):
+        return sorted(
+            filename[: -len(".session")]
+            for filename in os.listdir(self.directory)
+            if filename.endswith(".session") and not filename.startswith(".")
+        )
+
+    def session_path(self, account):
+        """Gets path for session data file."""
+        return os.path.join(self.directory, account + ".session")
+
+    def cookiejar_path(self, account):
+        """Gets path for cookiejar file."""
+        return os.path.join(self.directory, account)
+
+    @contextmanager
+    def _lock(self, account, shared=False):
+        if fcntl is None:
+            yield
+            return
+
+        lock_path = os.path.join(self.directory, account + ".lock")
+        with open(lock_path, "a", encoding="utf-8") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _read(self, account):
+        session_data = {}
+        try:
+            with open(self.session_path(account), encoding="utf-8") as session_f:
+                session_data = json.load(session_f)
+        except:  # pylint: disable=bare-except
+            LOGGER.info("Session file does not exist")
+
+        cookiejar_path = self.cookiejar_path(account)
+        cookiejar = cookielib.LWPCookieJar(filename=cookiejar_path)
+        if os.path.exists(cookiejar_path):
+            try:
+                cookiejar.load(ignore_discard=True, ignore_expires=True)
+                LOGGER.debug("Read cookies from %s", cookiejar_path)
+            except:  # pylint: disable=bare-except
+                # Most likely a pickled cookiejar from earlier versions.
+                # The cookiejar will get replaced with a valid one after
+                # successful authentication.
+                LOGGER.warning("Failed to read cookiejar %s", cookiejar_path)
+
+        return session_data, cookiejar
+
+    def _write(self, account, session_data=None, cookiejar=None):
+        if session_data is not None:
+            atomic_write(
+                self.session_path(account),
+                lambda outfile: json.dump(session_data, outfile),
+            )
+            LOGGER.debug("Saved session data to file")
+
+        if cookiejar is not None:
+            cookiejar_path = self.cookiejar_path(account)
+            save_cookiejar(cookiejar, cookiejar_path)
+            LOGGER.debug("Cookies saved to %s", cookiejar_path)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Stores the sessions of many accounts in a single SQLite database.
+
+    The database runs in WAL mode, so readers never wait on writers, and
+    accounts are looked up through the primary key index. Read-merge-write
+    cycles run in `BEGIN IMMEDIATE` transactions, which serializes them
+    across threads and processes sharing the database.
+    """
+
+    LWP_HEADER = "#LWP-Cookies-2.0\n"
+
+    def __init__(self, database, timeout=30.0):
+        self.database = database
+        self.timeout = timeout
+        self._local = threading.local()
+
+        connection = self._connection
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "account TEXT PRIMARY KEY, "
+            "session_data TEXT NOT NULL DEFAULT '{}', "
+            "cookies TEXT NOT NULL DEFAULT '', "
+            "updated_at REAL NOT NULL DEFAULT (julianday('now'))"
+            ") WITHOUT ROWID"
+        )
+
+    @property
+    def _connection(self):
+        """Gets the connection of the current thread."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            import sqlite3  # pylint: disable=import-outside-toplevel
+
+            connection = sqlite3.connect(
+                self.database, timeout=self.timeout, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        """Closes the connection of the current thread."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def accounts(self):
+        rows = self._connection.execute("SELECT account FROM sessions ORDER BY 1")
+        return [row[0] for row in rows]
+
+    @contextmanager
+    def _lock(self, account, shared=False):
+        if shared:
+            yield
+            return
+
+        connection = self._connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _read(self, account):
+        row = self._connection.execute(
+            "SELECT session_data, cookies FROM sessions WHERE account = ?",
+            (account,),
+        ).fetchone()
+
+        cookiejar = cookielib.LWPCookieJar()
+        if row is None:
+            return {}, cookiejar
+
+        session_data = json.loads(row[0])
+        if row[1]:
+            # pylint: disable=protected-access
+            cookiejar._really_load(
+                io.StringIO(self.LWP_HEADER + row[1]), self.database, True, True
+            )
+        return session_data, cookiejar
+
+    def _write(self, account, session_data=None, cookiejar=None):
+        if session_data is None and cookiejar is None:
+            return
+
+        columns = {}
+        if session_data is not None:
+            columns["session_data"] = json.dumps(session_data)
+        if cookiejar is not None:
+            columns["cookies"] = cookiejar.as_lwp_str(
+                ignore_discard=True, ignore_expires=True
+            )
+
+        names = ", ".join(columns)
+        updates = ", ".join("%s = excluded.%s" % (name, name) for name in columns)
+        self._connection.execute(
+            "INSERT INTO sessions (account, %s) VALUES (?%s) "
+            "ON CONFLICT (account) DO UPDATE SET %s, updated_at = julianday('now')"
+            % (names, ", ?" * len(columns), updates),
+            (account, *columns.values()),
+        )
+
+
+def migrate_sessions(source, destination, accounts=None, overwrite=False):
+    """Copies sessions from a store to another one.
+
+    For instance, to move from the session files layout to SQLite:
+
+        migrate_sessions(
+            FileSessionStore(cookie_directory),
+            SQLiteSessionStore(database),
+        )
+
+    Accounts already in `destination` are left untouched unless
+    `overwrite` is set. Returns the keys of the migrated accounts.
+    """
+    if accounts is None:
+        accounts = source.accounts()
+    existing = set() if overwrite else set(destination.accounts())
+
+    migrated = []
+    for account in accounts:
+        if account in existing:
+            continue
+        session_data, cookiejar = source.load(account)
+        destination.save(account, session_data, cookiejar)
+        migrated.append(account)
+        LOGGER.debug("Migrated session of %s", account)
+    return migrated
+
+
+class SessionWriter:
+    """Write-behind persistence of the session data and cookie jar.
+
+    The session marks what changed; nothing is written for requests that
+    changed neither a tracked header nor a cookie. A background thread
+    writes pending changes every `flush_interval` seconds, off the request
+    path, and a final flush happens on `close()` and at exit. With a
+    `flush_interval` of 0, changes are written as soon as they are marked,
+    except those marked with `defer`: they are always left to the
+    background thread, for callers which must not block on the store,
+    such as an event loop.
+
+    Only the values that changed since the last synchronization with the
+    store are written, so services sharing an account through the store
+    merge their changes rather than clobbering each other's.
+
+    `lock` is the lock guarding the session state. It is only held while
+    the state is read or adopted, not while the store is written: writes
+    are serialized by a lock of their own, which is never held while
+    waiting for the state, so threads holding the state can still write.
+    Snapshots of the state are numbered, so that an older one is neither
+    written nor adopted after a newer one.
+    """
+
+    def __init__(self, service, flush_interval=FLUSH_INTERVAL, lock=None):
+        self.service = service
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._state_lock = lock or threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._snapshots = 0
+        self._written = 0
+        self._adopted = 0
+        self._session_dirty = False
+        self._cookies_dirty = False
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self._synced_data = {}
+        self._synced_cookies = {}
+
+        _WRITERS.add(self)
+
+    @property
+    def dirty(self):
+        """Returns True if changes are waiting to be written."""
+        return self._session_dirty or self._cookies_dirty
+
+    def load(self):
+        """Loads the session data and cookies of the service from the store."""
+        with self._state_lock:
+            self._snapshots += 1
+            snapshot = self._snapshots
+        with self._flush_lock:
+            session_data, cookiejar = self.service.session_store.load(
+                self.service.account_key
+            )
+        with self._state_lock:
+            if snapshot > self._adopted:
+                self._adopted = snapshot
+                self._adopt(session_data, cookiejar)
+
+    def cookies_changed(self, cookies):
+        """Returns True if cookies received differ from those in the store."""
+        synced = self._synced_cookies
+        return any(
+            synced.get(_cookie_key(cookie)) != (cookie.value, cookie.expires)
+            for cookie in cookies
+        )
+
+    def mark_dirty(self, session_data=False, cookies=False, defer=False):
+        """Records that the session data and/or cookies changed.
+
+        With `defer`, they are written by the background thread even
+        without a flush interval, and at exit once the writer is closed.
+        """
+        if not (session_data or cookies):
+            return
+
+        with self._lock:
+            self._session_dirty = self._session_dirty or session_data
+            self._cookies_dirty = self._cookies_dirty or cookies
+
+            stopped = self._stopped.is_set()
+            write_now = not defer and (self.flush_interval <= 0 or stopped)
+            if defer and stopped:
+                _WRITERS.add(self)
+            if not write_now and not stopped and self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="pyicloud-session-writer", daemon=True
+                )
+                self._thread.start()
+
+        if write_now:
+            self.flush()
+
+    def flush(self):
+        """Writes pending changes."""
+        with self._lock:
+            dirty = self._session_dirty or self._cookies_dirty
+            self._session_dirty = False
+            self._cookies_dirty = False
+
+        if dirty:
+            self.sync()
+
+    def sync(self):
+        """Merges local changes into the store and adopts the stored state.
+
+        This picks up session tokens and cookies written by other services
+        sharing the same account.
+        """
+        with self._state_lock:
+            self._snapshots += 1
+            snapshot = self._snapshots
+            data_changes = {
+                key: value
+                for key, value in list(self.service.session_data.items())
+                if key not in self._synced_data or self._synced_data[key] != value
+            }
+
+            cookies = list_cookies(self.service.session.cookies)
+            cookie_changes = [
+                cookie
+                for cookie in cookies
+                if self._synced_cookies.get(_cookie_key(cookie))
+                != (cookie.value, cookie.expires)
+            ]
+            current_keys = {_cookie_key(cookie) for cookie in cookies}
+            removed_cookies = [
+                key for key in self._synced_cookies if key not in current_keys
+            ]
+
+        with self._flush_lock:
+            if snapshot < self._written:
+                # A newer snapshot, holding these changes, was written
+                return
+            self._written = snapshot
+            session_data, cookiejar = self.service.session_store.update(
+                self.service.account_key,
+                data_changes,
+                cookie_changes,
+                removed_cookies,
+            )
+
+        with self._state_lock:
+            if snapshot > self._adopted:
+                self._adopted = snapshot
+                self._adopt(
+                    session_data,
+                    cookiejar,
+                    cookie_snapshot(cookie_changes),
+                    data_changes,
+                )
+
+    def close(self):
+        """Stops the background flusher and writes pending changes."""
+        self._stopped.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self._thread = None
+        self.flush()
+        _WRITERS.discard(self)
+
+    def _adopt(self, session_data, cookiejar, written_cookies=None, written_data=None):
+        """Makes the given stored state the current state of the service.
+
+        After a write, values are only adopted if another client changed
+        them in the store: the session may have received newer ones since.
+        """
+        if written_data is None:
+            self.service.session_data.update(session_data)
+        else:
+            for key, value in session_data.items():
+                if key in written_data:
+                    if value == written_data[key]:
+                        continue
+                elif key in self._synced_data and value == self._synced_data[key]:
+                    continue
+                self.service.session_data[key] = value
+        self._synced_data = dict(session_data)
+
+        session_cookies = self.service.session.cookies
+        if session_cookies is not cookiejar:
+            for cookie in cookiejar:
+                key = _cookie_key(cookie)
+                stored = (cookie.value, cookie.expires)
+                if written_cookies is None or (
+                    stored != written_cookies.get(key)
+                    and stored != self._synced_cookies.get(key)
+                ):
+                    session_cookies.set_cookie(cookie)
+        self._synced_cookies = cookie_snapshot(cookiejar)
+
+    def _run(self):
+        interval = self.flush_interval
+        if interval <= 0:
+            interval = DEFERRED_FLUSH_INTERVAL
+        while not self._stopped.wait(interval):
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("Failed to save session")
+
+
+@atexit.register
+def _flush_writers():
+    for writer in list(_WRITERS):
+        try:
+            writer.close()
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception("Failed to save session")
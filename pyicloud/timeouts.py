@@ -0,0 +1,101 @@
+"""Request timeouts and deadlines."""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+
+from pyicloud.exceptions import PyiCloudDeadlineExceededException
+
+# Monotonic time the requests of the current context must end by
+_DEADLINE = ContextVar("pyicloud_deadline", default=None)
+
+
+class TimeoutPolicy:
+    """Connect and read timeouts of the requests.
+
+    Timeouts depend on the operation: 'metadata' requests, or 'download'
+    requests streaming a file. `webservices` overrides them for some
+    webservices, by operation:
+        TimeoutPolicy(webservices={"ckdatabasews": {"metadata": (5, 30)}})
+    A timeout is a (connect, read) tuple, one number for both, or None to
+    wait forever. The read timeout bounds each read, not the whole body.
+    """
+
+    DEFAULT_TIMEOUTS = {
+        "metadata": (10.0, 60.0),
+        "download": (10.0, 300.0),
+    }
+
+    def __init__(self, metadata=None, download=None, webservices=None):
+        self.timeouts = dict(self.DEFAULT_TIMEOUTS)
+        if metadata is not None:
+            self.timeouts["metadata"] = metadata
+        if download is not None:
+            self.timeouts["download"] = download
+        self.webservices = {
+            ws_key: dict(timeouts) for ws_key, timeouts in (webservices or {}).items()
+        }
+
+    def timeout(self, ws_key=None, operation="metadata"):
+        """Returns the timeout of an operation on a webservice."""
+        timeouts = self.webservices.get(ws_key)
+        if timeouts and operation in timeouts:
+            return timeouts[operation]
+        return self.timeouts[operation]
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {self.timeouts}>"
+
+
+@contextmanager
+def deadline(seconds=None, expires=None):
+    """Bounds the requests made in the block to `seconds` overall.
+
+    `expires` gives the monotonic time to end by instead. An enclosing
+    deadline ending earlier is kept. Requests get timeouts no longer than
+    the time left, are not retried past it, and raise
+    PyiCloudDeadlineExceededException once it passed.
+    """
+    if expires is None:
+        expires = None if seconds is None else time.monotonic() + seconds
+    current = _DEADLINE.get()
+    if expires is None or (current is not None and current < expires):
+        expires = current
+    token = _DEADLINE.set(expires)
+    try:
+        yield expires
+    finally:
+        _DEADLINE.reset(token)
+
+
+def expiry(seconds):
+    """Returns the monotonic time a deadline of `seconds` from now ends by."""
+    return None if seconds is None else time.monotonic() + seconds
+
+
+def remaining():
+    """Returns the seconds left before the deadline, or None without one."""
+    expires = _DEADLINE.get()
+    if expires is None:
+        return None
+    return expires - time.monotonic()
+
+
+def check_deadline():
+    """Raises PyiCloudDeadlineExceededException if the deadline passed."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise PyiCloudDeadlineExceededException()
+
+
+def bounded_timeout(timeout):
+    """Returns a timeout not lasting past the deadline."""
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise PyiCloudDeadlineExceededException()
+    if timeout is None:
+        return (left, left)
+    if not isinstance(timeout, tuple):
+        timeout = (timeout, timeout)
+    return tuple(left if value is None else min(value, left) for value in timeout)
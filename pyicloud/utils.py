@@ -1,10 +1,15 @@
 """Utils."""
 import getpass
-import keyring
+import json
 import sys
 
 from .exceptions import PyiCloudNoStoredPasswordAvailableException
 
+try:
+    # Several times faster on large payloads (photos, drive, devices)
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 KEYRING_SYSTEM = "pyicloud://icloud-password"
 
@@ -36,6 +41,8 @@ def password_exists_in_keyring(username):
 
 def get_password_from_keyring(username):
     """Get the password from a username."""
+    import keyring  # pylint: disable=import-outside-toplevel
+
     result = keyring.get_password(KEYRING_SYSTEM, username)
     if result is None:
         raise PyiCloudNoStoredPasswordAvailableException(
@@ -52,6 +59,8 @@ def get_password_from_keyring(username):
 
 def store_password_in_keyring(username, password):
     """Store the password of a username."""
+    import keyring  # pylint: disable=import-outside-toplevel
+
     return keyring.set_password(
         KEYRING_SYSTEM,
         username,
@@ -61,6 +70,8 @@ def store_password_in_keyring(username, password):
 
 def delete_password_in_keyring(username):
     """Delete the password of a username."""
+    import keyring  # pylint: disable=import-outside-toplevel
+
     return keyring.delete_password(
         KEYRING_SYSTEM,
         username,
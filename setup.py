@@ -22,6 +22,7 @@ setup(
     maintainer="The PyiCloud Authors",
     packages=find_packages(include=["pyicloud*"]),
     install_requires=required,
+    extras_require={"aio": ["aiohttp>=3.8"], "speedups": ["orjson"]},
     python_requires=">=3.7",
     license="MIT",
     classifiers=[
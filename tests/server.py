@@ -0,0 +1,824 @@
+"""Local stand-in for the iCloud webservices.
+
+Serves the auth, setup and data webservices over real HTTP on the loopback
+interface, from the fixtures or from a generated dataset, so the client can
+be tested and benchmarked end to end without network.
+
+Usage:
+    with StandInServer(latency=0.01, throttle_every=10) as server:
+        api = server.service()
+        api.devices
+        print(server.count("refreshClient"), server.connections)
+"""
+import base64
+import copy
+from hashlib import pbkdf2_hmac, sha256
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from collections.abc import Sequence
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
+
+import srp
+from srp import _pysrp
+
+from pyicloud.base import PyiCloudService, PyiCloudSession
+
+from .const import AUTHENTICATED_USER, VALID_PASSWORD
+from .const_account import ACCOUNT_DEVICES_WORKING, ACCOUNT_STORAGE_WORKING
+from .const_account_family import ACCOUNT_FAMILY_WORKING
+from .const_drive import (
+    DRIVE_FILE_DOWNLOAD_WORKING,
+    DRIVE_FOLDER_WORKING,
+    DRIVE_ROOT_WORKING,
+    DRIVE_SUBFOLDER_WORKING,
+)
+from .const_findmyiphone import FMI_FAMILY_WORKING
+from .const_login import LOGIN_WORKING, TRUSTED_DEVICES
+
+# Host of the download URLs, rewritten to the content server
+CONTENT_HOST = "https://cvws.icloud-content.com"
+
+# Webservices given their own server, so the client tells them apart by host
+WEBSERVICES = (
+    "idmsa",
+    "setup",
+    "account",
+    "findme",
+    "ckdatabasews",
+    "drivews",
+    "docws",
+    "contacts",
+    "content",
+    "other",
+)
+
+AUTH_WEBSERVICES = ("idmsa", "setup", "other")
+
+CHANGES_PAGE_SIZE = 200
+
+
+def index_count_record(obj_type, count):
+    """Returns the HyperionIndexCountLookup record counting an index."""
+    return {
+        "recordName": "HyperionIndexCountLookup:%s" % obj_type,
+        "recordType": "HyperionIndexCountLookup",
+        "fields": {"itemCount": {"value": count, "type": "INT64"}},
+    }
+
+
+class Dataset:
+    """Data of the account served by the stand-in server.
+
+    Defaults to the fixtures; photos, albums and notes are empty.
+    `photos` holds (CPLMaster, CPLAsset) record pairs, `album_photos` maps
+    an album folder id to its photos and `zones` maps a CloudKit zone to
+    the records sent by changes/zone and records/lookup. The PrimarySync
+    zone holds the photo and album records. Records changed with `change`
+    are sent by changes/zone after those of the zone.
+    """
+
+    def __init__(
+        self,
+        accounts=None,
+        devices=None,
+        drive_nodes=None,
+        drive_documents=None,
+        content=None,
+        contacts=None,
+        photos=None,
+        albums=None,
+        album_photos=None,
+        notes=None,
+    ):
+        self.accounts = accounts or {AUTHENTICATED_USER: VALID_PASSWORD}
+        self.login = LOGIN_WORKING
+        self.devices = devices or FMI_FAMILY_WORKING
+        self.account_devices = ACCOUNT_DEVICES_WORKING
+        self.family = ACCOUNT_FAMILY_WORKING
+        self.storage = ACCOUNT_STORAGE_WORKING
+        if drive_nodes is None:
+            drive_nodes = {
+                node["drivewsid"]: node
+                for nodes in (
+                    DRIVE_ROOT_WORKING,
+                    DRIVE_FOLDER_WORKING,
+                    DRIVE_SUBFOLDER_WORKING,
+                )
+                for node in nodes
+            }
+        self.drive_nodes = drive_nodes
+        if drive_documents is None:
+            drive_documents = {
+                DRIVE_FILE_DOWNLOAD_WORKING["document_id"]: DRIVE_FILE_DOWNLOAD_WORKING
+            }
+        self.drive_documents = drive_documents
+        self.content = content or {}
+        self.contacts = contacts or []
+        self.photos = photos or []
+        self.albums = albums or []
+        self.album_photos = album_photos or {}
+        self.zones = {"Notes": notes or [], "PrimarySync": _PhotoRecords(self)}
+        self.zone_changes = {}
+        self._records = {}
+
+    @property
+    def notes(self):
+        """Gets the records of the Notes zone."""
+        return self.zones["Notes"]
+
+    def record(self, zone, record_name):
+        """Returns a record of a zone by name, or None."""
+        records = self._records.get(zone)
+        if records is None:
+            records = {
+                record["recordName"]: record for record in self.zones.get(zone, [])
+            }
+            self._records[zone] = records
+        return records.get(record_name)
+
+    def change(self, zone, record):
+        """Changes a record of a zone, deleted if it has "deleted" set."""
+        self.zone_changes.setdefault(zone, []).append(record)
+        records = self._records.get(zone)
+        if records is not None:
+            if record.get("deleted"):
+                records.pop(record["recordName"], None)
+            else:
+                records[record["recordName"]] = record
+
+    def changes(self, zone):
+        """Returns the records sent by changes/zone, in order."""
+        return _Concatenation(self.zones.get(zone, []), self.zone_changes.get(zone, []))
+
+    def album(self, album_id=None):
+        """Returns the photos of an album, or of the library."""
+        if album_id is None:
+            return self.photos
+        return self.album_photos.get(album_id, [])
+
+    def document(self, path, size=None):
+        """Returns the content of a download URL path.
+
+        Paths without content get `size` bytes of filler, 1 KiB by default.
+        """
+        content = self.content.get(path)
+        if content is None:
+            # Filler content, the same for a path across runs
+            size = 1024 if size is None else int(size)
+            content = sha256(path.encode()).digest() * (size // 32 + 1)
+            content = content[:size]
+        return content
+
+
+class _PhotoRecords(Sequence):
+    """Records of the PrimarySync zone: photo assets and masters, albums."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return 2 * len(self.dataset.photos) + len(self.dataset.albums)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        photos = len(self.dataset.photos)
+        if index >= 2 * photos:
+            return self.dataset.albums[index - 2 * photos]
+        master, asset = self.dataset.photos[index // 2]
+        return asset if index % 2 == 0 else master
+
+
+class _Concatenation(Sequence):
+    """Sequences read one after the other."""
+
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+
+    def __len__(self):
+        return len(self.first) + len(self.second)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < len(self.first):
+            return self.first[index]
+        return self.second[index - len(self.first)]
+
+
+class Fault:
+    """Error injected in the responses to the requests matching a path."""
+
+    def __init__(self, path, status=503, count=1, headers=None, body=None):
+        self.path = path
+        self.status = status
+        self.count = count
+        self.headers = headers or {}
+        self.body = body
+
+    def matches(self, path):
+        """Returns True if the fault applies to a request path."""
+        return self.count != 0 and self.path in path
+
+
+class StandInServer:
+    """Local iCloud stand-in, one HTTP server per webservice.
+
+    `latency` delays every response, in seconds, or per webservice with a
+    dict. One data request in `throttle_every` is answered 503 with a
+    Retry-After of `retry_after` seconds; `inject` adds other errors.
+    With `rotate_tokens`, data responses carry a new scnt header and cookie,
+    as iCloud does when it refreshes the session.
+    """
+
+    def __init__(
+        self,
+        dataset=None,
+        latency=0,
+        throttle_every=0,
+        retry_after=0,
+        iterations=1000,
+        host="127.0.0.1",
+        rotate_tokens=False,
+    ):
+        self.dataset = dataset or Dataset()
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.iterations = iterations
+        self.host = host
+        self.rotate_tokens = rotate_tokens
+        self.roots = {}
+        self.requests = []
+        self.connections = 0
+        self.faults = []
+        self._servers = []
+        self._lock = threading.Lock()
+        self._verifiers = {}
+        self._challenges = {}
+        self._session_tokens = {}
+        self._web_tokens = {}
+        self._data_requests = 0
+        self._directory = None
+
+    def start(self):
+        """Starts the servers, on free ports."""
+        for ws_key in WEBSERVICES:
+            server = ThreadingHTTPServer((self.host, 0), _Handler)
+            server.daemon_threads = True
+            server.stand_in = self
+            server.ws_key = ws_key
+            self.roots[ws_key] = "http://%s:%s" % (self.host, server.server_port)
+            threading.Thread(
+                target=server.serve_forever, args=(0.05,), daemon=True
+            ).start()
+            self._servers.append(server)
+        self._directory = tempfile.mkdtemp(prefix="pyicloud-stand-in-")
+        return self
+
+    def stop(self):
+        """Stops the servers."""
+        # Shut the servers down together, each waits for its poll interval
+        threads = [threading.Thread(target=server.shutdown) for server in self._servers]
+        for thread in threads:
+            thread.start()
+        for thread, server in zip(threads, self._servers):
+            thread.join()
+            server.server_close()
+        self._servers = []
+        if self._directory:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def service(self, apple_id=None, password=None, **kwargs):
+        """Returns a PyiCloudService logging in to the stand-in."""
+        if apple_id is None:
+            apple_id = next(iter(self.dataset.accounts))
+        if password is None:
+            password = self.dataset.accounts[apple_id]
+        kwargs.setdefault("cookie_directory", self._directory)
+        return self.service_class(apple_id, password, **kwargs)
+
+    @property
+    def service_class(self):
+        """Gets a PyiCloudService class using the stand-in endpoints."""
+        return type(
+            "StandInService",
+            (PyiCloudService,),
+            {
+                "AUTH_ENDPOINT": self.roots["idmsa"] + "/appleauth/auth",
+                "HOME_ENDPOINT": self.roots["setup"],
+                "SETUP_ENDPOINT": self.roots["setup"] + "/setup/ws/1",
+            },
+        )
+
+    def inject(self, path, status=503, count=1, headers=None, body=None):
+        """Answers the next `count` requests to a path with an error.
+
+        A JSON `body` is sent instead of the default error one, such as
+        {"serverErrorCode": "ACCESS_DENIED"}; count -1 never stops.
+        """
+        fault = Fault(path, status, count, headers, body)
+        with self._lock:
+            self.faults.append(fault)
+        return fault
+
+    def expire_sessions(self):
+        """Expires the web sessions, so that the client validates again."""
+        with self._lock:
+            self._web_tokens.clear()
+
+    def count(self, path=None):
+        """Returns the number of requests received, to a path or all."""
+        with self._lock:
+            return sum(1 for _, _, req_path in self.requests if path in req_path)
+
+    def reset(self):
+        """Forgets the requests, connections and faults."""
+        with self._lock:
+            self.requests = []
+            self.connections = 0
+            self.faults = []
+            self._data_requests = 0
+
+    # Request accounting
+
+    def _connected(self):
+        with self._lock:
+            self.connections += 1
+
+    def _received(self, ws_key, method, path):
+        """Records a request, returns the fault or throttling to answer with."""
+        with self._lock:
+            self.requests.append((ws_key, method, path))
+            for fault in self.faults:
+                if fault.matches(path):
+                    fault.count -= 1
+                    return fault
+            if ws_key in AUTH_WEBSERVICES or not self.throttle_every:
+                return None
+            self._data_requests += 1
+            if (self._data_requests - 1) % self.throttle_every == 0:
+                return Fault(path, 503, headers={"Retry-After": self.retry_after})
+        return None
+
+    def _delay(self, ws_key):
+        latency = self.latency
+        if isinstance(latency, dict):
+            latency = latency.get(ws_key, 0)
+        if latency:
+            time.sleep(latency)
+
+    # Authentication
+
+    def _login_data(self, apple_id):
+        data = copy.deepcopy(self.dataset.login)
+        data["dsInfo"]["appleId"] = apple_id
+        for ws_key, webservice in data["webservices"].items():
+            if "url" in webservice:
+                webservice["url"] = self.roots.get(ws_key, self.roots["other"])
+        return data
+
+    def _signin_init(self, body):
+        apple_id = body.get("accountName")
+        password = self.dataset.accounts.get(apple_id)
+        if password is None:
+            return None
+        with self._lock:
+            if apple_id not in self._verifiers:
+                self._verifiers[apple_id] = _verification_key(password, self.iterations)
+            salt, verifier_key = self._verifiers[apple_id]
+        verifier = srp.Verifier(
+            apple_id,
+            salt,
+            verifier_key,
+            base64.b64decode(body["a"]),
+            hash_alg=srp.SHA256,
+            ng_type=srp.NG_2048,
+        )
+        _, challenge = verifier.get_challenge()
+        token = secrets.token_hex(16)
+        with self._lock:
+            self._challenges[token] = (apple_id, verifier)
+        return {
+            "iteration": self.iterations,
+            "salt": base64.b64encode(salt).decode(),
+            "protocol": "s2k",
+            "b": base64.b64encode(challenge).decode(),
+            "c": token,
+        }
+
+    def _signin_complete(self, body):
+        with self._lock:
+            apple_id, verifier = self._challenges.pop(body.get("c"), (None, None))
+        if verifier is None:
+            return None
+        verifier.verify_session(base64.b64decode(body.get("m1", "")))
+        if not verifier.authenticated():
+            return None
+        session_token = secrets.token_hex(16)
+        with self._lock:
+            self._session_tokens[session_token] = apple_id
+        return session_token
+
+    def _account_login(self, body):
+        with self._lock:
+            apple_id = self._session_tokens.get(body.get("dsWebAuthToken"))
+            if apple_id is None:
+                return None, None
+            web_token = secrets.token_hex(16)
+            self._web_tokens[web_token] = apple_id
+        return apple_id, web_token
+
+    def _web_session(self, web_token):
+        with self._lock:
+            return self._web_tokens.get(web_token)
+
+
+class StandInTestCase(TestCase):
+    """Tests of services logging in to a stand-in server.
+
+    The service mocks of the other tests replace the session class: it is
+    restored for the tests. Servers and services are closed after each test.
+    """
+
+    server = None
+
+    def setUp(self):
+        """Set up tests."""
+        session_patch = patch("pyicloud.base.PyiCloudSession", PyiCloudSession)
+        session_patch.start()
+        self.addCleanup(session_patch.stop)
+
+    def start_server(self, dataset=None, **kwargs):
+        """Starts the stand-in server of the test, see StandInServer."""
+        self.server = StandInServer(dataset, **kwargs).start()
+        self.addCleanup(self.server.stop)
+        return self.server
+
+    def service(self, **kwargs):
+        """Returns a PyiCloudService logging in to the server of the test."""
+        api = self.server.service(**kwargs)
+        self.addCleanup(api.session.close)
+        return api
+
+
+def _verification_key(password, iterations):
+    """Returns the salt and SRP verifier of an s2k password."""
+    srp.rfc5054_enable()
+    srp.no_username_in_x()
+    # The client hashes the salt as a number: no leading zero byte
+    salt = b"\x01" + secrets.token_bytes(15)
+    derived = pbkdf2_hmac(
+        "sha256", sha256(password.encode()).digest(), salt, iterations, 32
+    )
+    x = int.from_bytes(sha256(salt + sha256(b":" + derived).digest()).digest(), "big")
+    modulus, generator = _pysrp.get_ng(_pysrp.NG_2048, None, None)
+    verifier_key = pow(generator, x, modulus)
+    return salt, verifier_key.to_bytes((verifier_key.bit_length() + 7) // 8, "big")
+
+
+def _project(record, desired_keys):
+    """Returns a record with only the fields of desiredKeys, as CloudKit does."""
+    if desired_keys is None or "fields" not in record:
+        return record
+    fields = {
+        key: value for key, value in record["fields"].items() if key in desired_keys
+    }
+    return dict(record, fields=fields)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Routes the requests of a webservice to the stand-in."""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.stand_in._connected()  # pylint: disable=protected-access
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    @property
+    def stand_in(self):
+        """Gets the stand-in server."""
+        return self.server.stand_in
+
+    @property
+    def dataset(self):
+        """Gets the dataset served."""
+        return self.server.stand_in.dataset
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Handles a GET request."""
+        self._handle("GET")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Handles a POST request."""
+        self._handle("POST")
+
+    def _handle(self, method):
+        # pylint: disable=protected-access,attribute-defined-outside-init
+        url = urlsplit(self.path)
+        self.query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length) if length else b""
+        try:
+            self.body = json.loads(raw_body) if raw_body else None
+        except ValueError:
+            self.body = None
+
+        ws_key = self.server.ws_key
+        fault = self.stand_in._received(ws_key, method, url.path)
+        self.stand_in._delay(ws_key)
+        if fault is not None:
+            body = fault.body
+            if body is None:
+                body = {"error": "Injected error", "errorCode": str(fault.status)}
+            self._send_json(body, fault.status, fault.headers)
+            return
+
+        if ws_key not in AUTH_WEBSERVICES and ws_key != "content":
+            self.apple_id = self.stand_in._web_session(self._cookie())
+            if self.apple_id is None:
+                self._send_error(421, "Missing X-APPLE-WEBAUTH-TOKEN cookie")
+                return
+
+        route = getattr(self, "_%s" % ws_key)
+        route(method, url.path)
+
+    # Responses
+
+    def _send(self, content, status=200, headers=None, content_type=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        if self.stand_in.rotate_tokens and self.server.ws_key not in AUTH_WEBSERVICES:
+            token = secrets.token_hex(8)
+            self.send_header("scnt", token)
+            self.send_header(
+                "Set-Cookie", "X-APPLE-WEBAUTH-VALIDATE=%s; Path=/" % token
+            )
+        for header, value in (headers or {}).items():
+            self.send_header(header, str(value))
+        self.end_headers()
+        try:
+            self.wfile.write(content)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out and hung up
+            self.close_connection = True
+
+    def _send_json(self, data, status=200, headers=None):
+        text = json.dumps(data)
+        if CONTENT_HOST in text:
+            text = text.replace(CONTENT_HOST, self.stand_in.roots["content"])
+        self._send(text.encode(), status, headers, "application/json")
+
+    def _send_error(self, status, reason):
+        self._send_json({"error": reason, "errorCode": str(status)}, status)
+
+    def _not_found(self, *_):
+        self._send_error(404, "Not found")
+
+    def _cookie(self):
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        morsel = cookie.get("X-APPLE-WEBAUTH-TOKEN")
+        return morsel.value if morsel else None
+
+    # Webservices
+
+    def _idmsa(self, method, path):
+        # pylint: disable=protected-access
+        if method == "POST" and path.endswith("/signin/init"):
+            challenge = self.stand_in._signin_init(self.body or {})
+            if challenge is None:
+                self._send_error(401, "Unknown account")
+                return
+            self._send_json(challenge)
+        elif method == "POST" and path.endswith("/signin/complete"):
+            session_token = self.stand_in._signin_complete(self.body or {})
+            if session_token is None:
+                self._send_error(401, "Invalid email/password combination")
+                return
+            headers = {
+                "X-Apple-Session-Token": session_token,
+                "X-Apple-ID-Session-Id": secrets.token_hex(8),
+                "X-Apple-ID-Account-Country": "USA",
+                "scnt": secrets.token_hex(8),
+            }
+            self._send_json({"authType": "hsa2"}, headers=headers)
+        else:
+            self._not_found()
+
+    def _setup(self, method, path):
+        # pylint: disable=protected-access
+        if method == "POST" and path.endswith("/accountLogin"):
+            apple_id, web_token = self.stand_in._account_login(self.body or {})
+            if apple_id is None:
+                self._send_error(401, "Invalid session token")
+                return
+            headers = {"Set-Cookie": "X-APPLE-WEBAUTH-TOKEN=%s; Path=/" % web_token}
+            self._send_json(self.stand_in._login_data(apple_id), headers=headers)
+        elif method == "POST" and path.endswith("/validate"):
+            apple_id = self.stand_in._web_session(self._cookie())
+            if apple_id is None:
+                self._send_error(421, "Missing X-APPLE-WEBAUTH-TOKEN cookie")
+                return
+            self._send_json(self.stand_in._login_data(apple_id))
+        elif path.endswith("/listDevices"):
+            self._send_json(TRUSTED_DEVICES)
+        elif path.endswith("/storageUsageInfo"):
+            self._send_json(self.dataset.storage)
+        else:
+            self._not_found()
+
+    def _account(self, method, path):
+        # pylint: disable=unused-argument
+        if path.endswith("/device/getDevices"):
+            self._send_json(self.dataset.account_devices)
+        elif path.endswith("/family/getFamilyDetails"):
+            self._send_json(self.dataset.family)
+        else:
+            self._not_found()
+
+    def _findme(self, method, path):
+        if method == "POST" and path.endswith("/refreshClient"):
+            self._send_json(self.dataset.devices)
+        elif method == "POST" and path.startswith("/fmipservice/client/web/"):
+            self._send_json({"statusCode": "200"})
+        else:
+            self._not_found()
+
+    def _ckdatabasews(self, method, path):
+        body = self.body or {}
+        if method != "POST":
+            self._not_found()
+        elif path.endswith("/internal/records/query/batch"):
+            self._send_json({"batch": [self._count(query) for query in body["batch"]]})
+        elif path.endswith("/records/query"):
+            self._send_json(self._query(body))
+        elif path.endswith("/records/lookup"):
+            zone = body.get("zoneID", {}).get("zoneName")
+            self._send_json(
+                {"records": [self._lookup(zone, r) for r in body["records"]]}
+            )
+        elif path.endswith("/changes/zone"):
+            self._send_json({"zones": [self._changes(zone) for zone in body["zones"]]})
+        elif path.endswith("/records/modify"):
+            zone = body.get("zoneID", {}).get("zoneName")
+            records = [
+                self._modify(zone, operation["record"])
+                for operation in body["operations"]
+            ]
+            self._send_json({"records": records})
+        else:
+            self._not_found()
+
+    def _count(self, query):
+        (obj_type,) = query["query"]["filterBy"]["fieldValue"]["value"]
+        if obj_type == "CPLAssetByAddedDate":
+            photos = self.dataset.album()
+        elif obj_type.startswith("CPLContainerRelationNotDeletedByAssetDate:"):
+            photos = self.dataset.album(obj_type.split(":", 1)[1])
+        else:
+            photos = []
+        return {"records": [index_count_record(obj_type, len(photos))]}
+
+    def _query(self, body):
+        record_type = body["query"]["recordType"]
+        if record_type == "CheckIndexingState":
+            fields = {
+                "progress": {"value": 100, "type": "INT64"},
+                "state": {"value": "FINISHED", "type": "STRING"},
+            }
+            records = [{"recordType": record_type, "fields": fields}]
+            return {"records": records, "syncToken": "0"}
+        if record_type == "CPLAlbumByPositionLive":
+            return {"records": self.dataset.albums}
+
+        filters = {
+            query_filter["fieldName"]: query_filter["fieldValue"]["value"]
+            for query_filter in body["query"].get("filterBy", [])
+        }
+        if "parentId" in filters:
+            photos = self.dataset.album(filters["parentId"])
+        elif record_type == "CPLAssetAndMasterByAddedDate":
+            photos = self.dataset.album()
+        else:
+            photos = []
+
+        limit = max(body.get("resultsLimit", 200) // 2, 1)
+        offset = filters.get("startRank", 0)
+        if filters.get("direction") == "DESCENDING":
+            page = photos[max(offset - limit + 1, 0) : offset + 1][::-1]
+        else:
+            page = photos[offset : offset + limit]
+
+        records = []
+        for master, asset in page:
+            records.append(_project(asset, body.get("desiredKeys")))
+            records.append(_project(master, body.get("desiredKeys")))
+        return {"records": records}
+
+    def _lookup(self, zone, wanted):
+        record = self.dataset.record(zone, wanted["recordName"])
+        if record is None:
+            return {
+                "recordName": wanted["recordName"],
+                "reason": "Record not found",
+                "serverErrorCode": "NOT_FOUND",
+            }
+        return _project(record, self.body.get("desiredKeys"))
+
+    def _changes(self, zone):
+        zone_id = zone["zoneID"]
+        records = self.dataset.changes(zone_id["zoneName"])
+        offset = int(zone.get("syncToken") or 0)
+        if offset > len(records):
+            return {
+                "zoneID": zone_id,
+                "reason": "Sync token expired",
+                "serverErrorCode": "CHANGE_TOKEN_EXPIRED",
+            }
+        page = records[offset : offset + CHANGES_PAGE_SIZE]
+        return {
+            "zoneID": zone_id,
+            "records": [_project(record, zone.get("desiredKeys")) for record in page],
+            "syncToken": str(offset + len(page)),
+            "moreComing": offset + len(page) < len(records),
+        }
+
+    def _modify(self, zone, change):
+        """Applies the changed fields of a record, returns the record."""
+        record = copy.deepcopy(self.dataset.record(zone, change["recordName"]) or {})
+        record.update({key: value for key, value in change.items() if key != "fields"})
+        record.setdefault("fields", {}).update(change.get("fields", {}))
+        record["recordChangeTag"] = secrets.token_hex(3)
+        self.dataset.change(zone, record)
+        return record
+
+    def _drivews(self, method, path):
+        if method == "POST" and path.endswith("/retrieveItemDetailsInFolders"):
+            self._send_json(
+                [
+                    self.dataset.drive_nodes.get(item["drivewsid"])
+                    or {"drivewsid": item["drivewsid"], "status": "ID_INVALID"}
+                    for item in self.body
+                ]
+            )
+        elif path.endswith("/retrieveAppLibraries"):
+            self._send_json({"items": []})
+        else:
+            self._not_found()
+
+    def _docws(self, method, path):
+        document = None
+        if method == "GET" and path.endswith("/download/by_id"):
+            document = self.dataset.drive_documents.get(self.query.get("document_id"))
+        if document is None:
+            self._not_found()
+            return
+        self._send_json(document)
+
+    def _contacts(self, method, path):
+        # pylint: disable=unused-argument
+        if path.endswith("/co/startup"):
+            self._send_json(
+                {
+                    "prefToken": "pref-token",
+                    "syncToken": "sync-token",
+                    "contacts": self.dataset.contacts,
+                }
+            )
+        elif path.endswith("/co/contacts"):
+            self._send_json({"contacts": self.dataset.contacts})
+        else:
+            self._not_found()
+
+    def _content(self, method, path):
+        if method != "GET":
+            self._not_found()
+            return
+        content = self.dataset.document(path, self.query.get("size"))
+        self._send(content, content_type="application/octet-stream")
+
+    _other = _not_found
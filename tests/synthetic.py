@@ -0,0 +1,443 @@
+"""Synthetic iCloud accounts at arbitrary scale.
+
+Generates CloudKit photo and note records, Drive trees, Find My devices
+and contacts for the stand-in server, which derives the album counts from
+them. The data only depends on the seed, so the same account is served
+across runs; photos are generated when requested, so a library of 200k
+photos costs no memory.
+
+Usage:
+    dataset = synthetic_dataset(photos=200000, notes=20000, drive_depth=5)
+    with StandInServer(dataset) as server:
+        ...
+"""
+import base64
+from collections.abc import Sequence
+import copy
+import gzip
+import random
+import uuid
+
+from pyicloud.protobuf.topotext_pb2 import String
+from pyicloud.protobuf.versioned_document_pb2 import Document
+
+from .const_findmyiphone import FMI_FAMILY_WORKING
+from .server import CONTENT_HOST, Dataset
+
+# 2020-01-01, in milliseconds
+EPOCH = 1577836800000
+DAY = 86400000
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam "
+    "quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo"
+).split()
+
+PRIMARY_ZONE = {"zoneName": "PrimarySync", "zoneType": "REGULAR_CUSTOM_ZONE"}
+NOTES_ZONE = {"zoneName": "Notes", "zoneType": "REGULAR_CUSTOM_ZONE"}
+
+
+def _rng(seed, kind, index=0):
+    """Returns the random generator of an item, independent of the others."""
+    return random.Random("%s:%s:%s" % (seed, kind, index))
+
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4)).upper()
+
+
+def _record_name(rng):
+    """Returns a CloudKit record name, like 'AY6c+BsE0jjaXx9tmVGJM1D2VcEO'."""
+    return base64.b64encode(rng.getrandbits(168).to_bytes(21, "big")).decode()
+
+
+def _encrypted(text):
+    return {
+        "value": base64.b64encode(text.encode()).decode(),
+        "type": "ENCRYPTED_BYTES",
+    }
+
+
+def _int(value):
+    return {"value": value, "type": "INT64"}
+
+
+def _string(value):
+    return {"value": value, "type": "STRING"}
+
+
+def _timestamp(value):
+    return {"value": value, "type": "TIMESTAMP"}
+
+
+def _reference(record_name, zone):
+    return {
+        "value": {"recordName": record_name, "action": "NONE", "zoneID": zone},
+        "type": "REFERENCE",
+    }
+
+
+def _words(rng, count):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def photo_records(seed, index, sizes=(500000, 5000000)):
+    """Returns the CPLMaster and CPLAsset records of a photo or video."""
+    rng = _rng(seed, "photo", index)
+    master_name = _record_name(rng)
+    video = rng.random() < 0.1
+    extension = "MOV" if video else "JPG"
+    filename = "IMG_%04d.%s" % (index % 10000, extension)
+    width, height = rng.choice([(4032, 3024), (3024, 4032), (1920, 1080)])
+
+    fields = {
+        "filenameEnc": _encrypted(filename),
+        "itemType": _string("com.apple.quicktime-movie" if video else "public.jpeg"),
+        "originalOrientation": _int(1),
+    }
+    versions = [("resOriginal", width, height, rng.randint(*sizes))]
+    if video:
+        versions.append(("resVidMed", 1280, 720, rng.randint(*sizes) // 4))
+        versions.append(("resVidSmall", 640, 360, rng.randint(*sizes) // 16))
+    versions.append(("resJPEGMed", width // 2, height // 2, rng.randint(*sizes) // 8))
+    versions.append(
+        ("resJPEGThumb", width // 8, height // 8, rng.randint(*sizes) // 64)
+    )
+    for prefix, version_width, version_height, size in versions:
+        token = _record_name(rng)
+        fields[prefix + "Width"] = _int(version_width)
+        fields[prefix + "Height"] = _int(version_height)
+        movie = prefix.startswith("resVid") or (video and prefix == "resOriginal")
+        fields[prefix + "FileType"] = _string(
+            "com.apple.quicktime-movie" if movie else "public.jpeg"
+        )
+        fields[prefix + "Fingerprint"] = _string(token)
+        fields[prefix + "Res"] = {
+            "value": {
+                "fileChecksum": token,
+                "size": size,
+                "wrappingKey": _record_name(rng),
+                "referenceChecksum": _record_name(rng),
+                "downloadURL": "%s/B/%s/%s?o=%s&size=%s"
+                % (CONTENT_HOST, token, filename, master_name, size),
+            },
+            "type": "ASSETID",
+        }
+
+    created = EPOCH + index * 3600000 + rng.randrange(3600000)
+    master = {
+        "recordName": master_name,
+        "recordType": "CPLMaster",
+        "fields": fields,
+        "recordChangeTag": "%x" % rng.getrandbits(24),
+        "created": {"timestamp": created},
+        "modified": {"timestamp": created},
+        "deleted": False,
+        "zoneID": PRIMARY_ZONE,
+    }
+    asset = {
+        "recordName": _uuid(rng),
+        "recordType": "CPLAsset",
+        "fields": {
+            "masterRef": _reference(master_name, PRIMARY_ZONE),
+            "assetDate": _timestamp(created),
+            "addedDate": _timestamp(created + rng.randrange(DAY)),
+            "isFavorite": _int(int(rng.random() < 0.05)),
+            "isHidden": _int(0),
+            "orientation": _int(1),
+            "duration": _int(rng.randint(1, 60) if video else 0),
+            "timeZoneOffset": _int(0),
+        },
+        "recordChangeTag": "%x" % rng.getrandbits(24),
+        "created": {"timestamp": created},
+        "modified": {"timestamp": created},
+        "deleted": False,
+        "zoneID": PRIMARY_ZONE,
+    }
+    return master, asset
+
+
+class SyntheticPhotos(Sequence):
+    """Photo library of (CPLMaster, CPLAsset) pairs, made when accessed.
+
+    `indices` selects photos of the library, for an album.
+    """
+
+    def __init__(self, count, seed=0, indices=None, sizes=(500000, 5000000)):
+        self.seed = seed
+        self.sizes = sizes
+        self.indices = range(count) if indices is None else indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [
+                photo_records(self.seed, index, self.sizes)
+                for index in self.indices[key]
+            ]
+        return photo_records(self.seed, self.indices[key], self.sizes)
+
+    def album(self, start, step):
+        """Returns the photos start, start + step... of the library."""
+        return SyntheticPhotos(
+            0, self.seed, self.indices[start::step], sizes=self.sizes
+        )
+
+
+def album_records(seed, count):
+    """Returns the CPLAlbum folder records, after the root folder."""
+    rng = _rng(seed, "albums")
+    records = [
+        {
+            "recordName": "----Root-Folder----",
+            "recordType": "CPLAlbum",
+            "fields": {"albumType": _int(3)},
+            "recordChangeTag": "1",
+            "deleted": False,
+            "zoneID": PRIMARY_ZONE,
+        }
+    ]
+    for index in range(count):
+        records.append(
+            {
+                "recordName": _uuid(rng),
+                "recordType": "CPLAlbum",
+                "fields": {
+                    "albumNameEnc": _encrypted("Album %d" % index),
+                    "albumType": _int(0),
+                    "position": _int(1024 * (index + 1)),
+                    "sortAscending": _int(1),
+                    "sortType": _int(0),
+                    "isDeleted": _int(0),
+                },
+                "recordChangeTag": "%x" % rng.getrandbits(24),
+                "deleted": False,
+                "zoneID": PRIMARY_ZONE,
+            }
+        )
+    return records
+
+
+def note_text(seed, index, words=200):
+    """Returns the compressed protobuf body of a note and its text."""
+    rng = _rng(seed, "note-text", index)
+    text = "\n".join(
+        _words(rng, rng.randint(5, 40)) for _ in range(max(words // 20, 1))
+    )
+    document = Document()
+    document.version.add().data = String(string=text).SerializeToString()
+    return gzip.compress(document.SerializeToString(), mtime=0), text
+
+
+def note_records(seed, count, folders=5, words=200):
+    """Returns the Folder and Note records of the Notes zone."""
+    rng = _rng(seed, "notes")
+    records = []
+    for index in range(folders):
+        records.append(
+            {
+                "recordName": _uuid(rng),
+                "recordType": "Folder",
+                "fields": {"TitleEncrypted": _encrypted("Folder %d" % index)},
+                "recordChangeTag": "%x" % rng.getrandbits(24),
+                "deleted": False,
+                "zoneID": NOTES_ZONE,
+            }
+        )
+    folder_names = [record["recordName"] for record in records]
+
+    for index in range(count):
+        body, text = note_text(seed, index, words)
+        modified = EPOCH + index * 60000
+        record = {
+            "recordName": _uuid(rng),
+            "recordType": "Note",
+            "fields": {
+                "TitleEncrypted": _encrypted("Note %d" % index),
+                "SnippetEncrypted": _encrypted(text[:80]),
+                "TextDataEncrypted": {
+                    "value": base64.b64encode(body).decode(),
+                    "type": "ENCRYPTED_BYTES",
+                },
+                "ModificationDate": _timestamp(modified),
+                "Deleted": _int(0),
+            },
+            "recordChangeTag": "%x" % rng.getrandbits(24),
+            "deleted": False,
+            "zoneID": NOTES_ZONE,
+        }
+        if folder_names:
+            record["parent"] = {"recordName": folder_names[index % len(folder_names)]}
+        records.append(record)
+    return records
+
+
+def drive_tree(seed, depth=3, folders=4, files=5):
+    """Returns the Drive folders by drivewsid, and the documents by id.
+
+    Each folder down to `depth` holds `folders` folders and `files` files.
+    """
+    rng = _rng(seed, "drive")
+    nodes = {}
+    documents = {}
+
+    def folder(docwsid, name, parent_id, level):
+        drivewsid = "FOLDER::com.apple.CloudDocs::%s" % docwsid
+        items = []
+        for index in range(files):
+            file_id = _uuid(rng)
+            size = rng.randint(1000, 5000000)
+            file_name = "File %d" % index
+            items.append(
+                {
+                    "drivewsid": "FILE::com.apple.CloudDocs::%s" % file_id,
+                    "docwsid": file_id,
+                    "zone": "com.apple.CloudDocs",
+                    "name": file_name,
+                    "parentId": drivewsid,
+                    "dateModified": "2020-05-03T00:15:17Z",
+                    "dateChanged": "2020-05-02T17:16:17-07:00",
+                    "size": size,
+                    "etag": "%x::%x" % (rng.getrandbits(16), rng.getrandbits(16)),
+                    "extension": "txt",
+                    "hiddenExtension": False,
+                    "lastOpenTime": "2020-05-03T00:24:25Z",
+                    "type": "FILE",
+                }
+            )
+            documents[file_id] = {
+                "document_id": file_id,
+                "data_token": {
+                    "url": "%s/B/%s/%s.txt?o=%s&size=%s"
+                    % (CONTENT_HOST, file_id, file_name, file_id, size),
+                    "token": file_id,
+                    "signature": file_id,
+                    "wrapping_key": file_id,
+                    "reference_signature": file_id,
+                },
+                "double_etag": "1::1",
+            }
+        if level < depth:
+            for index in range(folders):
+                child_id = _uuid(rng)
+                child = folder(child_id, "Folder %d" % index, drivewsid, level + 1)
+                items.append({key: child[key] for key in child if key != "items"})
+        node = {
+            "drivewsid": drivewsid,
+            "docwsid": docwsid,
+            "zone": "com.apple.CloudDocs",
+            "name": name,
+            "parentId": parent_id,
+            "etag": "%x" % rng.getrandbits(16),
+            "type": "FOLDER",
+            "assetQuota": 0,
+            "fileCount": files,
+            "shareCount": 0,
+            "shareAliasCount": 0,
+            "directChildrenCount": len(items),
+            "items": items,
+            "numberOfItems": len(items),
+        }
+        nodes[drivewsid] = node
+        return node
+
+    folder("root", "", None, 0)
+    return nodes, documents
+
+
+def find_my_devices(seed, count):
+    """Returns a Find My refreshClient response listing devices."""
+    rng = _rng(seed, "devices")
+    templates = FMI_FAMILY_WORKING["content"]
+    response = dict(FMI_FAMILY_WORKING, content=[])
+    for index in range(count):
+        device = copy.deepcopy(templates[index % len(templates)])
+        device["id"] = _record_name(rng) + _record_name(rng)
+        device["name"] = "Device %d" % index
+        device["batteryLevel"] = rng.random()
+        if device.get("location"):
+            device["location"]["latitude"] = rng.uniform(-90, 90)
+            device["location"]["longitude"] = rng.uniform(-180, 180)
+        response["content"].append(device)
+    return response
+
+
+def contacts(seed, count):
+    """Returns contacts, as listed by the contacts webservice."""
+    rng = _rng(seed, "contacts")
+    return [
+        {
+            "contactId": _uuid(rng),
+            "etag": "C=%d@U=%s" % (index, _uuid(rng)),
+            "firstName": rng.choice(WORDS).title(),
+            "lastName": "Contact %d" % index,
+            "phones": [{"label": "MOBILE", "field": "+1 555 %07d" % index}],
+        }
+        for index in range(count)
+    ]
+
+
+def reminders(seed, collections=5, count=100):
+    """Returns a reminders startup response, reminders spread over lists."""
+    rng = _rng(seed, "reminders")
+    lists = [
+        {"title": "List %d" % index, "guid": _uuid(rng), "ctag": "%x" % index}
+        for index in range(collections)
+    ]
+    items = []
+    for index in range(count):
+        due = None
+        if rng.random() < 0.5:
+            year, month, day = 2020 + index % 3, rng.randint(1, 12), rng.randint(1, 28)
+            due = [int("%d%d%d" % (year, month, day)), year, month, day, 9, 0]
+        items.append(
+            {
+                "title": "Reminder %d" % index,
+                "description": _words(rng, 8),
+                "pGuid": lists[index % collections]["guid"],
+                "guid": _uuid(rng),
+                "dueDate": due,
+            }
+        )
+    return {"Collections": lists, "Reminders": items}
+
+
+def synthetic_dataset(
+    photos=1000,
+    albums=10,
+    notes=100,
+    note_folders=5,
+    note_words=200,
+    drive_depth=3,
+    drive_folders=4,
+    drive_files=5,
+    devices=10,
+    contact_count=100,
+    photo_sizes=(500000, 5000000),
+    seed=0,
+):
+    """Returns the Dataset of a synthetic account.
+
+    Album i holds the photos i, i + albums + 1... of the library.
+    """
+    library = SyntheticPhotos(photos, seed, sizes=photo_sizes)
+    folders = album_records(seed, albums)
+    drive_nodes, drive_documents = drive_tree(
+        seed, drive_depth, drive_folders, drive_files
+    )
+    return Dataset(
+        devices=find_my_devices(seed, devices),
+        drive_nodes=drive_nodes,
+        drive_documents=drive_documents,
+        contacts=contacts(seed, contact_count),
+        photos=library,
+        albums=folders,
+        album_photos={
+            folder["recordName"]: library.album(index, albums + 1)
+            for index, folder in enumerate(folders[1:])
+        },
+        notes=note_records(seed, notes, note_folders, note_words),
+    )
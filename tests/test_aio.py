@@ -0,0 +1,190 @@
+"""Asyncio client tests."""
+import asyncio
+from datetime import datetime
+import http.cookiejar as cookielib
+import json
+import logging
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import pytest
+
+from pyicloud.aio import AsyncPyiCloudService
+from pyicloud.aio.services import AsyncCalendarService
+from pyicloud.exceptions import PyiCloudAPIResponseException
+from pyicloud.retry import RetryPolicy
+
+from .const_findmyiphone import FMI_FAMILY_WORKING
+from .server import StandInTestCase
+
+
+def _sync_service(root):
+    """Returns a stand-in for an authenticated PyiCloudService."""
+    sync_service = Mock()
+    sync_service.user = {"accountName": "user", "password": "pass"}
+    sync_service.data = {"dsInfo": {"dsid": "1234"}}
+    sync_service.params = {"dsid": "1234"}
+    sync_service.with_family = True
+    sync_service.session_data = {}
+    sync_service.session.headers = {"Origin": "https://www.icloud.com"}
+    sync_service.session.verify = True
+    sync_service.session.cookies = cookielib.LWPCookieJar()
+    sync_service.session.get_retry_policy.return_value = RetryPolicy(max_retries=0)
+    sync_service.session.get_timeout.return_value = None
+    sync_service.session.rate_limiter = None
+    sync_service.session.metrics = None
+    sync_service.session.writer.cookies_changed.return_value = True
+    sync_service.session._get_request_logger.return_value = (  # pylint: disable=W0212
+        logging.getLogger("pyicloud.aio.base.http")
+    )
+    sync_service.session._log_payload.side_effect = str  # pylint: disable=W0212
+    sync_service._webservices = {  # pylint: disable=protected-access
+        "findme": {"url": root},
+        "drivews": {"url": root},
+    }
+    sync_service._get_webservice_url = (  # pylint: disable=protected-access
+        lambda ws_key: root
+    )
+    return sync_service
+
+
+class AsyncPyiCloudServiceTest(TestCase):
+    """Asyncio client tests."""
+
+    received_cookies = None
+
+    def _app(self):
+        app = web.Application()
+
+        async def refresh_client(request):
+            self.received_cookies.append(request.headers.get("Cookie"))
+            response = web.json_response(FMI_FAMILY_WORKING)
+            response.headers["X-Apple-Session-Token"] = "new-token"
+            response.set_cookie("X-APPLE-WEBAUTH-TOKEN", "t1", domain="127.0.0.1")
+            return response
+
+        async def throttled(request):  # pylint: disable=unused-argument
+            return web.json_response(
+                {"errorCode": "ACCESS_DENIED", "reason": "Throttled"}
+            )
+
+        app.router.add_post("/fmipservice/client/web/refreshClient", refresh_client)
+        app.router.add_post("/retrieveItemDetailsInFolders", throttled)
+        return app
+
+    def _run(self, test):
+        async def run():
+            server = TestServer(self._app())
+            await server.start_server()
+            try:
+                api = AsyncPyiCloudService(
+                    _sync_service(str(server.make_url("")).rstrip("/"))
+                )
+                await test(api)
+            finally:
+                await server.close()
+
+        asyncio.run(run())
+
+    def setUp(self):
+        """Set up tests."""
+        self.received_cookies = []
+
+    def test_devices(self):
+        """Test Find My devices and session updates."""
+
+        async def test(api):
+            devices = await api.devices()
+            assert len(list(devices)) == 13
+            assert devices[0]["name"] is not None
+
+            assert api.session_data["session_token"] == "new-token"
+            assert [cookie.name for cookie in api.session.cookies] == [
+                "X-APPLE-WEBAUTH-TOKEN"
+            ]
+            api.sync_service.session.writer.mark_dirty.assert_called_with(
+                session_data=True, cookies=True, defer=True
+            )
+
+            await devices.refresh_client()
+            assert self.received_cookies == [None, "X-APPLE-WEBAUTH-TOKEN=t1"]
+
+        self._run(test)
+
+    def test_error(self):
+        """Test errors reported in JSON bodies are raised."""
+
+        async def test(api):
+            drive = await api.drive()
+            with pytest.raises(PyiCloudAPIResponseException, match="ACCESS_DENIED"):
+                await drive.root()
+
+        self._run(test)
+
+
+class AsyncCalendarServiceTest(TestCase):
+    """Asyncio calendar service tests."""
+
+    def test_month_params(self):
+        """Test the default range is the current month."""
+
+        class June(datetime):
+            """June 2026, which starts on a Monday."""
+
+            @classmethod
+            def today(cls):
+                return cls(2026, 6, 15)
+
+        calendar = AsyncCalendarService("https://calendar", Mock(), {"dsid": "1"})
+        with patch("pyicloud.aio.services.datetime", June):
+            params = calendar._month_params()  # pylint: disable=protected-access
+        assert (params["startDate"], params["endDate"]) == ("2026-06-01", "2026-06-30")
+
+
+class AsyncStandInTest(StandInTestCase):
+    """Asyncio client tests, against the stand-in server."""
+
+    def setUp(self):
+        """Set up tests."""
+        super().setUp()
+        self.start_server()
+
+    def test_revalidates_cached_session(self):
+        """Test an expired session from cached webservices is validated."""
+        self.server.service(webservices_ttl=3600).session.close()
+        sync_service = self.service(lazy_auth=True)
+        self.server.reset()
+        self.server.expire_sessions()
+
+        async def test():
+            api = AsyncPyiCloudService(sync_service)
+            devices = await api.devices()
+            assert len(list(devices)) == len(self.server.dataset.devices["content"])
+            await api.close()
+
+        asyncio.run(test())
+        assert sync_service.session.auth_generation == 1
+        assert self.server.count("/signin/init") == 1
+
+    def test_request_logging(self):
+        """Test requests are logged redacted and truncated, as by the session."""
+        sync_service = self.service()
+        password = sync_service.user["password"]
+        sync_service.session.payload_log_limit = 100
+        # pylint: disable=protected-access
+        url = sync_service._get_webservice_url("findme")
+        url += "/fmipservice/client/web/refreshClient"
+
+        async def test():
+            api = AsyncPyiCloudService(sync_service)
+            await api.session.post(url, data=json.dumps({"password": password}))
+            await api.close()
+
+        with self.assertLogs(level=logging.DEBUG) as logs:
+            asyncio.run(test())
+        messages = [record.getMessage() for record in logs.records]
+        assert any("refreshClient" in message for message in messages)
+        assert not any(password in message for message in messages)
+        assert max(len(message) for message in messages) < 300
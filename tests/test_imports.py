@@ -0,0 +1,27 @@
+"""Import tests."""
+import subprocess
+import sys
+from unittest import TestCase
+
+
+class LazyImportsTest(TestCase):
+    """Lazy imports tests."""
+
+    def test_services_imported_on_use(self):
+        """Test services and heavy dependencies are imported on first use."""
+        code = (
+            "import sys\n"
+            "from pyicloud.cmdline import main\n"
+            "heavy = ['google.protobuf', 'srp', 'keyring', 'tzlocal',"
+            " 'pyicloud.services.notes']\n"
+            "print(sorted(name for name in heavy if name in sys.modules))\n"
+            "from pyicloud.services import NotesService\n"
+            "print('pyicloud.services.notes' in sys.modules)\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        assert result.stdout.splitlines() == ["[]", "True"]
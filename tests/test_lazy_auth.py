@@ -0,0 +1,127 @@
+"""Deferred authentication tests."""
+import http.cookiejar as cookielib
+import json
+from tempfile import TemporaryDirectory
+import time
+from unittest.mock import patch
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+from pyicloud.base import PyiCloudService
+from pyicloud.session_store import FileSessionStore
+
+from .server import StandInTestCase
+
+WEBSERVICES = {
+    "findme": {"url": "https://p01-fmipweb.icloud.com:443", "status": "active"},
+}
+MOVED_WEBSERVICES = {
+    "findme": {"url": "https://p02-fmipweb.icloud.com:443", "status": "active"},
+}
+ACCOUNT_DATA = {
+    "dsInfo": {"dsid": "1234", "hsaVersion": 2},
+    "hsaTrustedBrowser": True,
+    "webservices": WEBSERVICES,
+}
+
+
+def _response(status_code, data=None):
+    # pylint: disable=protected-access
+    response = Response()
+    response.status_code = status_code
+    response.headers = CaseInsensitiveDict({"Content-Type": "application/json"})
+    response._content = json.dumps(data or {}).encode()
+    response._content_consumed = True
+    return response
+
+
+class LazyAuthTest(StandInTestCase):
+    """Deferred authentication tests."""
+
+    def setUp(self):
+        """Set up tests."""
+        # pylint: disable=consider-using-with
+        self.directory = TemporaryDirectory()
+        self.store = FileSessionStore(self.directory.name)
+        self.addCleanup(self.directory.cleanup)
+        super().setUp()
+
+    def _seed(self, expires):
+        session_data = {
+            "client_id": "auth-1",
+            "session_token": "token",
+            "webservices": {"expires": expires, "data": ACCOUNT_DATA},
+        }
+        self.store.save("usericloudcom", session_data, cookielib.LWPCookieJar())
+
+    def _service(self):
+        return PyiCloudService(
+            "user@icloud.com", "password", session_store=self.store, lazy_auth=True
+        )
+
+    def test_cached_webservices(self):
+        """Test no request is made before the first service request."""
+        self._seed(time.time() + 60)
+        with patch("requests.Session.request") as request:
+            api = self._service()
+            # pylint: disable=protected-access
+            assert api._get_webservice_url("findme") == WEBSERVICES["findme"]["url"]
+            assert api.is_trusted_session
+            assert not api.requires_2fa
+        request.assert_not_called()
+
+    def test_expired_webservices(self):
+        """Test expired webservices are discovered on first use."""
+        self._seed(time.time() - 1)
+        validated = dict(ACCOUNT_DATA, webservices=MOVED_WEBSERVICES)
+        with patch(
+            "requests.Session.request", return_value=_response(200, validated)
+        ) as request:
+            api = self._service()
+            request.assert_not_called()
+            # pylint: disable=protected-access
+            assert api._get_webservice_url("findme") == (
+                MOVED_WEBSERVICES["findme"]["url"]
+            )
+        assert request.call_args[0][1].endswith("/validate")
+
+        api.session.writer.flush()
+        session_data, _ = self.store.load("usericloudcom")
+        assert session_data["webservices"]["data"]["webservices"] == (MOVED_WEBSERVICES)
+
+    def test_revalidate_on_rejection(self):
+        """Test a rejected request validates the session and is retried."""
+        self._seed(time.time() + 60)
+        validated = dict(ACCOUNT_DATA, webservices=MOVED_WEBSERVICES)
+        responses = [
+            _response(421),
+            _response(200, validated),
+            _response(200, {"content": []}),
+        ]
+        with patch("requests.Session.request", side_effect=responses) as request:
+            api = self._service()
+            response = api.session.post(
+                "https://p01-fmipweb.icloud.com:443/fmipservice/client/web/refresh"
+            )
+        assert response.json() == {"content": []}
+        urls = [call[0][1] for call in request.call_args_list]
+        assert urls[1].endswith("/validate")
+        assert urls[2] == (
+            "https://p02-fmipweb.icloud.com:443/fmipservice/client/web/refresh"
+        )
+        assert api.session.revalidate is None
+
+    def test_not_cached_without_lazy_auth(self):
+        """Test the account data is only stored when the cache is used."""
+        self._seed(time.time() + 60)
+        with patch(
+            "requests.Session.request", return_value=_response(200, ACCOUNT_DATA)
+        ):
+            api = PyiCloudService(
+                "user@icloud.com", "password", session_store=self.store
+            )
+            api.session.writer.flush()
+        assert api.webservices_ttl is None
+        session_data, _ = self.store.load("usericloudcom")
+        assert session_data.get("webservices") is None
@@ -0,0 +1,104 @@
+"""Request metrics tests."""
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from requests import PreparedRequest, Response
+
+from pyicloud.base import PyiCloudPasswordFilter, PyiCloudSession
+from pyicloud.metrics import Histogram, SessionMetrics
+from pyicloud.retry import RetryPolicy
+
+
+class HistogramTest(TestCase):
+    """Histogram tests."""
+
+    def test_quantiles(self):
+        """Test quantiles are interpolated within their bucket."""
+        histogram = Histogram(buckets=(1, 2, 4))
+        assert histogram.quantile(0.5) is None
+        for value in [0.5] * 50 + [1.5] * 45 + [3] * 4 + [10]:
+            histogram.observe(value)
+        assert histogram.count == 100
+        assert histogram.quantile(0.5) == 1
+        assert 1 < histogram.quantile(0.95) <= 2
+        assert 2 < histogram.quantile(0.99) <= 4
+        assert histogram.quantile(1) == 4
+
+
+class SessionMetricsTest(TestCase):
+    """Session metrics tests."""
+
+    def test_snapshot(self):
+        """Test metrics are collected per webservice and path."""
+        metrics = SessionMetrics(max_paths=2)
+        metrics.record("drivews", "/retrieveItemDetails", 200, 0.1, 100, 10)
+        metrics.record("drivews", "/retrieveItemDetails", 503, 0.2, 0, 10)
+        metrics.record_retry("drivews", "/retrieveItemDetails")
+        metrics.record("drivews", "/rename", 200, 0.1)
+        metrics.record("drivews", "/trash", None, 0.1)
+
+        snapshot = metrics.snapshot()
+        assert [endpoint["path"] for endpoint in snapshot] == [
+            "/rename",
+            "/retrieveItemDetails",
+            "other",
+        ]
+        details = snapshot[1]
+        assert details["requests"] == 2
+        assert details["statuses"] == {"200": 1, "503": 1}
+        assert details["retries"] == 1
+        assert details["bytes_in"] == 100
+        assert details["bytes_out"] == 20
+        assert 0.05 < details["latency"]["p50"] <= 0.25
+        assert snapshot[2]["statuses"] == {"error": 1}
+
+    def test_prometheus(self):
+        """Test the Prometheus text exposition."""
+        metrics = SessionMetrics(buckets=(0.1, 1))
+        metrics.record("findme", '/path"', 200, 0.5, 10, 5)
+
+        text = metrics.prometheus()
+        labels = 'webservice="findme",path="/path\\""'
+        assert "# TYPE pyicloud_requests_total counter" in text
+        assert 'pyicloud_requests_total{%s,status="200"} 1' % labels in text
+        assert "pyicloud_response_bytes_total{%s} 10" % labels in text
+        duration = "pyicloud_request_duration_seconds"
+        assert '%s_bucket{%s,le="0.1"} 0' % (duration, labels) in text
+        assert '%s_bucket{%s,le="+Inf"} 1' % (duration, labels) in text
+        assert "%s_count{%s} 1" % (duration, labels) in text
+
+    def test_session_metrics(self):
+        """Test the session measures its requests and retries."""
+        service = Mock()
+        service.password_filter = PyiCloudPasswordFilter("secret")
+        service.session_data = {}
+        service._webservices = {  # pylint: disable=protected-access
+            "drivews": {"url": "https://p01-drivews.icloud.com:443"},
+        }
+        metrics = SessionMetrics()
+        session = PyiCloudSession(
+            service,
+            retry_policy=RetryPolicy(backoff_factor=0, sleep=Mock()),
+            metrics=metrics,
+        )
+
+        def response(status_code):
+            response = Response()
+            response.status_code = status_code
+            response.request = PreparedRequest()
+            response.request.body = "{}"
+            response._content = b"ok"  # pylint: disable=protected-access
+            return response
+
+        with patch(
+            "requests.Session.request", side_effect=[response(503), response(200)]
+        ):
+            session.post("https://p01-drivews.icloud.com:443/rename", data="{}")
+
+        (endpoint,) = metrics.snapshot()
+        assert endpoint["webservice"] == "drivews"
+        assert endpoint["path"] == "/rename"
+        assert endpoint["statuses"] == {"200": 1, "503": 1}
+        assert endpoint["retries"] == 1
+        assert endpoint["bytes_in"] == 4
+        assert endpoint["bytes_out"] == 4
@@ -0,0 +1,433 @@
+"""Photos service tests, against the stand-in server."""
+import os
+from tempfile import TemporaryDirectory
+import threading
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+
+from pyicloud import timeouts
+from pyicloud.exceptions import (
+    PyiCloudAPIResponseException,
+    PyiCloudDeadlineExceededException,
+)
+from pyicloud.services.photo_index import PhotoIndex
+from pyicloud.services.photos import _download_name, desired_keys
+
+from .server import StandInTestCase
+from .synthetic import photo_records, synthetic_dataset
+
+
+def mp4_records(seed, index, sizes):
+    """Returns the records of a photo, with MPEG-4 videos."""
+    master, asset = photo_records(seed, index, sizes)
+    if master["fields"]["itemType"]["value"] == "com.apple.quicktime-movie":
+        master["fields"]["itemType"]["value"] = "public.mpeg-4"
+    return master, asset
+
+
+class PhotosDownloadTest(StandInTestCase):
+    """Bulk photo download tests."""
+
+    def setUp(self):
+        """Set up tests."""
+        super().setUp()
+        dataset = synthetic_dataset(photos=40, albums=2, photo_sizes=(1000, 50000))
+        self.start_server(dataset, latency={"content": 0.01})
+        self.api = self.service()
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dest = os.path.join(directory.name, "photos")
+
+    def test_download_all(self):
+        """Test downloading an album, then resuming it."""
+        album = self.api.photos.all
+        album.page_size = 10
+        progress = []
+
+        results = album.download_all(
+            self.dest,
+            workers=8,
+            progress=lambda result, stats: progress.append(stats.done),
+        )
+
+        assert len(results) == 40
+        assert all(result.ok for result in results)
+        assert len(progress) == 40 and progress[-1] == 40
+        assert progress == sorted(progress)
+        assert sorted(os.listdir(self.dest)) == sorted(
+            photo.filename for photo in album.photos
+        )
+        for result in results:
+            assert os.path.getsize(result.path) == result.photo.size == result.size
+
+        self.server.reset()
+        stats = []
+        results = album.download_all(
+            self.dest, progress=lambda result, batch: stats.append(batch)
+        )
+        assert len(results) == 40
+        assert stats[-1].skipped == 40 and stats[-1].bytes == 0
+        assert self.server.count("/B/") == 0
+
+    def test_failed_items_retried(self):
+        """Test failed downloads are retried alone, without failing the batch."""
+        album = self.api.photos.albums["Album 0"]
+        photos = list(album.photos)
+        flaky = photos[1].versions["thumb"]["url"].split("?")[0].split("/")[-2]
+        broken = photos[2].versions["thumb"]["url"].split("?")[0].split("/")[-2]
+        self.server.inject(flaky, 503, count=2)
+        self.server.inject(broken, 404, count=-1)
+
+        with patch("time.sleep"):
+            results = album.download_all(self.dest, "thumb", workers=3, retries=2)
+
+        results = {result.photo.id: result for result in results}
+        assert len(results) == len(photos)
+        assert results[photos[1].id].ok
+        assert not results[photos[2].id].ok
+        assert self.server.count(broken) == 3
+        assert os.path.basename(results[photos[0].id].path).endswith(
+            "_thumb" + os.path.splitext(photos[0].filename)[1]
+        )
+        assert not any(name.endswith(".part") for name in os.listdir(self.dest))
+        assert len(os.listdir(self.dest)) == len(photos) - 1
+
+    def test_download_names(self):
+        """Test ids with base64 separators name files in the destination."""
+        names = set()
+        photos = [
+            Mock(id="AbC/dEf+gH1/2==", filename=None),
+            Mock(id="XyZ/dEf+gH1/2==", filename=None),
+            Mock(id="AbC/dEf+gH1/3==", filename="IMG_0001.JPG"),
+            Mock(id="AbC/dEf+gH1/4==", filename="IMG_0001.JPG"),
+        ]
+        assert [_download_name(photo, "original", names) for photo in photos] == [
+            "AbC_dEf-gH1_2",
+            "XyZ_dEf-gH1_2",
+            "IMG_0001.JPG",
+            "IMG_0001_AbC_dEf-gH1_.JPG",
+        ]
+        assert _download_name(photos[0], "thumb", names) == "AbC_dEf-gH1_2_thumb"
+        assert not any(os.sep in name for name in names)
+
+
+class PhotosSyncTest(StandInTestCase):
+    """Incremental photo library sync tests."""
+
+    def setUp(self):
+        """Set up tests."""
+        super().setUp()
+        self.dataset = synthetic_dataset(photos=250, albums=3)
+        self.start_server(self.dataset)
+
+    def _photos(self):
+        api = self.service()
+        return api.photos
+
+    def _sync(self, photos):
+        """Returns the photos changed and deleted, committing every page."""
+        changed, deleted, deleted_records, records = [], [], [], []
+        full = None
+        for page in photos.sync():
+            full = page.full if full is None else full
+            changed.extend(page.photos)
+            deleted.extend(page.deleted)
+            deleted_records.extend(page.deleted_records)
+            records.extend(page.records)
+            page.commit()
+        return full, changed, deleted, deleted_records, records
+
+    def test_sync(self):
+        """Test a full sync, then syncs of the changes only."""
+        photos = self._photos()
+        full, changed, deleted, deleted_records, records = self._sync(photos)
+        assert full
+        assert len(changed) == 250 and deleted == deleted_records == []
+        assert len(records) == 4
+        assert changed[0].filename.startswith("IMG_0000.")
+
+        self.server.reset()
+        full, changed, deleted, deleted_records, _ = self._sync(photos)
+        assert not full
+        assert (changed, deleted, deleted_records) == ([], [], [])
+        assert self.server.count("/changes/zone") == 1
+
+        master, asset = self.dataset.photos[7]
+        favorite = dict(asset, fields=dict(asset["fields"], isFavorite={"value": 1}))
+        self.dataset.change("PrimarySync", favorite)
+        removed = next(
+            photo
+            for photo in photos.all.photos
+            if photo.id == self.dataset.photos[9][0]["recordName"]
+        )
+        removed.delete()
+        album = self.dataset.albums[1]["recordName"]
+        self.dataset.change("PrimarySync", {"recordName": album, "deleted": True})
+
+        # Synced by another process, from the stored session
+        _, changed, deleted, deleted_records, _ = self._sync(self._photos())
+        assert [photo.id for photo in changed] == [master["recordName"]]
+        assert changed[0].filename.startswith("IMG_0007.")
+        assert deleted == [removed.id]
+        assert deleted_records == [album]
+
+    def test_commit(self):
+        """Test the next sync resumes after the last page committed."""
+        photos = self._photos()
+        pages = photos.sync()
+        first = next(pages)
+        assert first.full and first.photos
+        next(pages)
+
+        # Interrupted before committing the first page
+        assert next(self._photos().sync()).full
+
+        first.commit()
+        resumed = next(self._photos().sync())
+        assert not resumed.full
+        assert resumed.photos[0].id not in {photo.id for photo in first.photos}
+
+    def test_expired_token(self):
+        """Test the whole library is listed again when the token expired."""
+        photos = self._photos()
+        photos.session.service.session_data["photos_sync_token"] = "100000"
+
+        full, changed, _, _, _ = self._sync(photos)
+
+        assert full
+        assert len(changed) == 250
+        assert photos.session.service.session_data["photos_sync_token"] == "504"
+
+
+class PhotoIndexTest(StandInTestCase):
+    """Local photo library index tests."""
+
+    def setUp(self):
+        """Set up tests."""
+        super().setUp()
+        self.dataset = synthetic_dataset(photos=250, albums=3)
+        self.start_server(self.dataset)
+        self.api = self.service()
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.index = PhotoIndex(os.path.join(directory.name, "photos.db"))
+        self.addCleanup(self.index.close)
+
+    def test_sync(self):
+        """Test indexing the library, then its changes."""
+        result = self.index.sync(self.api.photos)
+        assert result == (250, 0, True)
+        assert len(self.index) == 250
+        assert self.index.albums() == ["Album 0", "Album 1", "Album 2"]
+
+        master, asset = self.dataset.photos[7]
+        favorite = dict(asset, fields=dict(asset["fields"], isFavorite={"value": 1}))
+        self.dataset.change("PrimarySync", favorite)
+        deleted = self.dataset.photos[9][0]["recordName"]
+        self.dataset.change("PrimarySync", {"recordName": deleted, "deleted": True})
+        album_id = self.dataset.albums[1]["recordName"]
+        relation = {
+            "recordName": "%s-IN-%s" % (asset["recordName"], album_id),
+            "recordType": "CPLContainerRelation",
+            "fields": {
+                "containerId": {"value": album_id},
+                "itemId": {"value": asset["recordName"]},
+                "isDeleted": {"value": 0},
+            },
+        }
+        self.dataset.change("PrimarySync", relation)
+        self.server.reset()
+
+        result = self.index.sync(self.api.photos)
+        assert result == (1, 1, False)
+        assert self.index.get(deleted) is None
+        assert self.index.get(master["recordName"]).favorite
+        assert len(self.index) == 249
+        assert [photo.id for photo in self.index.query(album="Album 0")] == [
+            master["recordName"]
+        ]
+        assert self.server.count("/records/query") == 0
+
+    def test_query(self):
+        """Test queries answered from the index."""
+        self.index.sync(self.api.photos)
+        photos = list(self.api.photos.all.photos)
+
+        movies = [
+            photo
+            for photo in photos
+            if photo.item_type == "movie" and photo.size >= 2000000
+        ]
+        found = self.index.query(item_type="movie", min_size=2000000)
+        assert [photo.id for photo in found] == [
+            photo.id for photo in sorted(movies, key=lambda photo: photo.asset_date)
+        ]
+        assert self.index.count(item_type="movie", min_size=2000000) == len(movies)
+
+        since = photos[100].asset_date
+        recent = self.index.query(since=since, descending=True, limit=5)
+        assert len(recent) == 5 and recent[0].asset_date == max(
+            photo.asset_date for photo in photos
+        )
+        assert all(photo.asset_date >= since for photo in recent)
+        assert self.index.count(favorite=True) == sum(
+            photo.is_favorite for photo in photos
+        )
+        assert self.index.query(filename=photos[3].filename)[0].id == photos[3].id
+        assert self.index.count(filename="IMG_*.MOV") == self.index.count(
+            item_type="movie"
+        )
+
+        album = self.api.photos.albums["Album 0"]
+        assert self.index.add_album(album) == len(album)
+        assert sorted(photo.id for photo in self.index.query(album="Album 0")) == (
+            sorted(photo.id for photo in album.photos)
+        )
+
+        plan = self.index._connection.execute(  # pylint: disable=protected-access
+            "EXPLAIN QUERY PLAN SELECT * FROM photos "
+            "WHERE item_type = 'movie' AND asset_date >= 0"
+        ).fetchall()
+        assert "photos_type" in plan[0][-1]
+
+        with pytest.raises(TypeError):
+            self.index.query(kind="movie")
+
+    @patch("tests.synthetic.photo_records")
+    def test_reduced_profiles(self, records):
+        """Test listings with fewer fields keep the fields indexed."""
+        records.side_effect = mp4_records
+        self.index.sync(self.api.photos)
+        indexed = self.index.query()
+        assert self.index.count(item_type="movie") > 0
+
+        album = self.api.photos.all
+        assert self.index.add(album.iter_photos(fields="minimal")) == 250
+        assert self.index.query() == indexed
+        assert self.index.add(album.iter_photos(fields=["filenameEnc"])) == 250
+        assert self.index.query() == indexed
+        assert self.index.count(favorite=True) > 0
+        assert self.index.add_album(album) == 250
+        assert self.index.query() == indexed
+
+
+class PhotoFieldsTest(StandInTestCase):
+    """Photo field profile tests."""
+
+    def setUp(self):
+        """Set up tests."""
+        super().setUp()
+        self.start_server(synthetic_dataset(photos=30, albums=1))
+        self.api = self.service()
+
+    def _response_size(self, album, fields):
+        """Lists an album, returns its photos and the bytes received."""
+        sizes = []
+
+        def hook(response, *args, **kwargs):
+            sizes.append(len(response.content))
+
+        self.api.session.hooks["response"].append(hook)
+        try:
+            photos = list(album.iter_photos(fields=fields))
+        finally:
+            self.api.session.hooks["response"].remove(hook)
+        return photos, sum(sizes)
+
+    def test_profiles(self):
+        """Test photos listed with fewer fields degrade gracefully."""
+        album = self.api.photos.all
+        full, full_size = self._response_size(album, None)
+        originals, originals_size = self._response_size(album, "originals")
+        minimal, minimal_size = self._response_size(album, "minimal")
+        assert minimal_size < originals_size < full_size
+
+        for photo, original, small in zip(full, originals, minimal):
+            assert photo.id == original.id == small.id
+            assert photo.filename == original.filename == small.filename
+            assert photo.item_type == original.item_type == small.item_type
+            assert photo.added_date == small.added_date
+            assert photo.size == original.size
+            assert photo.versions["original"] == original.versions["original"]
+            assert list(original.versions) == ["original"]
+            assert small.size is None and small.dimensions == (None, None)
+            assert small.versions == {}
+
+        with patch("tests.synthetic.photo_records", side_effect=mp4_records):
+            movies = [photo.item_type for photo in album.iter_photos(fields=None)]
+            small = [photo.item_type for photo in album.iter_photos(fields="minimal")]
+        assert "movie" in movies and small == movies
+
+        custom = next(album.iter_photos(fields=["filenameEnc"]))
+        assert custom.filename == full[0].filename
+        assert custom.added_date is None and custom.asset_date is None
+        assert custom.item_type is None and custom.is_favorite is None
+
+        album.fields = "minimal"
+        assert next(iter(album)).size is None
+        with pytest.raises(ValueError):
+            next(album.iter_photos(fields="everything"))
+
+    def test_download_originals(self):
+        """Test downloading originals only fetches the original fields."""
+        with TemporaryDirectory() as dest:
+            with patch(
+                "pyicloud.services.photos.desired_keys", wraps=desired_keys
+            ) as keys:
+                results = self.api.photos.all.download_all(dest)
+        assert all(result.ok for result in results) and len(results) == 30
+        assert keys.call_args[0] == ("originals",)
+
+
+class PhotoPrefetchTest(StandInTestCase):
+    """Prefetched photo listing tests."""
+
+    def setUp(self):
+        """Set up tests."""
+        super().setUp()
+        self.start_server(synthetic_dataset(photos=100, albums=0))
+        self.api = self.service()
+        self.album = self.api.photos.all
+        self.album.page_size = 10
+
+    @staticmethod
+    def _prefetching():
+        return [
+            thread
+            for thread in threading.enumerate()
+            if thread.name == "pyicloud-prefetch"
+        ]
+
+    def test_prefetch(self):
+        """Test pages are listed ahead, no further than the prefetch depth."""
+        expected = [photo.id for photo in self.album.photos]
+        assert [photo.id for photo in self.album.iter_photos(prefetch=3)] == expected
+
+        self.server.reset()
+        self.album.prefetch = 2
+        photos = iter(self.album)
+        assert next(photos).id == expected[0]
+        time.sleep(0.3)
+        # The page consumed, two queued and one waiting for room
+        assert self.server.count("/records/query") == 4
+
+        photos.close()
+        time.sleep(0.1)
+        assert not self._prefetching()
+        assert self.server.count("/records/query") == 4
+
+    def test_errors(self):
+        """Test listing errors and deadlines reach the consumer."""
+        self.server.inject("/records/query", 400, count=-1)
+        with pytest.raises(PyiCloudAPIResponseException):
+            list(self.album.iter_photos(prefetch=2))
+        self.server.reset()
+
+        self.server.latency = {"ckdatabasews": 0.05}
+        with pytest.raises(PyiCloudDeadlineExceededException):
+            with timeouts.deadline(0.12):
+                list(self.album.iter_photos(prefetch=2))
+        time.sleep(0.1)
+        assert not self._prefetching()
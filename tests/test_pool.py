@@ -0,0 +1,142 @@
+"""Account pool tests."""
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from pyicloud import timeouts
+from pyicloud.base import PyiCloudPasswordFilter, PyiCloudSession
+from pyicloud.exceptions import PyiCloudDeadlineExceededException
+from pyicloud.pool import PyiCloudPool
+
+from .server import StandInTestCase
+
+
+def _service(apple_id):
+    """Returns a stand-in for an authenticated PyiCloudService."""
+    service = Mock()
+    service.user = {"accountName": apple_id}
+    service.password_filter = PyiCloudPasswordFilter("password")
+    service.session = PyiCloudSession(service)
+    return service
+
+
+class PyiCloudPoolTest(TestCase):
+    """Account pool tests."""
+
+    def setUp(self):
+        """Set up tests."""
+        self.pool = PyiCloudPool(max_workers=4)
+        self.addCleanup(self.pool.close)
+
+    def test_shared_adapter(self):
+        """Test the accounts share their transport adapter."""
+        first = self.pool.add_service(_service("first@icloud.com"))
+        second = self.pool.add_service(_service("second@icloud.com"))
+        assert first.session.get_adapter("https://p01-fmipweb.icloud.com") is (
+            second.session.get_adapter("https://p02-ckdatabasews.icloud.com")
+        )
+        assert self.pool.accounts == ["first@icloud.com", "second@icloud.com"]
+
+    def test_add_authenticates_with_shared_adapter(self):
+        """Test accounts are authenticated once using the shared adapter."""
+        with patch("pyicloud.pool.PyiCloudService") as service_class:
+            service = service_class.return_value
+            service.user = {"accountName": "user@icloud.com"}
+            results = self.pool.add_all({"user@icloud.com": "password"})
+
+        assert results["user@icloud.com"].ok
+        service_class.assert_called_once_with(
+            "user@icloud.com", "password", lazy_auth=True, webservices_ttl=0
+        )
+        service.session.mount.assert_any_call("https://", self.pool.adapter)
+        service.authenticate.assert_called_once_with()
+
+    def test_map_results_and_errors(self):
+        """Test jobs run in parallel and report per account results."""
+        for apple_id in ("ok@icloud.com", "error@icloud.com"):
+            self.pool.add_service(_service(apple_id))
+        threads = set()
+
+        def job(service):
+            threads.add(threading.get_ident())
+            time.sleep(0.05)
+            if service.user["accountName"] == "error@icloud.com":
+                raise ValueError("Throttled")
+            return service.user["accountName"]
+
+        results = self.pool.map(job)
+        assert results["ok@icloud.com"].ok
+        assert results["ok@icloud.com"].result == "ok@icloud.com"
+        assert not results["error@icloud.com"].ok
+        assert isinstance(results["error@icloud.com"].error, ValueError)
+        assert len(threads) == 2
+
+    def test_map_timeout(self):
+        """Test a timeout returns the results of the jobs which finished."""
+        for index in range(6):
+            self.pool.add_service(_service("user%d@icloud.com" % index))
+        started = []
+
+        def job(service):
+            started.append(timeouts.remaining())
+            if service.user["accountName"] != "user0@icloud.com":
+                time.sleep(0.2)
+            return service.user["accountName"]
+
+        results = self.pool.map(job, timeout=0.1)
+
+        assert results["user0@icloud.com"].result == "user0@icloud.com"
+        for index in range(1, 6):
+            result = results["user%d@icloud.com" % index]
+            assert isinstance(result.error, PyiCloudDeadlineExceededException)
+        time.sleep(0.3)
+        # One worker ran two jobs, the jobs left waiting were cancelled
+        assert len(started) == 5
+        assert all(0 < left <= 0.1 for left in started[:4])
+
+    def test_refresh_devices(self):
+        """Test devices are refreshed for each account."""
+        service = self.pool.add_service(_service("user@icloud.com"))
+        results = self.pool.refresh_devices()
+        service.invalidate.assert_called_once_with("devices")
+        assert results["user@icloud.com"].result is service.devices
+
+
+class PyiCloudPoolStandInTest(StandInTestCase):
+    """Account pool tests, against the stand-in server."""
+
+    def setUp(self):
+        """Set up tests."""
+        super().setUp()
+        self.start_server()
+        service_patch = patch(
+            "pyicloud.pool.PyiCloudService", self.server.service_class
+        )
+        service_patch.start()
+        self.addCleanup(service_patch.stop)
+        # Expired session, with webservices cached by a former run
+        self.server.service(webservices_ttl=3600).session.close()
+        self.server.expire_sessions()
+        self.server.reset()
+
+    def _add(self, **kwargs):
+        pool = PyiCloudPool(
+            cookie_directory=self.server._directory  # pylint: disable=W0212
+        )
+        self.addCleanup(pool.close)
+        apple_id = next(iter(self.server.dataset.accounts))
+        return pool.add(apple_id, self.server.dataset.accounts[apple_id], **kwargs)
+
+    def test_add_validates_cached_session(self):
+        """Test an account started from cached webservices is validated."""
+        service = self._add()
+        assert self.server.count("/signin/complete") == 1
+        assert service.session.revalidate is None
+
+    def test_add_lazy(self):
+        """Test an account added with lazy_auth is validated on first use."""
+        service = self._add(lazy_auth=True)
+        assert self.server.requests == []
+        assert len(service.devices.keys()) == 13
+        assert self.server.count("/signin/complete") == 1
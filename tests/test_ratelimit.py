@@ -0,0 +1,91 @@
+"""Rate limiter tests."""
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import pytest
+from requests import Response
+
+from pyicloud.base import PyiCloudPasswordFilter, PyiCloudSession
+from pyicloud.exceptions import PyiCloudDeadlineExceededException
+from pyicloud.ratelimit import FileTokenBucket, RateLimiter, TokenBucket
+from pyicloud.timeouts import deadline
+
+
+class TokenBucketTest(TestCase):
+    """Token bucket tests."""
+
+    @patch("pyicloud.ratelimit.time.monotonic", return_value=100.0)
+    def test_burst_then_rate(self, monotonic):
+        """Test the bucket allows a burst, then spaces requests at its rate."""
+        bucket = TokenBucket(rate=10, capacity=2)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == pytest.approx(0.1)
+        assert bucket.reserve() == pytest.approx(0.2)
+
+        # Refilled at the bucket rate, up to its capacity
+        monotonic.return_value = 100.5
+        assert bucket.reserve() == 0
+        monotonic.return_value = 110.0
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == pytest.approx(0.1)
+
+    @patch("pyicloud.ratelimit.time.monotonic", return_value=100.0)
+    def test_deadline(self, _):
+        """Test tokens available after the deadline are not waited for."""
+        bucket = TokenBucket(rate=0.1, capacity=1)
+        with deadline(5):
+            assert bucket.acquire() == 0
+            with pytest.raises(PyiCloudDeadlineExceededException):
+                bucket.acquire()
+        # Given back
+        assert bucket.reserve() == pytest.approx(10)
+
+    @patch("pyicloud.ratelimit.time.time", return_value=1000.0)
+    def test_file_bucket_shared(self, _):
+        """Test buckets using the same state file share their tokens."""
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ckdatabasews.bucket")
+            first = FileTokenBucket(path, rate=10, capacity=1)
+            second = FileTokenBucket(path, rate=10, capacity=1)
+            assert first.reserve() == 0
+            assert second.reserve() == pytest.approx(0.1)
+
+
+class RateLimiterTest(TestCase):
+    """Rate limiter tests."""
+
+    @patch("pyicloud.ratelimit.time.monotonic", return_value=100.0)
+    def test_rates_per_webservice(self, _):
+        """Test each webservice has its own bucket."""
+        limiter = RateLimiter({"ckdatabasews": (5, 1), "findme": 1})
+        assert limiter.reserve("ckdatabasews") == 0
+        assert limiter.reserve("ckdatabasews") == pytest.approx(0.2)
+        assert limiter.reserve("findme") == 0
+        assert limiter.bucket("drivews") is None
+        assert limiter.reserve("drivews") == 0
+
+        limiter = RateLimiter(default=2)
+        assert limiter.bucket("drivews").rate == 2
+        assert limiter.bucket("drivews") is limiter.bucket("drivews")
+
+    def test_session_rate_limited(self):
+        """Test the session takes a token of the requested webservice."""
+        service = Mock()
+        service.password_filter = PyiCloudPasswordFilter("secret")
+        service.session_data = {}
+        service._webservices = {  # pylint: disable=protected-access
+            "drivews": {"url": "https://p01-drivews.icloud.com:443"},
+        }
+        limiter = Mock()
+        session = PyiCloudSession(service, rate_limiter=limiter)
+
+        response = Response()
+        response.status_code = 200
+        response._content = b""  # pylint: disable=protected-access
+        with patch("requests.Session.request", return_value=response):
+            session.get("https://p01-drivews.icloud.com:443/retrieveItemDetails")
+        limiter.acquire.assert_called_once_with("drivews")
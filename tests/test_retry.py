@@ -0,0 +1,148 @@
+"""Retry policy tests."""
+from datetime import datetime, timezone
+import json
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import pytest
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+from pyicloud.base import PyiCloudPasswordFilter, PyiCloudSession
+from pyicloud.exceptions import PyiCloudAPIResponseException
+from pyicloud.retry import RetryPolicy, parse_retry_after
+from pyicloud.timeouts import deadline
+
+
+def _response(status_code, data=None, headers=None):
+    """Returns a response with a JSON body."""
+    # pylint: disable=protected-access
+    response = Response()
+    response.status_code = status_code
+    response.reason = "Reason %s" % status_code
+    response.headers = CaseInsensitiveDict(headers or {})
+    if data is not None:
+        response.headers["Content-Type"] = "application/json"
+        response._content = json.dumps(data).encode()
+    else:
+        response._content = b""
+    response._content_consumed = True
+    return response
+
+
+class RetryPolicyTest(TestCase):
+    """Retry policy tests."""
+
+    def test_parse_retry_after(self):
+        """Test parsing Retry-After seconds and dates."""
+        now = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        assert parse_retry_after("120") == 120
+        assert parse_retry_after("Fri, 01 Jan 2021 00:00:30 GMT", now) == 30
+        assert parse_retry_after("Thu, 31 Dec 2020 00:00:00 GMT", now) == 0
+        assert parse_retry_after("soon") is None
+        assert parse_retry_after(None) is None
+
+    def test_backoff(self):
+        """Test the backoff is jittered, exponential and capped."""
+        policy = RetryPolicy(backoff_factor=1, max_backoff=5)
+        for _ in range(100):
+            assert 0 <= policy.backoff(0) <= 1
+            assert 0 <= policy.backoff(2) <= 4
+            assert 0 <= policy.backoff(10) <= 5
+        assert policy.delay(0, retry_after=3) == 3
+        assert policy.delay(0, retry_after=36000) == 5
+
+    def test_rules(self):
+        """Test retries allowed per status and error code."""
+        policy = RetryPolicy(max_retries=4, error_code_rules={"THROTTLED": 2})
+        assert policy.retry_limit(status=503) == 4
+        assert policy.retry_limit(status=421) == 1
+        assert policy.retry_limit(status=404) == 0
+        assert policy.retry_limit(status=200, error_code="THROTTLED") == 2
+        assert policy.retry_limit(error_code="ACCESS_DENIED") == 0
+
+    def test_deadline(self):
+        """Test no retry is attempted past the deadline."""
+        retry = RetryPolicy(deadline=5).start()
+        assert not retry.should_retry(status=503, retry_after="10")
+        assert retry.should_retry(status=503, retry_after="1")
+        assert retry.next_delay >= 1
+
+        # Capped, unless the server asks to wait past the deadline
+        retry = RetryPolicy(max_backoff=2, deadline=5).start()
+        assert retry.should_retry(status=503, retry_after="4")
+        assert retry.next_delay <= 2
+        assert not retry.should_retry(status=503, retry_after="36000")
+        with deadline(5):
+            retry = RetryPolicy(max_backoff=2).start()
+            assert not retry.should_retry(status=503, retry_after="36000")
+            assert retry.should_retry(status=503, retry_after="4")
+
+
+class PyiCloudSessionRetryTest(TestCase):
+    """Session retry tests."""
+
+    def setUp(self):
+        """Set up tests."""
+        # pylint: disable=protected-access
+        service = Mock()
+        service.password_filter = PyiCloudPasswordFilter("secret")
+        service.session_data = {}
+        service._webservices = {
+            "ckdatabasews": {"url": "https://p01-ckdatabasews.icloud.com:443"},
+            "findme": {"url": "https://p01-fmipweb.icloud.com:443"},
+        }
+        service._get_webservice_url.side_effect = lambda ws_key: (
+            service._webservices[ws_key]["url"]
+        )
+        self.sleep = Mock()
+        self.session = PyiCloudSession(
+            service, retry_policy=RetryPolicy(max_retries=3, sleep=self.sleep)
+        )
+
+    def test_retry_until_success(self):
+        """Test throttled requests are retried after Retry-After."""
+        responses = [
+            _response(503, headers={"Retry-After": "2"}),
+            _response(429),
+            _response(200, {"ok": True}),
+        ]
+        with patch("requests.Session.request", side_effect=responses) as request:
+            response = self.session.get("https://p01-ckdatabasews.icloud.com/records")
+
+        assert response.json() == {"ok": True}
+        assert request.call_count == 3
+        assert self.sleep.call_count == 2
+        assert self.sleep.call_args_list[0][0][0] >= 2
+
+    def test_retry_error_code(self):
+        """Test errors reported in the body are retried then raised."""
+        throttled = {"errorCode": "ACCESS_DENIED", "reason": "Throttled"}
+        responses = [_response(200, throttled) for _ in range(4)]
+        with patch("requests.Session.request", side_effect=responses) as request:
+            with pytest.raises(PyiCloudAPIResponseException):
+                self.session.get("https://p01-ckdatabasews.icloud.com/records")
+        assert request.call_count == 4
+
+    def test_findme_reauthentication(self):
+        """Test Find My iPhone re-authenticates once on 450."""
+        responses = [_response(450), _response(450)]
+        with patch("requests.Session.request", side_effect=responses) as request:
+            with pytest.raises(PyiCloudAPIResponseException):
+                self.session.post("https://p01-fmipweb.icloud.com:443/refreshClient")
+        assert request.call_count == 2
+        self.session.service.authenticate.assert_called_once_with(True, None)
+
+    def test_policy_per_webservice(self):
+        """Test a webservice policy overrides the default one."""
+        self.session.retry_policies["findme"] = RetryPolicy(max_retries=0)
+        assert self.session.webservice_key("https://p01-fmipweb.icloud.com:443/x") == (
+            "findme"
+        )
+        assert self.session.webservice_key("https://idmsa.apple.com/auth") is None
+
+        with patch("requests.Session.request", return_value=_response(503)) as request:
+            with pytest.raises(PyiCloudAPIResponseException):
+                self.session.post("https://p01-fmipweb.icloud.com:443/refreshClient")
+        assert request.call_count == 1
+        self.sleep.assert_not_called()
@@ -0,0 +1,59 @@
+"""Stand-in server tests."""
+import pytest
+
+from pyicloud.exceptions import PyiCloudFailedLoginException
+from pyicloud.retry import RetryPolicy
+
+from .server import StandInTestCase
+
+
+class StandInServerTest(StandInTestCase):
+    """Stand-in server tests."""
+
+    def setUp(self):
+        """Set up tests."""
+        super().setUp()
+        self.start_server()
+
+    def test_login(self):
+        """Test the client logs in with SRP and uses the webservices."""
+        api = self.service()
+        assert api.is_trusted_session
+        assert api.session_data["session_token"]
+
+        assert len(api.devices.keys()) == 13
+        assert api.account.devices[0].name
+        assert api.drive["pyiCloud"]["Test"]["Scanned document 1.pdf"].open().content
+        assert self.server.count("/signin/complete") == 1
+        # Connections are reused across requests
+        assert self.server.connections < len(self.server.requests)
+
+    def test_wrong_password(self):
+        """Test a wrong password fails the login."""
+        with pytest.raises(PyiCloudFailedLoginException):
+            self.server.service(password="wrong")
+
+    def test_throttling(self):
+        """Test throttled and failed requests are retried."""
+        policy = RetryPolicy(backoff_factor=0)
+        api = self.service(retry_policy=policy)
+        self.server.inject("/refreshClient", body={"serverErrorCode": "ACCESS_DENIED"})
+        assert len(api.devices.keys()) == 13
+        assert self.server.count("/refreshClient") == 2
+
+        self.server.reset()
+        self.server.throttle_every = 2
+        api.devices.refresh_client()
+        api.devices.refresh_client()
+        assert self.server.count("/refreshClient") == 4
+
+    def test_expired_session(self):
+        """Test a session from the cache is validated when it expired."""
+        self.server.service(webservices_ttl=3600).session.writer.close()
+        self.server.expire_sessions()
+
+        api = self.service(lazy_auth=True)
+        assert self.server.count("/validate") == 0
+        assert len(api.devices.keys()) == 13
+        assert self.server.count("/refreshClient") == 2
+        assert self.server.count("/signin/complete") == 2
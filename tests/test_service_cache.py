@@ -0,0 +1,76 @@
+"""Service cache tests."""
+import http.cookiejar as cookielib
+from tempfile import TemporaryDirectory
+import time
+from unittest.mock import patch
+
+from pyicloud.base import PyiCloudService
+from pyicloud.session_store import FileSessionStore
+
+from .server import StandInTestCase
+
+WEBSERVICES = {
+    "ckdatabasews": {"url": "https://p01-ckdatabasews.icloud.com:443"},
+    "findme": {"url": "https://p01-fmipweb.icloud.com:443"},
+}
+
+
+def _new_service(*args):  # pylint: disable=unused-argument
+    return object()
+
+
+class ServiceCacheTest(StandInTestCase):
+    """Service cache tests."""
+
+    def setUp(self):
+        """Set up a service authenticated from cached webservices."""
+        super().setUp()
+        # pylint: disable=consider-using-with
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for target in (
+            patch("pyicloud.services.NotesService", side_effect=_new_service),
+            patch(
+                "pyicloud.services.FindMyiPhoneServiceManager",
+                side_effect=_new_service,
+            ),
+        ):
+            target.start()
+            self.addCleanup(target.stop)
+
+        store = FileSessionStore(directory.name)
+        session_data = {
+            "session_token": "token",
+            "webservices": {
+                "expires": time.time() + 60,
+                "data": {"dsInfo": {}, "webservices": WEBSERVICES},
+            },
+        }
+        store.save("usericloudcom", session_data, cookielib.LWPCookieJar())
+        self.api = PyiCloudService(
+            "user@icloud.com",
+            "password",
+            session_store=store,
+            lazy_auth=True,
+            service_ttls={"devices": 0.05},
+        )
+
+    def test_cached_until_invalidated(self):
+        """Test services are built once, until invalidated."""
+        notes = self.api.notes
+        assert self.api.notes is notes
+        assert self.api.notes is notes
+
+        self.api.invalidate("notes")
+        assert self.api.notes is not notes
+
+        notes = self.api.notes
+        self.api.invalidate()
+        assert self.api.notes is not notes
+
+    def test_cached_until_expired(self):
+        """Test services are built again once their TTL expired."""
+        devices = self.api.devices
+        assert self.api.devices is devices
+        time.sleep(0.06)
+        assert self.api.devices is not devices
@@ -0,0 +1,106 @@
+"""Session tests."""
+
+import logging
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from requests import Response
+
+from pyicloud.base import (
+    LogPayload,
+    PyiCloudPasswordFilter,
+    PyiCloudResponse,
+    PyiCloudSession,
+)
+from pyicloud.session_store import cookie_snapshot
+from pyicloud.utils import json_loads
+
+
+class PyiCloudSessionTest(TestCase):
+    """Session tests."""
+
+    session = None
+
+    def setUp(self):
+        """Set up tests."""
+        service = Mock()
+        service.password_filter = PyiCloudPasswordFilter("secret")
+        service.session_data = {}
+        self.session = PyiCloudSession(service)
+
+    def test_request_logger_charged_to_caller(self):
+        """Test the request logger is resolved from the calling module."""
+        # pylint: disable=protected-access
+        request_logger = self.session._get_request_logger(0)
+        assert request_logger.name == __name__ + ".http"
+        assert self.session.service.password_filter in request_logger.filters
+        assert self.session._get_request_logger(0) is request_logger
+        assert request_logger.filters.count(self.session.service.password_filter) == 1
+
+    def test_json_decoded_once(self):
+        """Test the JSON body is decoded once, by the session."""
+        response = Response()
+        response.status_code = 200
+        response.headers["Content-Type"] = "application/json"
+        response._content = b'{"items": []}'  # pylint: disable=protected-access
+
+        with patch("requests.Session.request", return_value=response):
+            with patch("pyicloud.base.json_loads", wraps=json_loads) as loads:
+                response = self.session.get("https://example.com")
+                assert isinstance(response, PyiCloudResponse)
+                assert response.json() is response.json()
+                assert loads.call_count == 1
+
+    def test_cookies_changed(self):
+        """Test the session is only written for cookies which changed."""
+        writer = self.session.writer
+
+        def send(value):
+            response = Response()
+            response.status_code = 200
+            response._content = b""  # pylint: disable=protected-access
+            response.headers["Set-Cookie"] = "X-APPLE-WEBAUTH-TOKEN=%s" % value
+            response.cookies.set("X-APPLE-WEBAUTH-TOKEN", value, domain="example.com")
+            with patch("requests.Session.request", return_value=response):
+                with patch.object(writer, "mark_dirty") as mark_dirty:
+                    self.session.get("https://example.com")
+            # As written by a flush
+            writer._synced_cookies = cookie_snapshot(  # pylint: disable=W0212
+                response.cookies
+            )
+            return mark_dirty.call_args[1]["cookies"]
+
+        assert send("t1")
+        assert not send("t1")
+        assert send("t2")
+
+    def test_payload_rendered_when_emitted(self):
+        """Test payloads are only rendered by handlers, truncated and redacted."""
+        payload = LogPayload(
+            {"password": "secret", "items": "x" * 100},
+            limit=40,
+            redact=self.session.service.password_filter.redact,
+        )
+        record = logging.LogRecord("test", logging.DEBUG, "", 0, "%s", (payload,), None)
+        with patch.object(LogPayload, "__str__", side_effect=AssertionError):
+            assert self.session.service.password_filter.filter(record)
+
+        message = record.getMessage()
+        assert "secret" not in message
+        assert message.startswith("{'password': '********', 'items': 'xxxx")
+        assert message.endswith("... (137 characters)")
+
+    def test_password_filter(self):
+        """Test the password is redacted from messages and arguments."""
+        password_filter = self.session.service.password_filter
+        record = logging.LogRecord(
+            "test", logging.DEBUG, "", 0, "%s secret %s", ("a secret", 1), None
+        )
+        password_filter.filter(record)
+        assert record.getMessage() == "a ******** ******** 1"
+
+        record = logging.LogRecord(
+            "test", logging.DEBUG, "", 0, {"password": "secret"}, None, None
+        )
+        password_filter.filter(record)
+        assert record.getMessage() == "{'password': '********'}"
@@ -0,0 +1,228 @@
+"""Session store tests."""
+import http.cookiejar as cookielib
+import json
+import os
+from tempfile import TemporaryDirectory
+import time
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from pyicloud.session_store import (
+    FileSessionStore,
+    SessionWriter,
+    SQLiteSessionStore,
+    migrate_sessions,
+)
+
+
+def _cookie(name, value):
+    return cookielib.Cookie(
+        0, name, value, None, False, ".icloud.com", True, True, "/", False,
+        True, None, False, None, None, {},
+    )  # fmt: skip
+
+
+class SessionStoreTestMixin:
+    """Session store tests shared by the store backends."""
+
+    def make_store(self):
+        """Returns the store under test."""
+        raise NotImplementedError
+
+    def make_service(self, store):
+        """Returns a service persisting its session through a writer."""
+        service = Mock()
+        service.account_key = "user"
+        service.session_store = store
+        service.session_data = {}
+        service.session.cookies = cookielib.LWPCookieJar()
+        service.session.writer = SessionWriter(service, flush_interval=0)
+        service.session.writer.load()
+        return service
+
+    def test_merge_instead_of_clobber(self):
+        """Test services sharing an account merge their changes."""
+        store = self.make_store()
+        service1 = self.make_service(store)
+        service2 = self.make_service(store)
+
+        service1.session_data["session_token"] = "token1"
+        service1.session.cookies.set_cookie(_cookie("X-APPLE-WEBAUTH-USER", "u"))
+        service1.session.writer.mark_dirty(session_data=True, cookies=True)
+
+        service2.session_data["scnt"] = "scnt2"
+        service2.session.cookies.set_cookie(_cookie("X-APPLE-WEBAUTH-TOKEN", "t"))
+        service2.session.writer.mark_dirty(session_data=True, cookies=True)
+
+        session_data, cookiejar = store.load("user")
+        assert session_data == {"session_token": "token1", "scnt": "scnt2"}
+        assert sorted(cookie.name for cookie in cookiejar) == [
+            "X-APPLE-WEBAUTH-TOKEN",
+            "X-APPLE-WEBAUTH-USER",
+        ]
+        assert service2.session_data["session_token"] == "token1"
+
+    def test_sync_picks_up_refreshed_session(self):
+        """Test a stale service adopts the session of another one."""
+        store = self.make_store()
+        service1 = self.make_service(store)
+        service1.session_data["session_token"] = "old"
+        service1.session.writer.mark_dirty(session_data=True)
+
+        service2 = self.make_service(store)
+        service2.session_data["session_token"] = "new"
+        service2.session.writer.mark_dirty(session_data=True)
+
+        assert service1.session_data["session_token"] == "old"
+        service1.session.writer.sync()
+        assert service1.session_data["session_token"] == "new"
+
+    def test_sync_keeps_newer_cookies(self):
+        """Test a cookie received while syncing is not replaced by the stored one."""
+        store = self.make_store()
+        service = self.make_service(store)
+        cookies = service.session.cookies
+        update = store.update
+
+        def update_while_receiving(*args):
+            # Another thread receives a newer cookie meanwhile
+            cookies.set_cookie(_cookie("X-APPLE-WEBAUTH-VALIDATE", "new"))
+            return update(*args)
+
+        store.update = update_while_receiving
+        cookies.set_cookie(_cookie("X-APPLE-WEBAUTH-VALIDATE", "old"))
+        service.session.writer.mark_dirty(cookies=True)
+        store.update = update
+
+        assert [cookie.value for cookie in cookies] == ["new"]
+        service.session.writer.mark_dirty(cookies=True)
+        _, cookiejar = store.load("user")
+        assert [cookie.value for cookie in cookiejar] == ["new"]
+
+
+class FileSessionStoreTest(SessionStoreTestMixin, TestCase):
+    """File session store tests."""
+
+    def setUp(self):
+        """Set up tests."""
+        self._tmpdir = TemporaryDirectory()  # pylint: disable=consider-using-with
+
+    def tearDown(self):
+        """Clean up tests."""
+        self._tmpdir.cleanup()
+
+    def make_store(self):
+        """Returns the store under test."""
+        return FileSessionStore(self._tmpdir.name)
+
+    def test_writes_only_when_dirty(self):
+        """Test nothing is written until something changed."""
+        store = self.make_store()
+        service = self.make_service(store)
+        session_path = store.session_path("user")
+        cookiejar_path = store.cookiejar_path("user")
+
+        service.session.writer.mark_dirty()
+        assert not os.path.exists(session_path)
+        assert not os.path.exists(cookiejar_path)
+
+        service.session_data["scnt"] = "abc"
+        service.session.writer.mark_dirty(session_data=True)
+        with open(session_path, encoding="utf-8") as session_f:
+            assert json.load(session_f)["scnt"] == "abc"
+        assert not os.path.exists(cookiejar_path)
+
+        service.session.cookies.set_cookie(_cookie("X-APPLE-WEBAUTH-USER", "u"))
+        service.session.writer.mark_dirty(cookies=True)
+        jar = cookielib.LWPCookieJar()
+        jar.load(cookiejar_path, ignore_discard=True)
+        assert [cookie.name for cookie in jar] == ["X-APPLE-WEBAUTH-USER"]
+        assert sorted(os.listdir(self._tmpdir.name)) == [
+            "user",
+            "user.lock",
+            "user.session",
+        ]
+
+    def test_write_behind(self):
+        """Test changes are held back until the writer is flushed."""
+        store = self.make_store()
+        service = self.make_service(store)
+        writer = service.session.writer = SessionWriter(service, flush_interval=3600)
+
+        service.session_data["scnt"] = "abc"
+        writer.mark_dirty(session_data=True)
+        assert writer.dirty
+        assert not os.path.exists(store.session_path("user"))
+
+        writer.close()
+        assert not writer.dirty
+        with open(store.session_path("user"), encoding="utf-8") as session_f:
+            assert json.load(session_f)["scnt"] == "abc"
+
+    def test_default_write_behind(self):
+        """Test marking changes does not touch the store by default."""
+        store = self.make_store()
+        service = self.make_service(store)
+        writer = service.session.writer = SessionWriter(service)
+
+        service.session.cookies.set_cookie(_cookie("X-APPLE-WEBAUTH-USER", "u"))
+        with patch.object(store, "update", wraps=store.update) as update:
+            writer.mark_dirty(cookies=True)
+            update.assert_not_called()
+            writer.close()
+            update.assert_called_once()
+        assert not writer.dirty
+
+    def test_deferred(self):
+        """Test deferred changes are written by the writer thread."""
+        store = self.make_store()
+        service = self.make_service(store)
+        writer = service.session.writer
+
+        service.session_data["scnt"] = "abc"
+        with patch("pyicloud.session_store.DEFERRED_FLUSH_INTERVAL", 0.01):
+            writer.mark_dirty(session_data=True, defer=True)
+            assert not os.path.exists(store.session_path("user"))
+            for _ in range(100):
+                if os.path.exists(store.session_path("user")):
+                    break
+                time.sleep(0.01)
+        assert not writer.dirty
+        with open(store.session_path("user"), encoding="utf-8") as session_f:
+            assert json.load(session_f)["scnt"] == "abc"
+        writer.close()
+
+
+class SQLiteSessionStoreTest(SessionStoreTestMixin, TestCase):
+    """SQLite session store tests."""
+
+    def setUp(self):
+        """Set up tests."""
+        self._tmpdir = TemporaryDirectory()  # pylint: disable=consider-using-with
+
+    def tearDown(self):
+        """Clean up tests."""
+        self._tmpdir.cleanup()
+
+    def make_store(self):
+        """Returns the store under test."""
+        return SQLiteSessionStore(os.path.join(self._tmpdir.name, "sessions.db"))
+
+    def test_migrate_from_files(self):
+        """Test migrating the session files layout to SQLite."""
+        file_store = FileSessionStore(self._tmpdir.name)
+        service = self.make_service(file_store)
+        service.session_data["session_token"] = "token"
+        service.session.cookies.set_cookie(_cookie("X-APPLE-WEBAUTH-USER", "u"))
+        service.session.writer.mark_dirty(session_data=True, cookies=True)
+
+        store = self.make_store()
+        assert migrate_sessions(file_store, store) == ["user"]
+        assert migrate_sessions(file_store, store) == []
+
+        session_data, cookiejar = store.load("user")
+        assert session_data == {"session_token": "token"}
+        assert [(cookie.name, cookie.value) for cookie in cookiejar] == [
+            ("X-APPLE-WEBAUTH-USER", "u")
+        ]
+        assert store.accounts() == ["user"]
@@ -0,0 +1,58 @@
+"""Synthetic account tests."""
+from .server import StandInTestCase
+from .synthetic import SyntheticPhotos, drive_tree, synthetic_dataset
+
+
+class SyntheticDatasetTest(StandInTestCase):
+    """Synthetic account tests."""
+
+    def test_deterministic(self):
+        """Test the data only depends on the seed."""
+        photos = SyntheticPhotos(200000, seed=1)
+        assert len(photos) == 200000
+        assert photos[123456] == SyntheticPhotos(200000, seed=1)[123456]
+        assert photos[0] != SyntheticPhotos(200000, seed=2)[0]
+        master, asset = photos[199999]
+        assert asset["fields"]["masterRef"]["value"]["recordName"] == (
+            master["recordName"]
+        )
+        assert drive_tree(1, depth=2) == drive_tree(1, depth=2)
+
+    def test_served(self):
+        """Test the client reads a synthetic account from the stand-in."""
+        dataset = synthetic_dataset(
+            photos=250, albums=3, notes=30, note_folders=2, devices=20, seed=3
+        )
+        self.start_server(dataset)
+        api = self.service()
+
+        assert len(api.devices.keys()) == 20
+
+        photos = api.photos.all
+        assert len(photos) == 250
+        assert len(list(photos)) == 250
+        album = api.photos.albums["Album 1"]
+        assert len(album) == len(list(album)) == 63
+        photo = next(iter(album))
+        assert photo.filename.startswith("IMG_0001.")
+        response = photo.download("thumb")
+        assert len(response.content) == photo.versions["thumb"]["size"]
+
+        notes = api.notes.notes
+        assert len(notes) == 30
+        assert notes[0]["fields"]["Text"]["string"]
+        assert len(api.notes.folders[0]["notes"]) == 15
+
+        folder = api.drive["Folder 1"]["Folder 0"]
+        assert folder.dir() == [
+            "File 0.txt",
+            "File 1.txt",
+            "File 2.txt",
+            "File 3.txt",
+            "File 4.txt",
+            "Folder 0",
+            "Folder 1",
+            "Folder 2",
+            "Folder 3",
+        ]
+        assert len(folder["File 0.txt"].open().content) == (folder["File 0.txt"].size)
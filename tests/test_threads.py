@@ -0,0 +1,223 @@
+"""Concurrent session use tests, against the stand-in server."""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+from unittest.mock import patch
+
+from pyicloud.exceptions import PyiCloudFailedLoginException
+from pyicloud.retry import RetryPolicy
+
+from .server import StandInTestCase
+from .synthetic import synthetic_dataset
+
+WORKERS = 32
+JOBS = 400
+
+
+class ThreadSafetyTest(StandInTestCase):
+    """Session shared by worker threads tests."""
+
+    def setUp(self):
+        """Set up tests."""
+        super().setUp()
+        dataset = synthetic_dataset(photos=20, albums=0, drive_depth=2)
+        self.start_server(dataset, throttle_every=7, rotate_tokens=True)
+
+    def _service(self, **kwargs):
+        return self.service(
+            retry_policy=RetryPolicy(max_retries=10, backoff_factor=0), **kwargs
+        )
+
+    def test_concurrent_requests(self):
+        """Test hundreds of concurrent requests sharing one session."""
+        api = self._service()
+        findme_url = api._get_webservice_url("findme")  # pylint: disable=W0212
+        account_url = api._get_webservice_url("account")  # pylint: disable=W0212
+
+        def job(index):
+            kind = index % 4
+            if kind == 0:
+                response = api.session.post(
+                    "%s/fmipservice/client/web/refreshClient" % findme_url,
+                    params=api.params,
+                    data=json.dumps({"clientContext": {"fmly": True}}),
+                )
+                return len(response.json()["content"])
+            if kind == 1:
+                response = api.session.get(
+                    "%s/setup/web/device/getDevices" % account_url, params=api.params
+                )
+                return len(response.json()["devices"])
+            if kind == 2:
+                if index % 40 == 2:
+                    api.invalidate("drive")
+                return len(api.drive.root.dir())
+            return len(api.devices.keys())
+
+        with ThreadPoolExecutor(WORKERS) as executor:
+            results = list(executor.map(job, range(JOBS)))
+
+        expected = [job(index) for index in range(4)]
+        assert results == expected * (JOBS // 4)
+        assert self.server.count("/signin/init") == 1
+
+        # The session saved is the last one received
+        api.session.writer.flush()
+        stored, cookiejar = api.session_store.load(api.account_key)
+        assert stored["scnt"] == api.session_data["scnt"]
+        cookies = {cookie.name: cookie.value for cookie in cookiejar}
+        validate = {cookie.name: cookie.value for cookie in api.session.cookies}
+        assert cookies["X-APPLE-WEBAUTH-VALIDATE"] == (
+            validate["X-APPLE-WEBAUTH-VALIDATE"]
+        )
+
+    def test_concurrent_first_use(self):
+        """Test threads using a service not authenticated yet log in once."""
+        self.server.throttle_every = 0
+        api = self._service(lazy_auth=True, session_flush_interval=0.05)
+
+        with ThreadPoolExecutor(WORKERS) as executor:
+            results = list(
+                executor.map(lambda _: len(api.devices.keys()), range(WORKERS))
+            )
+
+        assert len(set(results)) == 1
+        assert self.server.count("/signin/init") == 1
+        assert self.server.count("/refreshClient") == 1
+
+    def test_lock_not_held_by_slow_work(self):
+        """Test building a service or writing the session leaves the lock free."""
+        # pylint: disable=protected-access
+        api = self._service()
+        started = threading.Event()
+        release = threading.Event()
+        update = api.session_store.update
+
+        def build():
+            started.set()
+            release.wait(5)
+            return "built"
+
+        def slow_update(*args):
+            started.set()
+            release.wait(5)
+            return update(*args)
+
+        with ThreadPoolExecutor(2) as executor:
+            built = executor.submit(api._get_service, "slow", build)
+            assert started.wait(5)
+            assert api.session.lock.acquire(timeout=1)
+            api.session.lock.release()
+            waiting = executor.submit(api._get_service, "slow", lambda: "other")
+            release.set()
+            assert built.result() == waiting.result() == "built"
+
+            started.clear()
+            release.clear()
+            with patch.object(api.session_store, "update", side_effect=slow_update):
+                api.session_data["scnt"] = "changed"
+                written = executor.submit(api.session.writer.sync)
+                assert started.wait(5)
+                assert api.session.lock.acquire(timeout=1)
+                api.session.lock.release()
+                release.set()
+                written.result()
+        assert api.session_store.load(api.account_key)[0]["scnt"] == "changed"
+
+
+class SingleFlightReauthenticationTest(StandInTestCase):
+    """Expired session shared by worker threads tests."""
+
+    def setUp(self):
+        """Set up tests."""
+        super().setUp()
+        self.start_server(latency=0.01)
+
+    def _service(self, **kwargs):
+        return self.service(retry_policy=RetryPolicy(backoff_factor=0), **kwargs)
+
+    def _refresh_all(self, api):
+        """Refreshes Find My from every worker, returns results or errors."""
+        findme_url = api._get_webservice_url("findme")  # pylint: disable=W0212
+
+        def refresh(_):
+            try:
+                response = api.session.post(
+                    "%s/fmipservice/client/web/refreshClient" % findme_url,
+                    params=api.params,
+                    data=json.dumps({"clientContext": {"fmly": True}}),
+                )
+                return len(response.json()["content"])
+            except Exception as error:  # pylint: disable=broad-except
+                return error
+
+        with ThreadPoolExecutor(WORKERS) as executor:
+            return list(executor.map(refresh, range(WORKERS)))
+
+    def test_find_my_reauthenticates_once(self):
+        """Test requests rejected together authenticate the session once."""
+        api = self._service()
+        generation = api.session.auth_generation
+        self.server.reset()
+        self.server.expire_sessions()
+
+        results = self._refresh_all(api)
+
+        assert results == [results[0]] * WORKERS
+        assert isinstance(results[0], int)
+        assert api.session.auth_generation == generation + 1
+        assert self.server.count("/signin/init") == 1
+        assert self.server.count("/signin/complete") == 1
+
+    def test_revalidates_once(self):
+        """Test a session from cached webservices is validated once."""
+        self._service(webservices_ttl=3600).session.close()
+        api = self._service(lazy_auth=True)
+        self.server.reset()
+        self.server.expire_sessions()
+
+        results = self._refresh_all(api)
+
+        assert results == [results[0]] * WORKERS
+        assert isinstance(results[0], int)
+        assert api.session.auth_generation == 1
+        assert self.server.count("/signin/init") == 1
+
+    def test_failure_shared(self):
+        """Test a failed authentication is not attempted again by each request."""
+        api = self._service()
+        self.server.reset()
+        self.server.expire_sessions()
+        self.server.dataset.accounts[api.user["accountName"]] = "changed"
+        self.server._verifiers.clear()  # pylint: disable=protected-access
+
+        results = self._refresh_all(api)
+
+        assert all(
+            isinstance(result, PyiCloudFailedLoginException) for result in results
+        )
+        assert self.server.count("/signin/init") == 1
+
+    def test_recovers_after_failure(self):
+        """Test a request after a failed authentication authenticates again."""
+        api = self._service()
+        apple_id = api.user["accountName"]
+        password = self.server.dataset.accounts[apple_id]
+        self.server.reset()
+        self.server.expire_sessions()
+        self.server.dataset.accounts[apple_id] = "changed"
+        self.server._verifiers.clear()  # pylint: disable=protected-access
+        assert all(
+            isinstance(result, PyiCloudFailedLoginException)
+            for result in self._refresh_all(api)
+        )
+
+        self.server.dataset.accounts[apple_id] = password
+        self.server._verifiers.clear()  # pylint: disable=protected-access
+        self.server.reset()
+
+        results = self._refresh_all(api)
+
+        assert results == [results[0]] * WORKERS
+        assert isinstance(results[0], int)
+        assert self.server.count("/signin/init") == 1
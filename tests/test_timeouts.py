@@ -0,0 +1,130 @@
+"""Timeout and deadline tests."""
+import time
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import pytest
+from requests import ReadTimeout, Response
+
+from pyicloud.base import PyiCloudPasswordFilter, PyiCloudSession
+from pyicloud.exceptions import PyiCloudDeadlineExceededException
+from pyicloud.retry import RetryPolicy
+from pyicloud.timeouts import TimeoutPolicy, deadline, remaining
+
+from .server import StandInTestCase
+from .synthetic import synthetic_dataset
+
+
+def _response(status_code):
+    # pylint: disable=protected-access
+    response = Response()
+    response.status_code = status_code
+    response._content = b""
+    response._content_consumed = True
+    return response
+
+
+class TimeoutPolicyTest(TestCase):
+    """Timeout policy tests."""
+
+    def setUp(self):
+        """Set up tests."""
+        service = Mock()
+        service.password_filter = PyiCloudPasswordFilter("secret")
+        service.session_data = {}
+        service._webservices = {  # pylint: disable=protected-access
+            "docws": {"url": "https://p01-docws.icloud.com:443"},
+            "findme": {"url": "https://p01-fmipweb.icloud.com:443"},
+        }
+        self.policy = TimeoutPolicy(
+            metadata=(5, 20), webservices={"docws": {"download": (3, 600)}}
+        )
+        self.session = PyiCloudSession(
+            service,
+            retry_policy=RetryPolicy(backoff_factor=0.2),
+            timeout_policy=self.policy,
+        )
+
+    def test_timeouts(self):
+        """Test requests get the timeout of their webservice and operation."""
+        with patch("requests.Session.request", return_value=_response(200)) as request:
+            self.session.get("https://p01-docws.icloud.com:443/ws/download")
+            assert request.call_args[1]["timeout"] == (5, 20)
+            self.session.get("https://p01-docws.icloud.com:443/file", stream=True)
+            assert request.call_args[1]["timeout"] == (3, 600)
+            self.session.get("https://cvws.icloud-content.com/file", stream=True)
+            assert request.call_args[1]["timeout"] == (10, 300)
+            self.session.get("https://p01-fmipweb.icloud.com:443/", timeout=1)
+            assert request.call_args[1]["timeout"] == 1
+
+    def test_deadline(self):
+        """Test requests are bounded by the deadline, and not retried past it."""
+        url = "https://p01-fmipweb.icloud.com:443/"
+        with patch("requests.Session.request", return_value=_response(503)) as request:
+            with deadline(0.05):
+                left = remaining()
+                with deadline(10):
+                    assert remaining() <= left
+                with pytest.raises(Exception):
+                    self.session.get(url)
+                connect, read = request.call_args[1]["timeout"]
+                assert connect <= 0.05 and read <= 0.05
+
+                time.sleep(0.05)
+                with pytest.raises(PyiCloudDeadlineExceededException):
+                    self.session.get(url)
+            assert remaining() is None
+
+        with patch("requests.Session.request", side_effect=ReadTimeout()):
+            with deadline(0):
+                with pytest.raises(PyiCloudDeadlineExceededException):
+                    self.session.get(url, timeout=None)
+
+
+class OperationDeadlineTest(StandInTestCase):
+    """Operation deadline tests, against the stand-in server."""
+
+    def setUp(self):
+        """Set up tests."""
+        super().setUp()
+        dataset = synthetic_dataset(photos=50, albums=0, drive_depth=2)
+        self.start_server(dataset)
+        self.api = self.service()
+
+    def test_stalled_read(self):
+        """Test a stalled response times out."""
+        self.api.session.timeout_policy = TimeoutPolicy(metadata=(1, 0.05))
+        self.server.latency = {"findme": 0.5}
+        with pytest.raises(ReadTimeout):
+            self.api.devices  # pylint: disable=pointless-statement
+
+    def test_photos_deadline(self):
+        """Test listing photos stops at the deadline."""
+        album = self.api.photos.all
+        album.page_size = 10
+        assert len(list(album.iter_photos(deadline=5))) == 50
+
+        self.server.latency = {"ckdatabasews": 0.05}
+        photos = album.iter_photos(deadline=0.12)
+        with pytest.raises(PyiCloudDeadlineExceededException):
+            list(photos)
+
+    def test_drive_walk(self):
+        """Test walking the Drive tree, within a deadline."""
+        walked = list(self.api.drive.root.walk(deadline=5))
+        assert len(walked) == 21
+        root, folders, files = walked[0]
+        assert root.name == ""
+        assert [folder.name for folder in folders] == [
+            "Folder 0",
+            "Folder 1",
+            "Folder 2",
+            "Folder 3",
+        ]
+        assert len(files) == 5
+        assert walked[1][0].name == "Folder 0"
+
+        self.api.invalidate("drive")
+        self.server.latency = {"drivews": 0.05}
+        with pytest.raises(PyiCloudDeadlineExceededException):
+            list(self.api.drive.root.walk(deadline=0.12))